@@ -1,16 +1,60 @@
 import logging
 import random
-from typing import List
+import uuid
+from collections import namedtuple
+from typing import Iterator, List
 
 import numpy as np
 import pandas as pd
 import psycopg2
 from pandas import DataFrame
 
-from analysis.player import Player, Team, Match
+from analysis.form import FormEngine
+from analysis.match_filters import buildMatchFilter
+from analysis.player import Team, Match
+from analysis.player_table import MISSING, PlayerTable
+from analysis.position_metrics import METRICS, knownMask, maskedMean, positionMetrics
 
 logging.basicConfig(level=logging.INFO)
 
+# Columnar counterpart of a list of Match objects, row i of every array describes the same match.
+# x holds the features of a feature set, y the result (0 draw, 1 home win, 2 away win) and odds the
+# NUMERIC_ODDS_COLUMNS with NaN where unavailable.
+FeatureArrays = namedtuple('FeatureArrays', ['match_ids', 'game_dates', 'home_ids', 'away_ids', 'x', 'y', 'odds'])
+
+# Feature set : width of x. v0 is [mean rating, points, gd] per team as in Match.aggregateFeatures, v1 is the
+# position metrics (position_metrics.METRICS) followed by points and gd per team.
+FEATURE_SETS = {'v0': 6, 'v1': 2 * (len(METRICS) + 2)}
+
+
+def lineupFeatures(players: PlayerTable, indices: np.ndarray, found: np.ndarray, home_forms: np.ndarray,
+                   away_forms: np.ndarray, feature_set: str = 'v0') -> np.ndarray:
+    """
+    x of a feature set for N matches, from their (N, 22) home then away lineups as PlayerTable row indices and
+    the (N, 2) recent form of each team. Players not found and NULL ratings are left out of the team means.
+    """
+    unrated = int((found & (players.overall_ratings[indices] == MISSING)).sum())
+    if unrated:
+        logging.warning("{} lineup players have no overall rating, left out of their team's features".format(unrated))
+
+    if feature_set == 'v0':
+        ratings = players.overall_ratings[indices].astype(float)
+        rated = knownMask(ratings, found)
+        home_metrics = maskedMean(ratings[:, :11], rated[:, :11])
+        away_metrics = maskedMean(ratings[:, 11:], rated[:, 11:])
+    else:
+        home_metrics = positionMetrics(players, indices[:, :11], found[:, :11])
+        away_metrics = positionMetrics(players, indices[:, 11:], found[:, 11:])
+
+    return np.column_stack([home_metrics, home_forms, away_metrics, away_forms])
+
+
+def concatenateFeatures(batches: List[FeatureArrays]) -> FeatureArrays:
+    """
+    Joins the FeatureArrays of several batches in order
+    """
+    return FeatureArrays(*(np.concatenate(columns) for columns in zip(*batches)))
+
 
 class DatasetBuilder:
     '''
@@ -20,7 +64,7 @@ class DatasetBuilder:
     def __init__(self, address):
         self._conn = self.connectToDB(address)
         self._df: DataFrame
-        self._cachedPlayers = {}
+        self._players = PlayerTable()  # Players of every league read so far
 
     def connectToDB(self, address):
         """
@@ -32,35 +76,39 @@ class DatasetBuilder:
             logging.error("Failed to connect to DB, likely poor internet connection or bad DB address")
             exit(1)
 
+    # Every column of the match table, factory reads the lineups, result and odds from these
+    MATCH_COLUMNS = ['match_id', 'home_id', 'away_id', 'game_date', 'status', 'link'] + \
+                    ['h{}_player_id'.format(i) for i in range(1, 12)] + \
+                    ['a{}_player_id'.format(i) for i in range(1, 12)] + \
+                    ['home_goals', 'away_goals', 'home_max', 'draw_max', 'away_max', 'broker_home_max',
+                     'broker_draw_max', 'broker_away_max', 'market_home_max', 'market_draw_max',
+                     'market_away_max', 'max_over_2_5', 'max_under_2_5']
+
+    HOME_LINEUP_COLUMNS = ['h{}_player_id'.format(i) for i in range(1, 12)]
+    AWAY_LINEUP_COLUMNS = ['a{}_player_id'.format(i) for i in range(1, 12)]
+    ODDS_COLUMNS = ['home_max', 'draw_max', 'away_max', 'broker_home_max', 'broker_draw_max', 'broker_away_max',
+                    'market_home_max', 'market_draw_max', 'market_away_max', 'max_over_2_5', 'max_under_2_5']
+    # ODDS_COLUMNS holding odds, the broker_ columns hold the name of the broker (e.g. 'B365H')
+    NUMERIC_ODDS_COLUMNS = [column for column in ODDS_COLUMNS if not column.startswith('broker_')]
+
     def fetchMatches(self, start_date=None, end_date=None, status=None, league_id=None, home_win=None, away_win=None,
                      draw=None, season=None, league_code=None, players_and_lineups_available=None, odds_available=None):
         """
-        Fetches match data from the database with queried with the optional parameters
+        Fetches match data from the database with queried with the optional parameters.
+        status, league_id, season and league_code also accept lists to select several at once.
         """
+        where_clause, parameters = buildMatchFilter(
+            start_date=start_date, end_date=end_date, status=status, league_id=league_id, home_win=home_win,
+            away_win=away_win, draw=draw, season=season, league_code=league_code,
+            players_and_lineups_available=players_and_lineups_available, odds_available=odds_available)
+
         select_statement = """SELECT *
                             FROM match
                             JOIN club as home ON match.home_id = home.club_id
                             JOIN club as away ON match.away_id = away.club_id
                             JOIN league ON home.league_id = league.league_id
-                    
-                            WHERE (match.game_date >= %(start_date)s OR %(start_date)s IS NULL)
-                              AND (match.game_date <= %(end_date)s OR %(end_date)s IS NULL)
-                              AND (match.status = %(status)s OR %(status)s IS NULL)
-                              AND (league.league_id = %(league_id)s OR %(league_id)s IS NULL)
-                              AND (match.home_goals > match.away_goals OR %(home_win)s IS NULL)
-                              AND (match.home_goals < match.away_goals OR %(away_win)s IS NULL)
-                              AND (match.home_goals = match.away_goals OR %(draw)s IS NULL)
-                              AND (league.season = %(season)s OR %(season)s IS NULL)
-                              AND (league.league = %(league_code)s OR %(league_code)s IS NULL)
-                              AND ((league.players_location IS NOT NULL AND league.match_location IS NOT NULL) 
-                                    OR %(players_and_lineups_available)s IS NULL)
-                              AND (match.home_max IS NOT NULL OR %(odds_available)s IS NULL);"""
-
-        parameters = {'start_date': start_date, 'end_date': end_date, 'status': status,
-                      'league_id': league_id, 'home_win': home_win, 'away_win': away_win,
-                      'draw': draw, 'season': season, 'league_code': league_code,
-                      'players_and_lineups_available': players_and_lineups_available,
-                      'odds_available': odds_available}
+                            {}
+                            ORDER BY match.game_date, match.match_id;""".format(where_clause)
 
         df = pd.read_sql_query(select_statement, self._conn, params=parameters)
         df['game_date'] = pd.to_datetime(df['game_date'])
@@ -69,6 +117,41 @@ class DatasetBuilder:
         df = df.rename(columns=lambda i: name_changes[i].pop(0) if i in name_changes else i)
         self._df = df.loc[:, ~df.columns.duplicated()]
 
+    def streamMatches(self, chunk_size: int = 5000, **filters) -> Iterator[DataFrame]:
+        """
+        Streams the matches selected by the fetchMatches keyword filters as DataFrame batches of chunk_size rows.
+        Only the columns used by factory are selected and rows are read through a named (server-side) cursor,
+        so the joined result never has to be held in memory at once. Batches arrive in game_date order.
+        """
+        where_clause, parameters = buildMatchFilter(**filters)
+
+        select_statement = """SELECT {}, home.club_name AS home_name, away.club_name AS away_name, league.league_id
+                            FROM match
+                            JOIN club as home ON match.home_id = home.club_id
+                            JOIN club as away ON match.away_id = away.club_id
+                            JOIN league ON home.league_id = league.league_id
+                            {}
+                            ORDER BY match.game_date, match.match_id;""".format(
+            ", ".join("match." + column for column in self.MATCH_COLUMNS), where_clause)
+
+        cursor = self._conn.cursor(name="stream_matches_{}".format(uuid.uuid4().hex))
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(select_statement, parameters)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                batch = pd.DataFrame.from_records(rows, columns=[desc[0] for desc in cursor.description],
+                                                  coerce_float=True)
+                batch['game_date'] = pd.to_datetime(batch['game_date'])
+                yield batch
+        finally:
+            cursor.close()
+
+    def getDataframe(self) -> DataFrame:
+        return self._df
+
     def fetchRecentScores(self, club_id, match_date):
         cursor = self._conn.cursor()
         cursor.execute('''SELECT home_id, away_id, home_goals, away_goals
@@ -100,27 +183,31 @@ class DatasetBuilder:
                                 JOIN league ON club.league_id = league.league_id
                                 WHERE league.league_id = %s;'''
         cursor.execute(select_statement, (league_id,))
-        results = cursor.fetchall()
-
-        players = {}
-        for row in results:
-            players[row[0]] = Player(*row)
+        self._players.extend(cursor.fetchall(), league_id)
 
-        self._cachedPlayers[league_id] = players
-
-    def factory(self) -> List[Match]:
+    def factory(self, rows: DataFrame = None) -> List[Match]:
+        """
+        Builds Match objects for rows (all of the fetched dataframe by default). Recent form is always looked up
+        in the fetched dataframe, so rows must be a subset of it.
+        """
         if self._df is None:
             raise Exception("Dataframe has not been created")
 
+        if rows is None:
+            rows = self._df
+
         match_objects = []
 
         column_names = self.fetchColumnNames()
 
-        for match_tuple in self._df.itertuples():
+        # Recent form of both clubs of every row in one pass over the fetched dataframe
+        home_forms, away_forms = FormEngine(self._df).matchForm(rows)
+
+        for position, match_tuple in enumerate(rows.itertuples()):
             #print(match_tuple)
             if all(hasattr(match_tuple, attr) for attr in column_names):
 
-                if match_tuple.league_id not in self._cachedPlayers:
+                if not self._players.hasLeague(match_tuple.league_id):
                     self.fetchPlayers(match_tuple.league_id)
 
                 # HOME TEAM
@@ -131,7 +218,7 @@ class DatasetBuilder:
                                       match_tuple.h7_player_id, match_tuple.h8_player_id, match_tuple.h9_player_id,
                                       match_tuple.h10_player_id, match_tuple.h11_player_id]:
 
-                            home_team.addPlayer(self._cachedPlayers[match_tuple.league_id][player_id])
+                            home_team.addPlayer(self._players.view(player_id, match_tuple.league_id))
 
                     # AWAY TEAM
                     away_team = Team(match_tuple.away_id, match_tuple.away_name)
@@ -140,24 +227,21 @@ class DatasetBuilder:
                                       match_tuple.a4_player_id, match_tuple.a5_player_id, match_tuple.a6_player_id,
                                       match_tuple.a7_player_id, match_tuple.a8_player_id, match_tuple.a9_player_id,
                                       match_tuple.a10_player_id, match_tuple.a11_player_id]:
-                        away_team.addPlayer(self._cachedPlayers[match_tuple.league_id][player_id])
+                        away_team.addPlayer(self._players.view(player_id, match_tuple.league_id))
 
                 except KeyError:
                     logging.warning("No lineup data for {}".format(match_tuple.link))
                     continue
 
-                home_team.calculateRecentForm(self.pdFetchRecentScores(match_tuple.home_id, match_tuple.game_date))
+                home_team.setRecentForm([float(x) for x in home_forms[position]])
                 home_team.calculatePositionMetrics()
 
-                away_team.calculateRecentForm(self.pdFetchRecentScores(match_tuple.away_id, match_tuple.game_date))
+                away_team.setRecentForm([float(x) for x in away_forms[position]])
                 away_team.calculatePositionMetrics()
 
                 # ODDS
                 dict_conversion = dict(match_tuple._asdict())
-                odds = {key: dict_conversion[key] for key in ["home_max", "draw_max", "away_max", "broker_home_max",
-                                                              "broker_draw_max", "broker_away_max", "market_home_max",
-                                                              "market_draw_max",
-                                                              "market_away_max", "max_over_2_5", "max_under_2_5"]
+                odds = {key: dict_conversion[key] for key in self.ODDS_COLUMNS
                         if isinstance(dict_conversion[key], float) if not np.isnan(dict_conversion[key])}
 
                 # MATCH INSTANTIATION
@@ -172,6 +256,92 @@ class DatasetBuilder:
 
         return match_objects
 
+    def columnarFactory(self, rows: DataFrame = None, feature_set: str = 'v0') -> FeatureArrays:
+        """
+        Array counterpart of factory followed by aggregateFeatures/aggregateOddsFeatures, without building any
+        Player, Team or Match objects. Rows are skipped exactly where factory skips them (a lineup player not
+        among the league's players) and also where the result is unknown, as those have no label.
+        feature_set 'v1' replaces each team's mean rating with its position metrics (see FEATURE_SETS).
+        """
+        if self._df is None:
+            raise Exception("Dataframe has not been created")
+        if feature_set not in FEATURE_SETS:
+            raise ValueError("Unknown feature set: {}".format(feature_set))
+
+        if rows is None:
+            rows = self._df
+
+        lineups = rows[self.HOME_LINEUP_COLUMNS + self.AWAY_LINEUP_COLUMNS].to_numpy(dtype=float)  # N x 22
+        league_ids = rows['league_id'].to_numpy()
+
+        indices = np.zeros(lineups.shape, dtype=np.int64)
+        found = np.zeros(lineups.shape, dtype=bool)
+        for league_id in np.unique(league_ids):
+            league_rows = league_ids == league_id
+            indices[league_rows], found[league_rows] = self.lineupIndices(league_id, lineups[league_rows])
+
+        home_goals = rows['home_goals'].to_numpy(dtype=float)
+        away_goals = rows['away_goals'].to_numpy(dtype=float)
+        keep = found.all(axis=1) & ~np.isnan(home_goals) & ~np.isnan(away_goals)
+
+        for link in rows['link'].to_numpy()[~found.all(axis=1)]:
+            logging.warning("No lineup data for {}".format(link))
+
+        home_forms, away_forms = FormEngine(self._df).matchForm(rows)
+
+        x = lineupFeatures(self._players, indices, found, home_forms, away_forms, feature_set)
+        y = np.where(home_goals == away_goals, 0, np.where(home_goals > away_goals, 1, 2))
+
+        return FeatureArrays(match_ids=rows['match_id'].to_numpy()[keep],
+                             game_dates=rows['game_date'].to_numpy(dtype='datetime64[ns]')[keep],
+                             home_ids=rows['home_id'].to_numpy()[keep],
+                             away_ids=rows['away_id'].to_numpy()[keep],
+                             x=x[keep], y=y[keep],
+                             odds=rows[self.NUMERIC_ODDS_COLUMNS].apply(pd.to_numeric, errors='coerce')
+                             .to_numpy(dtype=float)[keep])
+
+    def lineupIndices(self, league_id: int, lineups: np.ndarray):
+        """
+        PlayerTable rows of the player ids in lineups (any shape, NaN for missing ids) among the players of a league,
+        with a mask of the ids that were found
+        """
+        if not self._players.hasLeague(league_id):
+            self.fetchPlayers(league_id)
+
+        return self._players.lookup(lineups, league_id)
+
+    def streamWindows(self, chunk_size: int = 5000, **filters) -> Iterator[DataFrame]:
+        """
+        Yields the streamed batches after setting the fetched dataframe to the batch plus the last month of previous
+        batches, which is all the recent form lookups of the batch need
+        """
+        window = None
+        for batch in self.streamMatches(chunk_size, **filters):
+            if window is None:
+                self._df = batch
+            else:
+                form_start = batch['game_date'].min() - pd.DateOffset(months=1)
+                self._df = pd.concat([window[window['game_date'] > form_start], batch], ignore_index=True)
+
+            yield batch
+            window = self._df
+
+    def streamFactory(self, chunk_size: int = 5000, **filters) -> Iterator[List[Match]]:
+        """
+        Streaming counterpart of fetchMatches followed by factory, yields the Match objects of each batch.
+        Only the last month of previous batches is kept alongside the current batch for the recent form lookups.
+        """
+        for batch in self.streamWindows(chunk_size, **filters):
+            yield self.factory(batch)
+
+    def streamColumnarFactory(self, chunk_size: int = 5000, feature_set: str = 'v0', **filters) -> FeatureArrays:
+        """
+        Streaming counterpart of fetchMatches followed by columnarFactory, the batches are joined in order.
+        None when no match is selected.
+        """
+        batches = [self.columnarFactory(batch, feature_set) for batch in self.streamWindows(chunk_size, **filters)]
+        return concatenateFeatures(batches) if batches else None
+
     def buildDataset_v0(self, match_objects : List[Match], training_split : float):
         features = [x.aggregateFeatures() for x in match_objects]
         random.shuffle(features)
@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis.dataset_builder import FEATURE_SETS, DatasetBuilder, FeatureArrays
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+feature_store.py persists the FeatureArrays of a dataset on disk so training runs do not rebuild every match.
+Each column is a raw binary file of fixed-size rows that new FT matches are appended to, and meta.json records the
+row count, dtypes and shapes. Loading maps the files into memory (np.memmap) instead of reading them.
+Stores are kept per dataset name and feature-set version (a key of FEATURE_SETS), so each version has its own store.
+"""
+
+# Feature set stored by default
+FEATURE_VERSION = 'v0'
+
+DEFAULT_STORE_DIR = os.environ.get('FEATURE_STORE_DIR', 'feature_store')
+
+
+class FeatureStore:
+    '''
+    On-disk FeatureArrays of one dataset (e.g. 'E0') at one feature-set version
+    '''
+
+    META_FILE = 'meta.json'
+    LOOKBACK_MONTHS = 3  # Before the last stored game date, searched for matches not stored yet on updates
+
+    def __init__(self, name: str, root: str = DEFAULT_STORE_DIR, version: str = FEATURE_VERSION):
+        if version not in FEATURE_SETS:
+            raise ValueError("Unknown feature set: {}".format(version))
+        self._name = name
+        self._version = version
+        self._directory = os.path.join(root, name, version)
+
+    def columnPath(self, column: str) -> str:
+        return os.path.join(self._directory, column + '.bin')
+
+    def readMeta(self):
+        """
+        Contents of meta.json, None when the store has not been written yet
+        """
+        path = os.path.join(self._directory, self.META_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as meta_file:
+            return json.load(meta_file)
+
+    def writeMeta(self, meta):
+        path = os.path.join(self._directory, self.META_FILE)
+        with open(path + '.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+        os.replace(path + '.tmp', path)  # meta.json is only ever replaced whole
+
+    def load(self) -> FeatureArrays:
+        """
+        Memory-mapped FeatureArrays of every stored match, None when the store is empty
+        """
+        meta = self.readMeta()
+        if meta is None or not meta['rows']:
+            return None
+
+        columns = {}
+        for column in FeatureArrays._fields:
+            dtype, row_shape = meta['columns'][column]
+            columns[column] = np.memmap(self.columnPath(column), dtype=np.dtype(dtype), mode='r',
+                                        shape=(meta['rows'], *row_shape))
+        return FeatureArrays(**columns)
+
+    def append(self, features: FeatureArrays, filters):
+        """
+        Appends rows to every column file and then records them in meta.json. Bytes past the recorded rows, left by
+        an interrupted append, are truncated first.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        meta = self.readMeta() or {'name': self._name, 'version': self._version, 'rows': 0, 'filters': filters,
+                                   'last_game_date': None,
+                                   'columns': {column: (getattr(features, column).dtype.str,
+                                                        getattr(features, column).shape[1:])
+                                               for column in FeatureArrays._fields}}
+
+        for column in FeatureArrays._fields:
+            row_shape = tuple(meta['columns'][column][1])
+            if getattr(features, column).shape[1:] != row_shape:
+                raise ValueError("Feature store {} holds {} rows of shape {}, not {}, delete {} to rebuild it".format(
+                    self._name, column, row_shape, getattr(features, column).shape[1:], self._directory))
+
+        for column in FeatureArrays._fields:
+            dtype, row_shape = meta['columns'][column]
+            values = np.ascontiguousarray(getattr(features, column), dtype=np.dtype(dtype))
+            row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+            with open(self.columnPath(column), 'ab') as column_file:
+                column_file.truncate(meta['rows'] * row_bytes)
+                column_file.write(values.tobytes())
+
+        meta['rows'] += len(features.match_ids)
+        if len(features.game_dates):
+            last_game_date = str(pd.Timestamp(features.game_dates.max()))
+            meta['last_game_date'] = max(filter(None, [meta['last_game_date'], last_game_date]))
+        self.writeMeta(meta)
+
+    def update(self, builder: DatasetBuilder, **filters) -> FeatureArrays:
+        """
+        Brings the store up to date with the FT matches selected by the fetchMatches keyword filters and returns
+        it loaded. An empty store is built from every match, otherwise the matches of the LOOKBACK_MONTHS before the
+        last stored game date on are fetched (with the month before for recent form) and those not stored yet are
+        appended, so matches completed late (postponed, refreshed lineups) are picked up too.
+        ValueError when the store is still empty, i.e. the filters select no match.
+        """
+        filters = dict(filters, status='FT')
+        stored_filters = json.loads(json.dumps(filters, default=str))  # As they read back from meta.json
+        meta = self.readMeta()
+
+        if meta is None or meta['last_game_date'] is None:
+            logging.info("Building feature store {} {} . . .".format(self._name, self._version))
+            features = builder.streamColumnarFactory(feature_set=self._version, **filters)
+        else:
+            if meta['filters'] != stored_filters:
+                raise ValueError("Feature store {} was built with filters {}".format(self._name, meta['filters']))
+            window_start = pd.Timestamp(meta['last_game_date']) - pd.DateOffset(months=self.LOOKBACK_MONTHS)
+            builder.fetchMatches(**dict(filters, start_date=window_start - pd.DateOffset(months=1)))
+
+            matches = builder.getDataframe()
+            candidates = matches[matches['game_date'] >= window_start]
+            stored = self.load()
+            if stored is not None:
+                candidates = candidates[~np.isin(candidates['match_id'].to_numpy(), stored.match_ids)]
+            features = builder.columnarFactory(candidates, self._version)
+
+        if features is not None and len(features.match_ids):
+            self.append(features, stored_filters)
+        new_matches = len(features.match_ids) if features is not None else 0
+        logging.info("Feature store {} {}: {} new matches".format(self._name, self._version, new_matches))
+
+        stored = self.load()
+        if stored is None:
+            raise ValueError("Feature store {} {} is empty, no FT matches with features were selected by {}".format(
+                self._name, self._version, stored_filters))
+        return stored
@@ -0,0 +1,232 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from pandas import DataFrame
+
+from analysis.dataset_builder import lineupFeatures
+from analysis.form import FormEngine
+from analysis.match_filters import buildMatchFilter
+from analysis.player_table import PlayerTable
+from analysis.predict import OUTCOMES, extractMatchInfo, kellyStake
+from database.queries import QUERY_STATS, PreparedQueries
+from database.squad_cache import SQUAD_CACHE
+from models.registry import MODEL_REGISTRY, ModelRegistry
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+gameweek.py predicts every UPCOMING match of a date range in one batch, where Predict handles a single fixture page.
+The fixture pages are fetched concurrently, lineup names are resolved against the shared squad cache, the players
+of every lineup are read with one query and the recent form of every club with another. Each league's fixtures are
+then scored by its latest registered model in one forward pass and written to the prediction table.
+"""
+
+
+class GameweekPredictor:
+    '''
+    Batch predictions of the upcoming matches in the match table
+    '''
+
+    def __init__(self, address: str, workers: int = 16, kelly: float = 0.5, registry: ModelRegistry = MODEL_REGISTRY):
+        self._conn = self.connectToDB(address)
+        self._queries = PreparedQueries(self._conn)
+        self._workers = workers  # Concurrent page requests
+        self._kelly = kelly
+        self._registry = registry
+
+    def connectToDB(self, address):
+        """
+        Obtain and return a connection object
+        """
+        try:
+            return psycopg2.connect(address)
+        except psycopg2.OperationalError:
+            logging.error("Failed to connect to DB, likely poor internet connection or bad DB address")
+            exit(1)
+
+    def fetchFixtures(self, start_date, end_date, league_code=None) -> DataFrame:
+        """
+        UPCOMING matches from start_date to end_date (inclusive), of the league codes given when not None
+        """
+        where_clause, parameters = buildMatchFilter(status='UPCOMING', start_date=start_date, end_date=end_date,
+                                                    league_code=league_code)
+        select_statement = """SELECT match.match_id, match.link, match.game_date, match.home_id, match.away_id,
+                                     match.home_max, match.draw_max, match.away_max,
+                                     league.league_id, league.league, league.season
+                              FROM match
+                              JOIN club ON match.home_id = club.club_id
+                              JOIN league ON club.league_id = league.league_id
+                              {}
+                              ORDER BY match.game_date, match.match_id;""".format(where_clause)
+
+        fixtures = pd.read_sql_query(select_statement, self._conn, params=parameters)
+        fixtures['game_date'] = pd.to_datetime(fixtures['game_date'])
+        return fixtures
+
+    def fetchPages(self, links) -> List:
+        """
+        match_info of every fixture page (None where it could not be read), requested concurrently
+        """
+        def fetch(link):
+            try:
+                return extractMatchInfo(link)
+            except Exception as e:
+                logging.warning("Failed to read {}: {}".format(link, e))
+                return None
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            return list(executor.map(fetch, links))
+
+    def resolveLineups(self, fixtures: DataFrame, pages: List) -> np.ndarray:
+        """
+        (N, 22) home then away lineup player ids of the fixtures, NaN where the lineup or a name was not resolved.
+        The clubs are known from the match table, so only the names are matched against their squads.
+        """
+        lineups = np.full((len(fixtures), 22), np.nan)
+        for row, (fixture, match_info) in enumerate(zip(fixtures.itertuples(), pages)):
+            if match_info is None or None in match_info['home_lineup'] or None in match_info['away_lineup']:
+                continue
+            squads = SQUAD_CACHE.get(self._queries, fixture.league, fixture.season)
+            for offset, club_id, names in [(0, fixture.home_id, match_info['home_lineup']),
+                                           (11, fixture.away_id, match_info['away_lineup'])]:
+                matches = squads.squadMatcher(club_id).assign(names)
+                lineups[row, offset:offset + 11] = [match.id if match else np.nan for match in matches]
+        return lineups
+
+    def fetchPlayers(self, player_ids) -> PlayerTable:
+        """
+        PlayerTable of the given players, read in one query
+        """
+        rows = self._queries.fetchall('fetch_players', ([int(player_id) for player_id in player_ids],))
+        leagues = {}
+        for row in rows:
+            leagues.setdefault(row[-1], []).append(row[:-1])
+
+        players = PlayerTable()
+        for league_id, league_rows in leagues.items():
+            players.extend(league_rows, league_id)
+        return players
+
+    def fetchForms(self, fixtures: DataFrame):
+        """
+        Recent form of the home and away club of every fixture, from the FT matches of the month before, read in
+        one query
+        """
+        club_ids = np.unique(np.concatenate([fixtures['home_id'].to_numpy(), fixtures['away_id'].to_numpy()]))
+        start_date = (fixtures['game_date'].min() - pd.DateOffset(months=1)).date()
+        end_date = fixtures['game_date'].max().date()
+        rows = self._queries.fetchall('fetch_form_matches', ([int(club_id) for club_id in club_ids], start_date,
+                                                             end_date))
+        matches = pd.DataFrame.from_records(rows, columns=['home_id', 'away_id', 'game_date', 'home_goals',
+                                                           'away_goals'], coerce_float=True)
+        matches['game_date'] = pd.to_datetime(matches['game_date'])
+        return FormEngine(matches).matchForm(fixtures)
+
+    def score(self, fixtures: DataFrame, lineups: np.ndarray) -> DataFrame:
+        """
+        Predictions of the fixtures with complete lineups of known players, one forward pass per league with its
+        latest model
+        """
+        complete = ~np.isnan(lineups).any(axis=1)
+        fixtures, lineups = fixtures[complete].reset_index(drop=True), lineups[complete]
+        if not len(fixtures):
+            return pd.DataFrame()
+
+        # Lineups with players missing from the player table are skipped, as in the training data
+        players = self.fetchPlayers(np.unique(lineups))
+        indices, found = players.lookup(lineups)
+        known = found.all(axis=1)
+        for link in fixtures['link'].to_numpy()[~known]:
+            logging.warning("Lineup players of {} are missing from the player table, not predicted".format(link))
+        fixtures, indices, found = fixtures[known].reset_index(drop=True), indices[known], found[known]
+        if not len(fixtures):
+            return pd.DataFrame()
+        home_forms, away_forms = self.fetchForms(fixtures)
+
+        predictions = []
+        for league in fixtures['league'].unique():
+            rows = (fixtures['league'] == league).to_numpy()
+            try:
+                entry = self._registry.find(league)
+            except FileNotFoundError as e:
+                logging.warning(e)
+                continue
+            x = lineupFeatures(players, indices[rows], found[rows], home_forms[rows], away_forms[rows],
+                               entry.meta['feature_version'])
+            probabilities, outcomes = self._registry.load(league, entry.trained_date).predictBatch(x)
+
+            league_fixtures = fixtures[rows]
+            odds = league_fixtures[['draw_max', 'home_max', 'away_max']].to_numpy(dtype=float)
+            chosen_odds = odds[np.arange(len(outcomes)), outcomes]
+            chosen_probabilities = probabilities[np.arange(len(outcomes)), outcomes]
+            stakes = np.where(np.isnan(chosen_odds), np.nan, kellyStake(chosen_probabilities, chosen_odds, self._kelly))
+
+            predictions.append(pd.DataFrame({
+                'match_id': league_fixtures['match_id'].to_numpy(),
+                'model': "{}-{}".format(league, entry.trained_date),
+                'draw_probability': probabilities[:, 0],
+                'home_probability': probabilities[:, 1],
+                'away_probability': probabilities[:, 2],
+                'outcome': outcomes,
+                'stake': stakes}))
+
+        return pd.concat(predictions, ignore_index=True) if predictions else pd.DataFrame()
+
+    def writePredictions(self, predictions: DataFrame):
+        """
+        Upserts the predictions into the prediction table, one statement per model
+        """
+        for model, rows in predictions.groupby('model'):
+            self._queries.execute('insert_predictions', (
+                model, [int(match_id) for match_id in rows['match_id']],
+                *[[float(value) for value in rows[column]]
+                  for column in ['draw_probability', 'home_probability', 'away_probability']],
+                [int(outcome) for outcome in rows['outcome']],
+                [None if np.isnan(stake) else float(stake) for stake in rows['stake']]))
+        self._queries.commit()
+
+    def run(self, start_date, end_date, league_code=None) -> DataFrame:
+        """
+        Predicts and stores every UPCOMING match from start_date to end_date, returns the predictions
+        """
+        fixtures = self.fetchFixtures(start_date, end_date, league_code)
+        logging.info("Predicting {} upcoming matches . . .".format(len(fixtures)))
+        if not len(fixtures):
+            return pd.DataFrame()
+
+        pages = self.fetchPages(fixtures['link'].tolist())
+        lineups = self.resolveLineups(fixtures, pages)
+        missing = int(np.isnan(lineups).any(axis=1).sum())
+        if missing:
+            logging.warning("{} matches have no complete lineup yet and are not predicted".format(missing))
+
+        predictions = self.score(fixtures, lineups)
+        if len(predictions):
+            self.writePredictions(predictions)
+            for prediction in predictions.itertuples():
+                logging.info("{} {}: {} (stake {:.4f})".format(prediction.model, prediction.match_id,
+                                                              OUTCOMES[prediction.outcome], prediction.stake))
+        return predictions
+
+
+def main():
+    address: str = os.environ.get('DB_ADDRESS')  # Address stored in environment
+    today = pd.Timestamp.now().normalize()
+
+    # TIMER START
+    start = time.time()
+    GameweekPredictor(address).run(today, today + pd.DateOffset(days=7))
+    # TIMER DONE
+    end = time.time()
+    logging.info(str(end - start) + " seconds")
+    logging.info("Query statistics:\n" + QUERY_STATS.report())
+
+
+if __name__ == '__main__':
+    main()
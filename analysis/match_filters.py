@@ -0,0 +1,65 @@
+from typing import Dict, Tuple
+
+"""
+match_filters.py builds the WHERE clause of the DatasetBuilder match queries. Only the filters that were actually
+supplied become predicates, so Postgres can plan each query with the indexes on game_date, status and league instead
+of a generic plan full of (col = x OR x IS NULL) branches.
+"""
+
+# filter name : column compared against the value(s)
+VALUE_FILTERS = {'status': 'match.status',
+                 'league_id': 'league.league_id',
+                 'season': 'league.season',
+                 'league_code': 'league.league'}
+
+# filter name : (column, operator) for bounded ranges
+RANGE_FILTERS = {'start_date': ('match.game_date', '>='),
+                 'end_date': ('match.game_date', '<=')}
+
+# filter name : predicate applied whenever the flag is not None
+FLAG_FILTERS = {'home_win': 'match.home_goals > match.away_goals',
+                'away_win': 'match.home_goals < match.away_goals',
+                'draw': 'match.home_goals = match.away_goals',
+                'players_and_lineups_available': '(league.players_location IS NOT NULL AND '
+                                                 'league.match_location IS NOT NULL)',
+                'odds_available': 'match.home_max IS NOT NULL'}
+
+MATCH_FILTERS = list(RANGE_FILTERS) + list(VALUE_FILTERS) + list(FLAG_FILTERS)
+
+
+def buildMatchFilter(**filters) -> Tuple[str, Dict]:
+    """
+    Returns the WHERE clause (empty when nothing is filtered) and its parameters for the supplied filters.
+    status, league_id, season and league_code also accept a list/tuple/set, matching any of the values.
+    """
+    unknown = set(filters) - set(MATCH_FILTERS)
+    if unknown:
+        raise TypeError("Unknown match filters: {}".format(", ".join(sorted(unknown))))
+
+    predicates = []
+    parameters = {}
+
+    for name, (column, operator) in RANGE_FILTERS.items():
+        if filters.get(name) is not None:
+            predicates.append("{} {} %({})s".format(column, operator, name))
+            parameters[name] = filters[name]
+
+    for name, column in VALUE_FILTERS.items():
+        value = filters.get(name)
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            predicates.append("{} = ANY(%({})s)".format(column, name))
+            parameters[name] = list(value)
+        else:
+            predicates.append("{} = %({})s".format(column, name))
+            parameters[name] = value
+
+    for name, predicate in FLAG_FILTERS.items():
+        if filters.get(name) is not None:
+            predicates.append(predicate)
+
+    if not predicates:
+        return "", parameters
+
+    return "WHERE " + "\n  AND ".join(predicates), parameters
@@ -2,16 +2,25 @@ import logging
 import os
 import random
 import time
-from datetime import datetime
 
-from analysis.dataset_builder import DatasetBuilder
+from analysis.dataset_builder import FEATURE_SETS, DatasetBuilder
+from analysis.feature_store import FeatureStore
+from analysis.parallel_builder import ParallelDatasetBuilder
+from analysis.splitter import DateSplitter
 from models.NeuralNet import NeuralNet
-import matplotlib.pyplot as plt
+from models.registry import MODEL_REGISTRY
 import numpy as np
+import pandas as pd
 
 # Enables Info logging to be displayed on console
 logging.basicConfig(level=logging.INFO)
 
+MAX_EPOCHS = 50
+PATIENCE = 5  # Epochs without a better validation loss before training stops
+TRAINING_SPLIT = 0.9  # Of the training matches, the latest rest validate early stopping
+FINE_TUNE_EPOCHS = 10
+FINE_TUNE_LEARNING_RATE = 1e-4  # A tenth of Adam's default
+
 
 class ModelRunner:
     def __init__(self, address: str = None):
@@ -25,51 +34,158 @@ class ModelRunner:
         return DatasetBuilder(self._address)
 
     def load_v0_NeuralNet(self, model_path):
-        nn = NeuralNet()
-        nn.loadModel(model_path)
-        return nn
-
-    def train_v0_NeuralNet(self):
-        self._builder.fetchMatches(status='FT', players_and_lineups_available=True, league_code='E0')
-        objs = self._builder.factory()
-        x_train, y_train, x_test, y_test = self._builder.buildDataset_v0(objs, 0.75)
-        nn = NeuralNet()
+        return NeuralNet.fromFile(model_path)
+
+    def checkpointPath(self, league: str) -> str:
+        """
+        Checkpoint file of a league's training run, outside the models indexed by the registry
+        """
+        return os.path.join(MODEL_REGISTRY.getDirectory(), 'checkpoints', '{}.h5'.format(league))
+
+    def train_v0_NeuralNet(self, feature_set: str = 'v0', patience: int = PATIENCE):
+        # Features of every FT match persisted on disk, only matches played since the last run are built
+        features = FeatureStore('E0', version=feature_set).update(self._builder, players_and_lineups_available=True,
+                                                                  league_code='E0')
+        # Tested on the latest quarter of the matches, trained on the ones before
+        train, test = DateSplitter(features).splitFraction(0.75)
+        train, validation = DateSplitter(train).splitFraction(TRAINING_SPLIT)
+        nn = NeuralNet(FEATURE_SETS[feature_set])
         nn.compileModel()
-        nn.fitModel(x_train, y_train, 50)
+        nn.fitModel(train.x, train.y, MAX_EPOCHS, validation_data=(validation.x, validation.y), patience=patience,
+                    checkpoint_path=self.checkpointPath('E0'))
 
-        print("MODEL ACCURACY {}%".format(round(nn.evaluateAccuracy(x_test, y_test) * 100, 5)))
+        print("MODEL ACCURACY {}%".format(round(nn.evaluateAccuracy(test.x, test.y) * 100, 5)))
         return nn
 
-    def train_v0_for_predictions(self, save_to=None):
-        self._builder.fetchMatches(status='FT', players_and_lineups_available=True, league_code='E0')
-        objs = self._builder.factory()
-        x_train, y_train, x_test, y_test = self._builder.buildDataset_v0(objs, 1)
+    def train_v0_for_predictions(self, save_to=None, batch_size: int = 32, patience: int = PATIENCE,
+                                 league: str = 'E0'):
+        from models.input_pipeline import featureDataset  # tf.data, only imported for training
+
+        # Features of every FT match persisted on disk, only matches played since the last run are built
+        features = FeatureStore(league).update(self._builder, players_and_lineups_available=True, league_code=league)
+        train, validation = DateSplitter(features).splitFraction(TRAINING_SPLIT)
+
         nn = NeuralNet()
         nn.compileModel()
-        nn.fitModel(x_train, y_train, 50)
+        nn.fitDataset(featureDataset(train, batch_size), MAX_EPOCHS,
+                      validation_dataset=featureDataset(validation, batch_size, shuffle=False), patience=patience,
+                      checkpoint_path=self.checkpointPath(league))
         if save_to:
             nn.saveModel(save_to)
         return nn
 
-    def payout_v0_NeuralNet(self, league, load_path=None):
+    def train_v0_league(self, league: str, feature_set: str = 'v0', batch_size: int = 32, patience: int = PATIENCE,
+                        save: bool = True):
+        """
+        Trains a new model on every FT match of league with early stopping on the latest matches, and saves it to
+        the model registry with its validation accuracy
+        """
+        features = FeatureStore(league, version=feature_set).update(self._builder, players_and_lineups_available=True,
+                                                                    league_code=league)
+        train, validation = DateSplitter(features).splitFraction(TRAINING_SPLIT)
+
+        nn = NeuralNet(FEATURE_SETS[feature_set])
+        nn.compileModel()
+        nn.fitModel(train.x, train.y, MAX_EPOCHS, batch_size, validation_data=(validation.x, validation.y),
+                    patience=patience, checkpoint_path=self.checkpointPath(league))
+        accuracy = nn.evaluateAccuracy(validation.x, validation.y)
+        logging.info("MODEL ACCURACY {}%".format(round(accuracy * 100, 5)))
+
+        if save:
+            self.saveToRegistry(nn, league, feature_set, features, accuracy=accuracy)
+        return nn
+
+    def warm_start_v0(self, league: str, epochs: int = FINE_TUNE_EPOCHS, batch_size: int = 32, patience: int = 2,
+                      save: bool = True):
+        """
+        Fine-tunes the league's latest registered model on the FT matches played since the last match it was
+        trained on, at a low learning rate. Trains a new model when none is registered.
+        """
+        entry = MODEL_REGISTRY.latest(league)
+        if entry is None or entry.h5_path is None:
+            logging.info("No saved {} model to warm start from, training a new one . . .".format(league))
+            return self.train_v0_league(league, batch_size=batch_size, save=save)
+
+        feature_set = entry.meta['feature_version']
+        features = FeatureStore(league, version=feature_set).update(self._builder, players_and_lineups_available=True,
+                                                                    league_code=league)
+        # Models registered without last_game_date were trained on matches before their training date
+        last_game_date = entry.meta.get('last_game_date')
+        cut_date = pd.Timestamp(last_game_date) + pd.DateOffset(days=1) if last_game_date else entry.trained_date
+        _, new = DateSplitter(features).split(cut_date)
+
+        # The latest new matches validate early stopping, as in train_v0_league
+        tune, validation = DateSplitter(new).splitFraction(TRAINING_SPLIT)
+        nn = NeuralNet.fromFile(entry.h5_path)
+        if not len(tune.y) or not len(validation.y):
+            logging.info("{} {} matches since {}, too few to fine-tune, keeping the model".format(len(new.y), league,
+                                                                                               cut_date))
+            return nn
+
+        nn.compileModel(learning_rate=FINE_TUNE_LEARNING_RATE)
+        new_match_accuracy = nn.evaluateAccuracy(new.x, new.y)  # Out of sample for the loaded model
+        logging.info("Accuracy on {} new matches before fine-tuning: {}%".format(len(new.y),
+                                                                                 round(new_match_accuracy * 100, 5)))
+        nn.fitModel(tune.x, tune.y, epochs, batch_size, validation_data=(validation.x, validation.y),
+                    patience=patience, checkpoint_path=self.checkpointPath(league))
+        accuracy = nn.evaluateAccuracy(validation.x, validation.y)
+        logging.info("MODEL ACCURACY {}%".format(round(accuracy * 100, 5)))
+
+        if save:
+            self.saveToRegistry(nn, league, feature_set, features, accuracy=accuracy,
+                                warm_started_from=entry.trained_date, fine_tuned_matches=len(tune.y),
+                                new_match_accuracy=new_match_accuracy)
+        return nn
+
+    def saveToRegistry(self, nn: NeuralNet, league: str, feature_set: str, features, **meta):
+        """
+        Saves a model trained today on features to the model registry, with the metadata warm starts rely on
+        """
+        nn.saveModel(MODEL_REGISTRY.modelPath(league))
+        MODEL_REGISTRY.register(league, feature_version=feature_set, matches=len(features.y),
+                                last_game_date=str(pd.Timestamp(features.game_dates.max()).date()), **meta)
+
+    def train_v0_multi_league(self, league_codes, workers: int = None, feature_set: str = 'v0',
+                              batch_size: int = 256):
+        """
+        Trains on every FT match of several leagues, the dataset is built one league-season per process and fed
+        to the model through tf.data
+        """
+        features = ParallelDatasetBuilder(self._address, workers, feature_set).build(
+            status='FT', players_and_lineups_available=True, league_code=list(league_codes))
+        from models.input_pipeline import featureDataset  # tf.data, only imported for training
+
+        train, test = DateSplitter(features).splitFraction(0.75)
+        nn = NeuralNet(FEATURE_SETS[feature_set])
+        nn.compileModel()
+        nn.fitDataset(featureDataset(train, batch_size), MAX_EPOCHS)
+
+        print("MODEL ACCURACY {}%".format(round(nn.evaluateAccuracy(test.x, test.y) * 100, 5)))
+        return nn
+
+    def payout_v0_NeuralNet(self, league, load_path=None, test_from=None):
+        """
+        Backtests betting on league with Kelly stakes, on the matches from test_from on when given. load_path is a
+        saved .h5 model to backtest, or True for the league's latest registered model.
+        """
+        import matplotlib.pyplot as plt  # Only the backtest plots
+
         # TRAIN MODEL BEFORE 20/21
         if load_path:
-            nn = NeuralNet()
-            nn.loadModel(r"C:\Users\Liam\PycharmProjects\football2\model_files\E1-2021-11-29.h5")
+            nn = NeuralNet.fromFile(MODEL_REGISTRY.find(league).h5_path if load_path is True else load_path)
         else:
             self._builder.fetchMatches(status='FT', players_and_lineups_available=True, league_code="E1",
                                        )#end_date='2021-07-27')
-            objs = self._builder.factory()
+            features = self._builder.columnarFactory()
 
-            x_train, y_train, x_test, y_test = self._builder.buildDataset_v0(objs, 0.9)
+            train, test = DateSplitter(features).splitFraction(0.9)
 
             nn = NeuralNet()
             nn.compileModel()
-            nn.fitModel(x_train, y_train, epochs=50)
-            #nn.saveModel(r"C:/Users/Liam/PycharmProjects/football2/model_files/{}-{}.h5".format(
-            #       league, datetime.now().strftime("%Y-%m-%d")))
+            nn.fitModel(train.x, train.y, epochs=50)
+            #nn.saveModel(MODEL_REGISTRY.modelPath(league))
 
-            logging.info("MODEL ACCURACY {}%".format(round(nn.evaluateAccuracy(x_test, y_test) * 100, 5)))
+            logging.info("MODEL ACCURACY {}%".format(round(nn.evaluateAccuracy(test.x, test.y) * 100, 5)))
 
 
         # GET 20/21 MATCH/ODDS DATA
@@ -77,9 +193,10 @@ class ModelRunner:
         self._builder.fetchMatches(status='FT', players_and_lineups_available=True, league_code=league,
                                    )#season='2122')
 
-        objs = self._builder.factory()
-
-        test_features, test_labels, odds_data = self._builder.buildSeasonTest(objs)
+        season = self._builder.columnarFactory()
+        if test_from:
+            _, season = DateSplitter(season).split(test_from)
+        test_features, test_labels, odds_data = season.x, season.y, season.odds
 
         games_predicted_correctly = 0
         balance = 1000
@@ -92,9 +209,15 @@ class ModelRunner:
 
         balance_series = [balance]
 
-        for feature_vector, label, odds in zip(test_features, test_labels, odds_data):
+        # Score the whole season in one forward pass
+        season_probabilities, season_predictions = nn.predictBatch(test_features)
+
+        for i, (label, odds_row) in enumerate(zip(test_labels, odds_data)):
+            odds = {column: value for column, value in zip(DatasetBuilder.NUMERIC_ODDS_COLUMNS, odds_row)
+                    if not np.isnan(value)}
+
             # Make prediction
-            probabilities, predicted_outcome = nn.predictOutcome(feature_vector)
+            probabilities, predicted_outcome = season_probabilities[i], season_predictions[i:i + 1].copy()
 
             predicted_outcome[0] = random.choice([0,1,2])
 
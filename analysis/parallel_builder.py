@@ -0,0 +1,96 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import pandas as pd
+import psycopg2
+
+from analysis.dataset_builder import DatasetBuilder, FeatureArrays, concatenateFeatures
+from analysis.match_filters import buildMatchFilter
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+parallel_builder.py builds the FeatureArrays of several leagues at once. The work is split by league-season across
+a process pool, each worker process keeps its own DatasetBuilder (DB connection and player table) for every
+league-season it is given, and the results are joined in (league, season) order whatever order they finish in.
+"""
+
+# Set in each worker process by initWorker
+_worker_builder: DatasetBuilder = None
+
+
+def initWorker(address: str):
+    global _worker_builder
+    _worker_builder = DatasetBuilder(address)
+
+
+def buildLeagueSeason(league_id: int, league: str, first_date, last_date, filters, feature_set: str) -> FeatureArrays:
+    """
+    columnarFactory over the matches of one league-season. The league's matches from the month before the season
+    are fetched too, so the recent form is the same as when the whole league is built at once.
+    """
+    _worker_builder.fetchMatches(**dict(filters, league_code=league, start_date=first_date - pd.DateOffset(months=1),
+                                        end_date=last_date))
+    matches = _worker_builder.getDataframe()
+    return _worker_builder.columnarFactory(matches[matches['league_id'] == league_id], feature_set)
+
+
+class ParallelDatasetBuilder:
+    '''
+    Builds FeatureArrays across a process pool, one task per league-season
+    '''
+
+    def __init__(self, address: str, workers: int = None, feature_set: str = 'v0'):
+        self._address = address
+        self._workers = workers or os.cpu_count()
+        self._feature_set = feature_set
+
+    def fetchLeagueSeasons(self, **filters) -> List[Tuple]:
+        """
+        (league_id, league, season, first game date, last game date) of every league-season with matches selected
+        by the fetchMatches keyword filters, ordered by league and season
+        """
+        where_clause, parameters = buildMatchFilter(**filters)
+        select_statement = """SELECT league.league_id, league.league, league.season,
+                                     min(match.game_date), max(match.game_date)
+                              FROM match
+                              JOIN club ON match.home_id = club.club_id
+                              JOIN league ON club.league_id = league.league_id
+                              {}
+                              GROUP BY league.league_id, league.league, league.season
+                              ORDER BY league.league, league.season;""".format(where_clause)
+
+        conn = psycopg2.connect(self._address)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(select_statement, parameters)
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def build(self, **filters) -> FeatureArrays:
+        """
+        FeatureArrays of every match selected by the fetchMatches keyword filters (league_code may be a list), in
+        league, season and then game date order. None when no match is selected.
+        """
+        league_seasons = self.fetchLeagueSeasons(**filters)
+        if not league_seasons:
+            return None
+
+        # The league and date range of each task replace these filters, status and flags still apply
+        task_filters = {name: value for name, value in filters.items()
+                        if name not in ('league_code', 'league_id', 'season', 'start_date', 'end_date')}
+        if any(filters.get(name) is not None for name in ('start_date', 'end_date')):
+            logging.warning("start_date/end_date only select league-seasons, whole seasons are built")
+
+        logging.info("Building {} league-seasons on {} processes . . .".format(len(league_seasons), self._workers))
+        with ProcessPoolExecutor(max_workers=self._workers, initializer=initWorker,
+                                 initargs=(self._address,)) as executor:
+            futures = [executor.submit(buildLeagueSeason, league_id, league, pd.Timestamp(first_date),
+                                       pd.Timestamp(last_date), task_filters, self._feature_set)
+                       for league_id, league, season, first_date, last_date in league_seasons]
+            batches = [future.result() for future in futures]  # Submission order keeps the result deterministic
+
+        return concatenateFeatures(batches)
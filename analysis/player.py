@@ -86,31 +86,17 @@ class Team:
     def getRecentForm(self):
         return self._recent_form
 
+    def setRecentForm(self, recent_form: List):
+        self._recent_form = recent_form
+
     def calculatePositionMetrics(self):
         if not len(self._players):
             logging.warning("Empty lineup in the Team with name: {}".format(self._club_name))
             return None
 
+        # Only the mean rating is used, the position group metrics are computed for whole datasets by
+        # analysis.position_metrics
         lineup = np.array([player.getOverallRating() for player in self._players])
-        defence = np.array([player.getOverallRating() for player in self._players if player.getPosition()
-                            in Team.POSITIONS["DEFENCE"]])
-        midfield = np.array([player.getOverallRating() for player in self._players if player.getPosition()
-                            in Team.POSITIONS["MIDFIELD"]])
-        forward = np.array([player.getOverallRating() for player in self._players if player.getPosition()
-                            in Team.POSITIONS["FORWARD"]])
-
-        value = np.array([player.getValue() for player in self._players])
-
-        totalRating = np.array([player.getTotalRating() for player in self._players])
-        ages = np.array([player.getAge() for player in self._players])
-
-        '''
-        for r in [lineup, defence, midfield, forward]:
-            if not len(r):
-                self._position_ratings.append(0.0)
-            else:
-                self._position_ratings.append(np.mean(r))
-        '''
         self._position_ratings = [np.mean(lineup)]
 
     def calculateRecentForm(self, recent_matches):
@@ -0,0 +1,159 @@
+from typing import List, Tuple
+
+import numpy as np
+
+"""
+player_table.py stores players as a struct of NumPy arrays instead of one Player object per row. Rows are addressed by
+a dense index, and player ids are mapped to indices through a sorted id array, so whole lineups can be looked up
+at once and their ratings gathered with fancy indexing. PlayerView wraps a single row with the getters of Player
+for code that wants objects.
+"""
+
+# sofifa positions, a player's position is stored as its index in this list (-1 when unknown)
+POSITIONS = ['GK', 'RB', 'RWB', 'CB', 'LB', 'LWB', 'CDM', 'LM', 'CM', 'RM', 'CAM', 'LW', 'CF', 'RW', 'ST']
+POSITION_CODES = {position: code for code, position in enumerate(POSITIONS)}
+
+# Integer stand-in for NULL values
+MISSING = -1
+
+
+def positionCode(position: str) -> int:
+    return POSITION_CODES.get(position, MISSING)
+
+
+class PlayerView:
+    '''
+    Read-only Player-like view of one row of a PlayerTable
+    '''
+
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index: int):
+        self._table = table
+        self._index = index
+
+    def getPlayerID(self) -> int:
+        return int(self._table.player_ids[self._index])
+
+    def getName(self) -> str:
+        return self._table.names[self._index]
+
+    def getClubId(self) -> int:
+        return int(self._table.club_ids[self._index])
+
+    def getOverallRating(self) -> int:
+        return int(self._table.overall_ratings[self._index])
+
+    def getPotentialRating(self) -> int:
+        return int(self._table.potential_ratings[self._index])
+
+    def getPosition(self) -> str:
+        code = self._table.positions[self._index]
+        return POSITIONS[code] if code != MISSING else None
+
+    def getAge(self) -> int:
+        return int(self._table.ages[self._index])
+
+    def getValue(self) -> float:
+        return float(self._table.values[self._index])
+
+    def getNationality(self) -> str:
+        return self._table.nationalities[self._index]
+
+    def getTotalRating(self) -> int:
+        return int(self._table.total_ratings[self._index])
+
+
+class PlayerTable:
+    '''
+    Columns of every loaded player, row i of each array is the same player. Rows are appended a league at a time
+    with extend().
+    '''
+
+    # Numeric column : dtype
+    COLUMNS = [('player_ids', np.int64), ('club_ids', np.int32), ('overall_ratings', np.int16),
+               ('potential_ratings', np.int16), ('positions', np.int8), ('ages', np.int16), ('values', np.float64),
+               ('total_ratings', np.int16), ('league_ids', np.int32)]
+
+    def __init__(self):
+        for column, dtype in self.COLUMNS:
+            setattr(self, column, np.zeros(0, dtype=dtype))
+        self.names: List[str] = []
+        self.nationalities: List[str] = []
+        self._sorted_ids = np.zeros(0, dtype=np.int64)  # Player ids in ascending order
+        self._sorted_indices = np.zeros(0, dtype=np.int32)  # Row index of each sorted id
+        self._leagues = set()
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def hasLeague(self, league_id) -> bool:
+        return league_id in self._leagues
+
+    def extend(self, rows, league_id):
+        """
+        Appends the players of one league from rows of (player_id, name, club_id, overall_rating, potential_rating,
+        position, age, value, country, total_rating), the column order of the Player constructor
+        """
+        self._leagues.add(league_id)
+        if not rows:
+            return
+
+        player_id, name, club_id, overall, potential, position, age, value, country, total = zip(*rows)
+
+        def toArray(values, dtype):
+            return np.array([MISSING if x is None else x for x in values], dtype=dtype)
+
+        new_columns = {'player_ids': toArray(player_id, np.int64), 'club_ids': toArray(club_id, np.int32),
+                       'overall_ratings': toArray(overall, np.int16),
+                       'potential_ratings': toArray(potential, np.int16),
+                       'positions': np.array([positionCode(x) for x in position], dtype=np.int8),
+                       'ages': toArray(age, np.int16), 'values': toArray(value, np.float64),
+                       'total_ratings': toArray(total, np.int16),
+                       'league_ids': np.full(len(rows), league_id, dtype=np.int32)}
+        for column, _ in self.COLUMNS:
+            setattr(self, column, np.concatenate([getattr(self, column), new_columns[column]]))
+        self.names += name
+        self.nationalities += country
+
+        order = np.argsort(self.player_ids, kind='stable')
+        self._sorted_ids = self.player_ids[order]
+        self._sorted_indices = order.astype(np.int32)
+
+    def lookup(self, player_ids, league_id=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Row indices of player_ids (an array of any shape, NaN for no player) and a mask of the ids found,
+        restricted to the players of league_id when given. Indices of ids not found are 0.
+        """
+        player_ids = np.asarray(player_ids, dtype=float)
+        if not len(self._sorted_ids):
+            return np.zeros(player_ids.shape, dtype=np.int64), np.zeros(player_ids.shape, dtype=bool)
+
+        positions = np.minimum(np.searchsorted(self._sorted_ids, player_ids), len(self._sorted_ids) - 1)
+        found = self._sorted_ids[positions] == player_ids  # False for NaN
+        indices = np.where(found, self._sorted_indices[positions], 0)
+        if league_id is not None:
+            found &= self.league_ids[indices] == league_id
+        return indices, found
+
+    def index(self, player_id, league_id=None) -> int:
+        """
+        Row index of one player, KeyError when the player is not loaded (for that league)
+        """
+        position = self._sorted_ids.searchsorted(player_id)
+        if position == len(self._sorted_ids) or self._sorted_ids[position] != player_id:
+            raise KeyError(player_id)
+        index = int(self._sorted_indices[position])
+        if league_id is not None and self.league_ids[index] != league_id:
+            raise KeyError(player_id)
+        return index
+
+    def view(self, player_id, league_id=None) -> PlayerView:
+        return PlayerView(self, self.index(player_id, league_id))
+
+    def nbytes(self) -> int:
+        """
+        Bytes held by the numeric columns and the id map (names and nationalities excluded)
+        """
+        return sum(getattr(self, column).nbytes for column, _ in self.COLUMNS) + self._sorted_ids.nbytes + \
+            self._sorted_indices.nbytes
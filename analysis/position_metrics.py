@@ -0,0 +1,61 @@
+import numpy as np
+
+from analysis.player import Team
+from analysis.player_table import MISSING, POSITION_CODES, PlayerTable
+
+"""
+position_metrics.py computes the lineup metrics of every team of a batch of matches at once. Lineups are given as
+row indices into a PlayerTable, so the ratings, values, ages and position codes of all lineups are gathered with
+one fancy index each, and the per-group metrics are masked reductions over those matrices.
+"""
+
+# Position codes of each group of Team.POSITIONS
+GROUP_CODES = {group: np.array([POSITION_CODES[position] for position in positions])
+               for group, positions in Team.POSITIONS.items()}
+
+# Columns of positionMetrics, in order
+METRICS = ['lineup_rating', 'defence_rating', 'midfield_rating', 'forward_rating', 'value_millions',
+           'total_rating', 'age_spread']
+
+
+def maskedMean(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Row means of values over the masked entries, 0 for rows without any
+    """
+    counts = mask.sum(axis=1)
+    sums = np.where(mask, values, 0).sum(axis=1)
+    return np.divide(sums, counts, out=np.zeros(len(values)), where=counts > 0)
+
+
+def knownMask(values: np.ndarray, found: np.ndarray) -> np.ndarray:
+    """
+    found entries whose value is known, NULLs are stored as MISSING
+    """
+    return found & (values != MISSING)
+
+
+def positionMetrics(players: PlayerTable, indices: np.ndarray, found: np.ndarray) -> np.ndarray:
+    """
+    (N, len(METRICS)) metrics of N lineups given as (N, 11) PlayerTable row indices, players not found and NULL
+    values are left out: mean overall rating of the lineup and of its defence, midfield and forward (0 when the
+    group is empty), summed value in millions, mean total rating and standard deviation of the ages
+    """
+    ratings = players.overall_ratings[indices].astype(float)
+    positions = players.positions[indices]
+    ages = players.ages[indices].astype(float)
+    values = players.values[indices]
+    total_ratings = players.total_ratings[indices].astype(float)
+    rated = knownMask(ratings, found)
+
+    columns = [maskedMean(ratings, rated)]
+    for group in ['DEFENCE', 'MIDFIELD', 'FORWARD']:
+        columns.append(maskedMean(ratings, rated & np.isin(positions, GROUP_CODES[group])))
+
+    columns.append(np.where(knownMask(values, found), values, 0).sum(axis=1) / 1e6)
+    columns.append(maskedMean(total_ratings, knownMask(total_ratings, found)))
+
+    aged = knownMask(ages, found)
+    mean_age = maskedMean(ages, aged)
+    columns.append(np.sqrt(maskedMean((ages - mean_age[:, None]) ** 2, aged)))
+
+    return np.column_stack(columns)
@@ -1,29 +1,144 @@
 import os
-import re
 import time
 from datetime import datetime
 import logging
 import random
-from difflib import SequenceMatcher
 
 import psycopg2
 import requests
 from bs4 import BeautifulSoup
 import numpy as np
 
-from analysis.model_runner import ModelRunner
 from analysis.player import Match, Team, Player
+from database.name_matcher import NameMatcher
+from database.player_cache import PLAYER_CACHE
+from database.queries import PreparedQueries
+from database.squad_cache import SQUAD_CACHE
+from models.registry import MODEL_REGISTRY
+
+# Outcome of each model output, in order
+OUTCOMES = ['draw', 'home', 'away']
+
+
+def kellyStake(probability, odds, kelly):
+    """
+    Fraction of the balance to stake on odds with the given win probability, scaled by the kelly fraction
+    """
+    return kelly * (((odds - 1) * probability) - (1 - probability)) / (odds - 1)
+
+
+def requestPage(url: str):
+    '''
+    HTTP GET each fixture page with an alternating user agent.
+    '''
+    user_agent_list = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36",
+        "Mozilla/5.0 (X11; Ubuntu; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2919.83 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2866.71 Safari/537.36",
+        "Mozilla/5.0 (X11; Ubuntu; Linux i686 on x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/53.0.2820.59 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2762.73 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/49.0.2656.18 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 6.2; WOW64) AppleWebKit/537.36 (KHTML like Gecko) Chrome/44.0.2403.155 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.1 Safari/537.36",
+        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.0 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.0 Safari/537.36",
+        "Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2226.0 Safari/537.36"]
+    next_user_agent = random.choice(user_agent_list)
+
+    try:
+        header = {'user-agent': next_user_agent}
+        response = requests.get(url, headers=header)  # Get page
+    except requests.exceptions.ConnectionError as e:
+        logging.warning("Failed to get a response on {}".format(url))
+        return None
+
+    # Some pages are inaccessible due to server, these can be passed but ideally a minimum
+    if response.status_code == 500:
+        logging.warning("Response 500 on {}".format(url))
+        return None
+
+    if response.status_code != 200:
+        raise Exception("RESPONSE {} ON >>> {}".format(response.status_code, url))
+
+    return response
+
+def toSoup(response):
+    """
+    Make sure lxml html parser is installed
+    """
+    return BeautifulSoup(response.text, "lxml")
+
+def extractMatchInfo(link: str):
+    '''
+    Content extraction method for match info and lineups of a soccerway fixture page
+    '''
+    response = requestPage(link)
+    if not response:
+        return None
+
+    soup = toSoup(response)
+    match_info = {}
+
+    match_details = soup.find('div', {'class': 'match-info'})
+    if not match_details:
+        return None
+
+    # DATE
+    date = match_details.find('div', {'class': 'details'}).a.get_text()
+    match_info['game_date'] = datetime.strptime(date, '%d/%m/%Y').strftime("%Y-%m-%d")  # date in postgreSQL format
+
+    # TEAMS
+    match_info["home_team"] = match_details.find('div', {'class': 'container left'}) \
+        .find('a', {'class': 'team-title'}).get_text()
+
+    match_info["away_team"] = match_details.find('div', {'class': 'container right'}) \
+        .find('a', {'class': 'team-title'}).get_text()
+
+    # LINEUPS
+    lineups_containers = soup.find('div', {'class': 'combined-lineups-container'})
+
+    if lineups_containers:
+        home_lineup_box = lineups_containers.find('div', {'class': 'container left'}).table.tbody
+        away_lineup_box = lineups_containers.find('div', {'class': 'container right'}).table.tbody
+
+        # If a full lineup is not provided, ignore the match
+        if len(home_lineup_box.find_all('tr')) < 12 or len(away_lineup_box.find_all('tr')) < 12:
+            return None
+
+        # HOME
+        match_info["home_lineup"] = [player.find('td', {'class': 'player large-link'}).a.get_text()
+                                     for player in home_lineup_box.find_all('tr')[:11]]
+
+        # AWAY
+        match_info["away_lineup"] = [player.find('td', {'class': 'player large-link'}).a.get_text()
+                                     for player in away_lineup_box.find_all('tr')[:11]]
+
+    else:  # If the lineups are not available
+        match_info["home_lineup"] = [None for _ in range(11)]
+        match_info["away_lineup"] = [None for _ in range(11)]
+        logging.warning("Lineups not found! Proceeding with None")
+
+    if all(key in match_info for key in ["home_team", "away_team", "game_date", "home_lineup",
+                                         "away_lineup"]):
+        return match_info
+    else:
+        logging.error("Not all keys present")
 
 
 class Predict:
-    def __init__(self, address, link, league, season, home_max_odds, draw_max_odds, away_max_odds):
+    def __init__(self, address, link, league, season, home_max_odds, draw_max_odds, away_max_odds,
+                 queries: PreparedQueries = None):
         self._address = address
-        self._conn = self.connectToDB(address)
+        # Predictions made together can share one connection and its prepared statements
+        self._queries = queries if queries is not None else PreparedQueries(self.connectToDB(address))
         self._link = link
         self._league = league
         self._season = season
-        self._club_ids = self.fetchClubIds()  # Fetch all clubs and their ids in that league
-        self._player_ids = self.fetchPlayerIds()  # Fetch all players from that league
+        self._squads = SQUAD_CACHE.get(self._queries, league, season)  # Clubs and players shared across predictions
+        self._club_ids = self._squads.club_ids
+        self._player_ids = self._squads.player_ids
+        self._club_matcher = self._squads.clubMatcher()
         self._home_max_odds = home_max_odds
         self._draw_max_odds = draw_max_odds
         self._away_max_odds = away_max_odds
@@ -40,102 +155,13 @@ class Predict:
             exit(1)
 
     def requestPage(self, url: str):
-        '''
-        HTTP GET each fixture page with an alternating user agent.
-        '''
-        user_agent_list = [
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36",
-            "Mozilla/5.0 (X11; Ubuntu; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2919.83 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/54.0.2866.71 Safari/537.36",
-            "Mozilla/5.0 (X11; Ubuntu; Linux i686 on x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/53.0.2820.59 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/52.0.2762.73 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_8_4) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/49.0.2656.18 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 6.2; WOW64) AppleWebKit/537.36 (KHTML like Gecko) Chrome/44.0.2403.155 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36",
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.1 Safari/537.36",
-            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.0 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2227.0 Safari/537.36",
-            "Mozilla/5.0 (Windows NT 6.3; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2226.0 Safari/537.36"]
-        next_user_agent = random.choice(user_agent_list)
-
-        try:
-            header = {'user-agent': next_user_agent}
-            response = requests.get(url, headers=header)  # Get page
-        except requests.exceptions.ConnectionError as e:
-            logging.warning("Failed to get a response on {}".format(url))
-            return None
-
-        # Some pages are inaccessible due to server, these can be passed but ideally a minimum
-        if response.status_code == 500:
-            logging.warning("Response 500 on {}".format(url))
-            return None
-
-        if response.status_code != 200:
-            raise Exception("RESPONSE {} ON >>> {}".format(response.status_code, url))
-
-        return response
+        return requestPage(url)
 
     def toSoup(self, response):
-        """
-        Make sure lxml html parser is installed
-        """
-        return BeautifulSoup(response.text, "lxml")
+        return toSoup(response)
 
     def extractMatchInfo(self):
-        '''
-        Content extraction method for match info and lineups
-        '''
-        response = self.requestPage(self._link)
-        if not response:
-            return None
-
-        soup = self.toSoup(response)
-        match_info = {}
-
-        match_details = soup.find('div', {'class': 'match-info'})
-        if not match_details:
-            return None
-
-        # DATE
-        date = match_details.find('div', {'class': 'details'}).a.get_text()
-        match_info['game_date'] = datetime.strptime(date, '%d/%m/%Y').strftime("%Y-%m-%d")  # date in postgreSQL format
-
-        # TEAMS
-        match_info["home_team"] = match_details.find('div', {'class': 'container left'}) \
-            .find('a', {'class': 'team-title'}).get_text()
-
-        match_info["away_team"] = match_details.find('div', {'class': 'container right'}) \
-            .find('a', {'class': 'team-title'}).get_text()
-
-        # LINEUPS
-        lineups_containers = soup.find('div', {'class': 'combined-lineups-container'})
-
-        if lineups_containers:
-            home_lineup_box = lineups_containers.find('div', {'class': 'container left'}).table.tbody
-            away_lineup_box = lineups_containers.find('div', {'class': 'container right'}).table.tbody
-
-            # If a full lineup is not provided, ignore the match
-            if len(home_lineup_box.find_all('tr')) < 12 or len(away_lineup_box.find_all('tr')) < 12:
-                return None
-
-            # HOME
-            match_info["home_lineup"] = [player.find('td', {'class': 'player large-link'}).a.get_text()
-                                         for player in home_lineup_box.find_all('tr')[:11]]
-
-            # AWAY
-            match_info["away_lineup"] = [player.find('td', {'class': 'player large-link'}).a.get_text()
-                                         for player in away_lineup_box.find_all('tr')[:11]]
-
-        else:  # If the lineups are not available
-            match_info["home_lineup"] = [None for _ in range(11)]
-            match_info["away_lineup"] = [None for _ in range(11)]
-            logging.warning("Lineups not found! Proceeding with None")
-
-        if all(key in match_info for key in ["home_team", "away_team", "game_date", "home_lineup",
-                                             "away_lineup"]):
-            return match_info
-        else:
-            logging.error("Not all keys present")
+        return extractMatchInfo(self._link)
 
     def extractLineups(self, match_info):
         if not len(self._club_ids):  # No club ids
@@ -146,150 +172,103 @@ class Predict:
             match_info["home_id"] = self._club_ids[match_info["home_team"]]
         else:
             # If the home_id can't be matched use string similarity
-            match_info["home_id"] = self.searchSimilar(self._club_ids, match_info["home_team"])
+            match_info["home_id"] = self.searchSimilar(self._club_matcher, match_info["home_team"])
 
         if match_info["away_team"] in self._club_ids:
             match_info["away_id"] = self._club_ids[match_info["away_team"]]
         else:
-            match_info["away_id"] = self.searchSimilar(self._club_ids, match_info["away_team"])
+            match_info["away_id"] = self.searchSimilar(self._club_matcher, match_info["away_team"])
 
-        # HOME
-        home_squad_ids = dict(self._player_ids[match_info["home_id"]])
-        home_lineup_ids = []
-
-        for h_name in match_info["home_lineup"]:
-            if h_name is None:  # If lineup not available
-                home_lineup_ids.append(None)
-            elif h_name in home_squad_ids:
-                home_lineup_ids.append(home_squad_ids[h_name])
-            else:
-                # If the h_name can't be matched use string similarity
-                home_lineup_ids.append(self.searchSimilar(home_squad_ids, h_name))
+        # Exact names first, then one similarity matrix per lineup assigned one-to-one
+        home_matcher = self._squads.squadMatcher(match_info["home_id"])
+        home_lineup_ids = [match.id if match else None for match in home_matcher.assign(match_info["home_lineup"])]
 
-        # AWAY
-        away_squad_ids = dict(self._player_ids[match_info["away_id"]])
-        away_lineup_ids = []
-
-        for a_name in match_info["away_lineup"]:
-            if a_name is None:  # If lineup not available
-                away_lineup_ids.append(None)
-            elif a_name in away_squad_ids:
-                away_lineup_ids.append(away_squad_ids[a_name])
-            else:
-                away_lineup_ids.append(self.searchSimilar(away_squad_ids, a_name))
+        away_matcher = self._squads.squadMatcher(match_info["away_id"])
+        away_lineup_ids = [match.id if match else None for match in away_matcher.assign(match_info["away_lineup"])]
 
         match_info["home_lineup_ids"] = home_lineup_ids
         match_info["away_lineup_ids"] = away_lineup_ids
         return match_info
 
-    def searchSimilar(self, name_ids_dict, name):
+    def searchSimilar(self, matcher: NameMatcher, name):
         """
-        Finds the most similar string to name in name_ids_dict
+        Finds the id of the most similar name indexed by matcher
         """
-        closest = ("", 0.0)
-        for key in name_ids_dict:
-            similarity = SequenceMatcher(None, key, name).ratio()
-            if closest[1] < similarity:
-                closest = (key, similarity)
-        return name_ids_dict[closest[0]]
-
-    def fetchClubIds(self):
-        cursor = self._conn.cursor()
-
-        select_statement = '''SELECT club_name, club_id 
-                              FROM club 
-                              JOIN league ON league.league_id=club.league_id 
-                              WHERE league.league='{}' AND league.season='{}';'''.format(self._league, self._season)
-        cursor.execute(select_statement)
+        return matcher.resolve(name)
 
-        return dict(cursor.fetchall())
+    def fetchRecentScores(self, club_id, match_date):
+        return self._queries.fetchall('fetch_recent_scores', (club_id, match_date))
 
-    def fetchPlayerIds(self):
+    def fetchClubsRecentScores(self, club_ids, match_date):
         """
-        Select every player in a given league and group by the club in a dictionary
+        fetchRecentScores of several clubs in one query, as a dict of club_id : scores
         """
-        cursor = self._conn.cursor()
-
-        select_statement = '''SELECT club.club_id, player.name, player.player_id FROM player
-                                JOIN club ON player.club_id=club.club_id
-                                JOIN league ON league.league_id=club.league_id
-                                WHERE league.season='{}' AND league.league='{}';
-                            '''.format(self._season, self._league)
-        cursor.execute(select_statement)
-
-        query_result_set = cursor.fetchall()
+        scores = self._queries.fetchall('fetch_clubs_recent_scores', ([int(club_id) for club_id in club_ids],
+                                                                      match_date))
+        return {club_id: [row for row in scores if club_id in (row[0], row[1])] for club_id in club_ids}
 
-        club_player_ids = {}
-        for club_id, player_name, player_id in query_result_set:
-            if club_id in club_player_ids:
-                club_player_ids[club_id].append((player_name, player_id))
-            else:
-                club_player_ids[club_id] = [(player_name, player_id)]
-
-        return club_player_ids
-
-    def fetchRecentScores(self, club_id, match_date):
-        cursor = self._conn.cursor()
-        cursor.execute('''SELECT home_id, away_id, home_goals, away_goals
-                          FROM match
-                          WHERE (home_id = %(club_id)s OR away_id = %(club_id)s) AND
-                           game_date >= date_trunc('day', %(match_date)s::timestamp - interval '1' month)
-                        and game_date < date_trunc('day', %(match_date)s::timestamp)''',
-                       {'club_id': club_id, 'match_date': match_date})
-
-        return cursor.fetchall()
+    def fetchPlayers(self, player_ids):
+        """
+        Player of every id that exists, from the shared player cache with one query for the ones not cached
+        """
+        return {player_id: Player(*row) for player_id, row in PLAYER_CACHE.get(self._queries, player_ids).items()}
 
     def fetchPlayer(self, player_id: int):
-        cursor = self._conn.cursor()
-        select_statement = '''SELECT player_id, name, player.club_id, overall_rating, potential_rating,
-                                position, age, value, country, total_rating FROM player
-                                WHERE player.player_id=%s'''
-        cursor.execute(select_statement, (player_id,))
-        results = cursor.fetchone()
-        return Player(*results)
+        return self.fetchPlayers([player_id])[player_id]
 
     def factory(self, match_info_with_ids):
         home_obj = Team(match_info_with_ids["home_id"], match_info_with_ids["home_team"])
         away_obj = Team(match_info_with_ids["away_id"], match_info_with_ids["away_team"])
-        for home_p_id, away_p_id in zip(match_info_with_ids["home_lineup_ids"], match_info_with_ids["away_lineup_ids"]):
-            home_obj.addPlayer(self.fetchPlayer(home_p_id))
-            away_obj.addPlayer(self.fetchPlayer(away_p_id))
 
-        home_obj.calculateRecentForm(
-            self.fetchRecentScores(match_info_with_ids["home_id"], match_info_with_ids["game_date"]))
+        # Both lineups in one round trip (or none when cached), then both clubs' recent scores in another
+        players = self.fetchPlayers(match_info_with_ids["home_lineup_ids"] + match_info_with_ids["away_lineup_ids"])
+        for team, lineup_ids in [(home_obj, match_info_with_ids["home_lineup_ids"]),
+                                 (away_obj, match_info_with_ids["away_lineup_ids"])]:
+            for player_id in lineup_ids:
+                if player_id in players:
+                    team.addPlayer(players[player_id])
+                else:
+                    logging.warning("Player {} not found, left out of {}".format(player_id, team.getClubName()))
+
+        recent_scores = self.fetchClubsRecentScores([match_info_with_ids["home_id"], match_info_with_ids["away_id"]],
+                                                    match_info_with_ids["game_date"])
+        home_obj.calculateRecentForm(recent_scores[match_info_with_ids["home_id"]])
         home_obj.calculatePositionMetrics()
 
-        away_obj.calculateRecentForm(
-            self.fetchRecentScores(match_info_with_ids["away_id"], match_info_with_ids["game_date"]))
+        away_obj.calculateRecentForm(recent_scores[match_info_with_ids["away_id"]])
         away_obj.calculatePositionMetrics()
 
         match_obj = Match(game_date=match_info_with_ids["game_date"], home_team=home_obj, away_team=away_obj)
         return np.array(match_obj.aggregateFeatures())
 
     def trainForPredictions(self, save: bool):
-        if save:
-            save_location = r"C:\Users\Liam\PycharmProjects\football2\model_files\{}-{}.h5".format(
-                self._league, datetime.now().strftime("%Y-%m-%d"))
-        else:
-            save_location = None
+        from analysis.model_runner import ModelRunner  # Training needs TensorFlow, predicting does not
+
+        save_location = MODEL_REGISTRY.modelPath(self._league) if save else None
 
         model = ModelRunner(self._address).train_v0_for_predictions(
-            save_to=save_location)
+            save_to=save_location, league=self._league)
+        if save:
+            MODEL_REGISTRY.register(self._league, feature_version='v0')
 
         self._model = model
 
-    def loadForPredictions(self, location):
-        self._model = ModelRunner().load_v0_NeuralNet(location)
+    def loadForPredictions(self, location=None):
+        """
+        Loads the weights of a saved .h5 model (or its .npz export) for NumPy inference, without TensorFlow. The
+        league's latest registered model is used when no location is given, models are cached by the registry.
+        """
+        self._model = MODEL_REGISTRY.loadFile(location) if location else MODEL_REGISTRY.load(self._league)
 
     def predict(self, features):
         assert self._model
-        probabilities, outcome = self._model.predictOutcome(features[:-1])
-        return probabilities, outcome[0]
+        probabilities, outcomes = self._model.predictBatch(features[:-1])
+        return probabilities[0], outcomes[0]
 
     def bet(self, probabilities, outcome, kelly):
         probability = probabilities[outcome]
         odds = [self._draw_max_odds, self._home_max_odds, self._away_max_odds][outcome]
-        return kelly * (((odds - 1) * probability) - (1 - probability)) / (odds - 1)
+        return kellyStake(probability, odds, kelly)
 
 
 def predictOne():
@@ -303,14 +282,26 @@ def predictOne():
     match_info_with_ids = p.extractLineups(match_info)
     features = p.factory(match_info_with_ids)
     #p.trainForPredictions(save=True)
-    p.loadForPredictions(r"C:\Users\Liam\PycharmProjects\football2\model_files\E1-2021-11-24.h5")
+    p.loadForPredictions()  # Latest E1 model in model_files/
     probabilities, outcome = p.predict(features)
     print(outcome, p.bet(probabilities, outcome, 0.5))
 
 
-def predictMany():
+def predictMany(fixtures, league, season, model_location=None, kelly=0.5):
+    """
+    Predicts and stakes several fixtures of a league-season, given as (link, home_max_odds, draw_max_odds,
+    away_max_odds), with one forward pass over all of them. The league's latest registered model is used by default.
+    """
     address: str = os.environ.get('DB_ADDRESS')  # Address stored in environment
 
+    predictors = [Predict(address, link, league, season, home_max_odds=home_odds, draw_max_odds=draw_odds,
+                          away_max_odds=away_odds) for link, home_odds, draw_odds, away_odds in fixtures]
+    features = np.array([p.factory(p.extractLineups(p.extractMatchInfo())) for p in predictors])
+
+    model = MODEL_REGISTRY.loadFile(model_location) if model_location else MODEL_REGISTRY.load(league)
+    probabilities, outcomes = model.predictBatch(features[:, :-1])
+    return [(outcome, p.bet(match_probabilities, outcome, kelly))
+            for p, match_probabilities, outcome in zip(predictors, probabilities, outcomes)]
 
 
 # Call to main, GCP does this implicitly
@@ -0,0 +1,100 @@
+import logging
+from typing import Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from analysis.dataset_builder import FeatureArrays
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+splitter.py splits FeatureArrays by time, so models are only ever tested on matches played after the ones they were
+trained on. Once the matches are in game date order every split is a contiguous range, so train and test sets are
+slices (views, also of memory-mapped feature store arrays) rather than copies.
+"""
+
+
+def sliceFeatures(features: FeatureArrays, start: int, stop: int) -> FeatureArrays:
+    """
+    Rows start to stop of every column, as views
+    """
+    return FeatureArrays(*(column[start:stop] for column in features))
+
+
+def isDateOrdered(features: FeatureArrays) -> bool:
+    return bool(np.all(features.game_dates[1:] >= features.game_dates[:-1]))
+
+
+class DateSplitter:
+    '''
+    Date-based train/test splits and walk-forward folds over FeatureArrays in game date order.
+    Arrays out of order (e.g. built league by league) are sorted once on construction.
+    '''
+
+    def __init__(self, features: FeatureArrays):
+        if not isDateOrdered(features):
+            logging.info("Sorting {} matches by game date . . .".format(len(features.match_ids)))
+            order = np.argsort(features.game_dates, kind='stable')
+            features = FeatureArrays(*(column[order] for column in features))
+        self._features = features
+
+    def getFeatures(self) -> FeatureArrays:
+        return self._features
+
+    def position(self, date) -> int:
+        """
+        Number of matches played before date
+        """
+        return int(np.searchsorted(self._features.game_dates, np.datetime64(pd.Timestamp(date), 'ns'), side='left'))
+
+    def split(self, cut_date) -> Tuple[FeatureArrays, FeatureArrays]:
+        """
+        Matches before cut_date for training and from cut_date on for testing
+        """
+        cut = self.position(cut_date)
+        return sliceFeatures(self._features, 0, cut), sliceFeatures(self._features, cut, len(self._features.y))
+
+    def splitFraction(self, training_split: float) -> Tuple[FeatureArrays, FeatureArrays]:
+        """
+        The earliest training_split of the matches for training and the rest for testing
+        """
+        cut = round(len(self._features.y) * training_split)
+        return sliceFeatures(self._features, 0, cut), sliceFeatures(self._features, cut, len(self._features.y))
+
+    def walkForward(self, first_test_date, test_months: int = 1,
+                    train_months: int = None) -> Iterator[Tuple[FeatureArrays, FeatureArrays]]:
+        """
+        Rolling folds: each tests on test_months of matches starting at first_test_date and moving forward by
+        test_months, trained on every earlier match (or only the train_months before when given)
+        """
+        test_start = pd.Timestamp(first_test_date)
+        last_date = pd.Timestamp(self._features.game_dates[-1]) if len(self._features.y) else test_start
+        while test_start <= last_date:
+            test_end = test_start + pd.DateOffset(months=test_months)
+            train_start = self.position(test_start - pd.DateOffset(months=train_months)) if train_months else 0
+            start, end = self.position(test_start), self.position(test_end)
+            if end > start:
+                yield sliceFeatures(self._features, train_start, start), sliceFeatures(self._features, start, end)
+            test_start = test_end
+
+
+def batches(features: FeatureArrays, batch_size: int = 32, shuffle: bool = False, repeat: bool = False,
+            seed: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    (x, y) mini-batches of features. Unshuffled batches are views, shuffled ones only copy the rows of one batch at a
+    time. With repeat the generator cycles through the matches forever (reshuffling each pass), as Keras expects
+    when given steps_per_epoch.
+    """
+    rng = np.random.default_rng(seed)
+    size = len(features.y)
+    while True:
+        order = rng.permutation(size) if shuffle else None
+        for start in range(0, size, batch_size):
+            if order is None:
+                yield features.x[start:start + batch_size], features.y[start:start + batch_size]
+            else:
+                rows = np.sort(order[start:start + batch_size])  # Sorted rows read memory maps sequentially
+                yield features.x[rows], features.y[rows]
+        if not repeat:
+            return
@@ -0,0 +1,130 @@
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import analysis.parallel_builder as parallel_builder
+from analysis.dataset_builder import DatasetBuilder, concatenateFeatures
+from analysis.player_table import PlayerTable
+from benchmarks.form_engine import syntheticMatches
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Compares DatasetBuilder.columnarFactory against factory followed by aggregateFeatures, checking that both give the
+same features, labels and odds for the same matches. Synthetic matches are also built league-season by league-season
+through the parallel builder's worker function, which must give the same arrays as one columnarFactory call.
+Matches are read from the database in DB_ADDRESS (league from BENCH_LEAGUE), otherwise BENCH_MATCHES synthetic
+matches with generated squads are used.
+Run from the repository root: python -m benchmarks.columnar_factory
+"""
+
+
+def syntheticBuilder(count, rng):
+    """
+    DatasetBuilder over synthetic matches whose lineups are drawn from generated squads, a few ids unknown
+    """
+    matches = syntheticMatches(count, rng)
+    matches['match_id'] = np.arange(len(matches))
+    matches['league_id'] = matches['home_id'] // 20
+    matches['status'] = 'FT'
+    matches['link'] = ['match/{}'.format(i) for i in range(len(matches))]
+    matches['home_name'], matches['away_name'] = 'home', 'away'
+    for prefix, club_column in [('h', 'home_id'), ('a', 'away_id')]:
+        for i in range(1, 12):
+            matches['{}{}_player_id'.format(prefix, i)] = matches[club_column] * 100 + i
+    matches.loc[rng.random(len(matches)) < 0.01, 'h1_player_id'] = np.nan
+    for column in DatasetBuilder.NUMERIC_ODDS_COLUMNS:
+        matches[column] = np.where(rng.random(len(matches)) < 0.2, np.nan, 1 + 5 * rng.random(len(matches)))
+    for column in ['broker_home_max', 'broker_draw_max', 'broker_away_max']:  # Broker names, as OddsBuilder writes
+        matches[column] = np.where(matches[column.replace('broker_', '')].isna(), None,
+                                   rng.choice(['B365H', 'BWH', 'IWH', 'PSH', 'WHH', 'VCH'], len(matches)))
+
+    builder = DatasetBuilder.__new__(DatasetBuilder)
+    builder._players = PlayerTable()
+    builder._df = matches
+    builder.fetchColumnNames = lambda: DatasetBuilder.MATCH_COLUMNS
+    for league_id in matches['league_id'].unique():
+        builder._players.extend([(club_id * 100 + i, 'player', club_id, int(rng.integers(50, 90)), 0, 'ST', 25, 0,
+                                  'country', 0)
+                                 for club_id in range(league_id * 20, league_id * 20 + 20) for i in range(1, 12)],
+                                league_id)
+    return builder
+
+
+def checkLeagueSeasons(builder):
+    """
+    Whether buildLeagueSeason over every league-season (Aug-Jul) of the synthetic matches, whose broker columns
+    hold broker names, gives the arrays of columnarFactory over all of them
+    """
+    matches = builder._df
+
+    def fetchMatches(league_code=None, start_date=None, end_date=None, **filters):
+        builder._df = matches[(matches['league_id'] == int(league_code)) & (matches['game_date'] >= start_date) &
+                              (matches['game_date'] <= end_date)].reset_index(drop=True)
+
+    builder.fetchMatches = fetchMatches
+    builder.getDataframe = lambda: builder._df
+    parallel_builder._worker_builder = builder
+
+    seasons = []
+    for league_id in np.unique(matches['league_id']):
+        dates = matches.loc[matches['league_id'] == league_id, 'game_date']
+        for year in range(dates.min().year - 1, dates.max().year + 1):
+            first_date, last_date = pd.Timestamp(year, 8, 1), pd.Timestamp(year + 1, 7, 31, 23, 59)
+            if ((dates >= first_date) & (dates <= last_date)).any():
+                seasons.append(parallel_builder.buildLeagueSeason(league_id, str(league_id), first_date, last_date,
+                                                                  {}, 'v0'))
+    builder._df = matches
+    del builder.fetchMatches, builder.getDataframe
+
+    expected, built = builder.columnarFactory(), concatenateFeatures(seasons)
+    order, built_order = np.argsort(expected.match_ids), np.argsort(built.match_ids)
+    return all(np.array_equal(np.asarray(a)[order], np.asarray(b)[built_order], equal_nan=a.dtype.kind == 'f')
+               for a, b in zip(expected, built))
+
+
+def loadBuilder():
+    address = os.environ.get('DB_ADDRESS')
+    if not address:
+        return syntheticBuilder(int(os.environ.get('BENCH_MATCHES', '20000')), np.random.default_rng(0))
+
+    builder = DatasetBuilder(address)
+    builder.fetchMatches(status='FT', players_and_lineups_available=True,
+                         league_code=os.environ.get('BENCH_LEAGUE', 'E0'))
+    return builder
+
+
+def main():
+    builder = loadBuilder()
+    logging.info("{} matches".format(len(builder._df)))
+
+    start = time.perf_counter()
+    match_objects = builder.factory()
+    features = [match.aggregateOddsFeatures() for match in match_objects if not np.isnan(match.getHomeGoals())]
+    object_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    arrays = builder.columnarFactory()
+    columnar_seconds = time.perf_counter() - start
+
+    x = np.array([feature[:-2] for feature in features])
+    y = np.array([feature[-2] for feature in features])
+    odds = [{column: value for column, value in zip(DatasetBuilder.NUMERIC_ODDS_COLUMNS, row)
+             if not np.isnan(value)} for row in arrays.odds]
+
+    logging.info("factory + aggregateFeatures : {:.4f}s".format(object_seconds))
+    logging.info("columnarFactory             : {:.4f}s ({:.0f}x)".format(columnar_seconds,
+                                                                          object_seconds / columnar_seconds))
+    identical = np.array_equal(x, arrays.x, equal_nan=True) and np.array_equal(y, arrays.y) and \
+        odds == [feature[-1] for feature in features]
+    logging.info("Identical features, labels and odds: {}".format(identical))
+
+    if not os.environ.get('DB_ADDRESS'):
+        logging.info("Identical arrays built by league-season: {}".format(checkLeagueSeasons(builder)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from analysis.dataset_builder import DatasetBuilder
+from analysis.form import FormEngine
+from analysis.player import Team
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Compares the FormEngine against the previous per-match DataFrame mask and Team.calculateRecentForm loop, checking
+that both give the same form for every club of every match.
+Matches are read from the database in DB_ADDRESS (league from BENCH_LEAGUE), otherwise BENCH_MATCHES synthetic
+matches are generated across several leagues of 20 clubs. The previous approach is quadratic, keep
+BENCH_MATCHES in the thousands.
+Run from the repository root: python -m benchmarks.form_engine
+"""
+
+
+def syntheticMatches(count, rng):
+    """
+    Round of fixtures every week for leagues of 20 clubs, with a few results still unknown
+    """
+    clubs_per_league = 20
+    leagues = max(count // 380, 1)
+    rows = []
+    for league in range(leagues):
+        clubs = np.arange(clubs_per_league) + league * clubs_per_league
+        date = pd.Timestamp('2015-08-08 15:00')
+        while len(rows) < (league + 1) * count // leagues:
+            rng.shuffle(clubs)
+            for home_id, away_id in zip(clubs[::2], clubs[1::2]):
+                rows.append((home_id, away_id, date + pd.Timedelta(hours=int(rng.integers(0, 72))),
+                             float(rng.poisson(1.5)), float(rng.poisson(1.2))))
+            date += pd.Timedelta(days=7)
+
+    matches = pd.DataFrame(rows, columns=['home_id', 'away_id', 'game_date', 'home_goals', 'away_goals'])
+    unknown = rng.random(len(matches)) < 0.01
+    matches.loc[unknown, ['home_goals', 'away_goals']] = np.nan
+    return matches.sort_values('game_date', kind='stable').reset_index(drop=True)
+
+
+def loadMatches():
+    address = os.environ.get('DB_ADDRESS')
+    if not address:
+        return syntheticMatches(int(os.environ.get('BENCH_MATCHES', '5000')), np.random.default_rng(0))
+
+    builder = DatasetBuilder(address)
+    builder.fetchMatches(league_code=os.environ.get('BENCH_LEAGUE', 'E0'))
+    return builder._df
+
+
+def legacyForm(matches):
+    """
+    The per-match lookups previously run by DatasetBuilder.factory
+    """
+    builder = DatasetBuilder.__new__(DatasetBuilder)
+    builder._df = matches
+
+    forms = []
+    for match_tuple in matches.itertuples():
+        for club_id in [match_tuple.home_id, match_tuple.away_id]:
+            team = Team(club_id, None)
+            team.calculateRecentForm(builder.pdFetchRecentScores(club_id, match_tuple.game_date))
+            forms.append(team.getRecentForm())
+    return np.array(forms, dtype=float)
+
+
+def main():
+    matches = loadMatches()
+    logging.info("{} matches".format(len(matches)))
+
+    start = time.perf_counter()
+    legacy = legacyForm(matches)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    home_forms, away_forms = FormEngine(matches).matchForm(matches)
+    engine_seconds = time.perf_counter() - start
+    engine = np.stack([home_forms, away_forms], axis=1).reshape(-1, 2)
+
+    logging.info("mask + calculateRecentForm : {:.4f}s".format(legacy_seconds))
+    logging.info("FormEngine                 : {:.4f}s ({:.0f}x)".format(engine_seconds,
+                                                                        legacy_seconds / engine_seconds))
+    logging.info("Identical form for every club of every match: {}".format(
+        np.array_equal(legacy, engine, equal_nan=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from models.micro_batcher import BatchStats, MicroBatcher
+from models.registry import MODEL_REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Scores BENCH_REQUESTS single-fixture requests with the latest E0 model from threads of increasing concurrency,
+one at a time through NumpyNet.predictBatch and then through a MicroBatcher, and prints the latency and throughput
+of the micro-batches per batch size.
+Run from the repository root: python -m benchmarks.micro_batcher
+"""
+
+
+def main():
+    requests = int(os.environ.get('BENCH_REQUESTS', '4000'))
+    model = MODEL_REGISTRY.load('E0')
+    features = np.random.default_rng(0).normal(65, 8, size=(requests, model.getInputSize())).astype(np.float32)
+
+    start = time.perf_counter()
+    for row in features:
+        model.predictBatch(row)
+    logging.info("One at a time: {:.0f} requests/s".format(requests / (time.perf_counter() - start)))
+
+    for threads in [1, 8, 32, 128]:
+        stats = BatchStats()
+        batcher = MicroBatcher(max_batch_size=64, max_wait=0.002, stats=stats)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            start = time.perf_counter()
+            results = list(executor.map(lambda row: batcher.predict('E0', row), features))
+            seconds = time.perf_counter() - start
+
+        assert np.allclose(np.concatenate(results), model.predictBatch(features)[0], atol=1e-6)
+        logging.info("{} threads: {:.0f} requests/s\n{}".format(threads, requests / seconds, stats.report()))
+
+
+if __name__ == '__main__':
+    main()
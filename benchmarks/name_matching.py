@@ -0,0 +1,122 @@
+import logging
+import os
+import random
+import time
+from difflib import SequenceMatcher
+
+import psycopg2
+
+from database.name_matcher import NameMatcher, normalizeName
+from database.queries import PreparedQueries
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Compares the NameMatcher against the previous difflib scan over every squad name.
+Squads are read from the database in DB_ADDRESS (league/season from BENCH_LEAGUE and BENCH_SEASON), otherwise a
+small built-in squad is used. Queries are squad names rewritten the way soccerway differs from sofifa.
+Run from the repository root: python -m benchmarks.name_matching
+"""
+
+SAMPLE_SQUAD = ["H. Kane", "Son Heung Min", "H. Lloris", "E. Dier", "P. Højbjerg", "S. Reguilón", "L. Moura",
+                "Emerson", "D. Sánchez", "B. Davies", "J. Rodon", "G. Lo Celso", "Bryan Gil", "O. Skipp",
+                "M. Doherty", "D. Alli", "T. Ndombele", "C. Romero", "P. Gollini", "S. Bergwijn", "J. Tanganga",
+                "Lucas Moura", "B. Gil", "H. Winks", "J. Clarke", "D. Scarlett", "H. White", "T. Malachi"]
+
+
+def legacySearchSimilar(name_ids_dict, name):
+    """
+    The scan previously copied across the lineup matcher, refresher and predictor
+    """
+    closest = ("", 0.0)
+    for key in name_ids_dict:
+        similarity = SequenceMatcher(None, key, name).ratio()
+        if closest[1] < similarity:
+            closest = (key, similarity)
+    return name_ids_dict[closest[0]]
+
+
+def perturb(name, rng):
+    """
+    Rewrites a sofifa name the way it tends to appear on soccerway
+    """
+    tokens = normalizeName(name).split()
+    choice = rng.randrange(4)
+    if choice == 0 and len(tokens) > 1:  # word order
+        tokens = tokens[::-1]
+    elif choice == 1:  # accents already stripped, capitalise instead
+        pass
+    elif choice == 2 and len(tokens) > 1:  # initial expanded to a first name
+        tokens[0] = tokens[0] + "ames" if len(tokens[0]) == 1 else tokens[0]
+    else:  # one character dropped
+        word = max(tokens, key=len)
+        position = rng.randrange(len(word))
+        tokens[tokens.index(word)] = word[:position] + word[position + 1:]
+    return ' '.join(token.capitalize() for token in tokens)
+
+
+def loadSquads():
+    address = os.environ.get('DB_ADDRESS')
+    if not address:
+        return [{name: i for i, name in enumerate(SAMPLE_SQUAD)}]
+
+    queries = PreparedQueries(psycopg2.connect(address))
+    rows = queries.fetchall('fetch_player_ids', (os.environ.get('BENCH_LEAGUE', 'E0'),
+                                                  os.environ.get('BENCH_SEASON', '2122')))
+    squads = {}
+    for club_id, player_name, player_id in rows:
+        squads.setdefault(club_id, {})[player_name] = player_id
+    return list(squads.values())
+
+
+def main():
+    rng = random.Random(0)
+    squads = loadSquads()
+    workload = [(squad, perturb(name, rng), player_id) for squad in squads for name, player_id in squad.items()]
+    logging.info("{} squads, {} lineup names".format(len(squads), len(workload)))
+
+    start = time.perf_counter()
+    legacy = [legacySearchSimilar(squad, query) for squad, query, _ in workload]
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matchers = {id(squad): NameMatcher(squad) for squad in squads}
+    matches = [matchers[id(squad)].match(query) for squad, query, _ in workload]
+    matcher_seconds = time.perf_counter() - start
+
+    truth = [player_id for _, _, player_id in workload]
+    agreement = sum(a == b.id for a, b in zip(legacy, matches)) / len(workload)
+    legacy_accuracy = sum(a == t for a, t in zip(legacy, truth)) / len(workload)
+    matcher_accuracy = sum(b.id == t for b, t in zip(matches, truth)) / len(workload)
+
+    logging.info("difflib scan : {:.4f}s, {:.1%} correct".format(legacy_seconds, legacy_accuracy))
+    logging.info("NameMatcher  : {:.4f}s (index build included), {:.1%} correct".format(matcher_seconds,
+                                                                                         matcher_accuracy))
+    logging.info("Agreement with the difflib scan: {:.1%}".format(agreement))
+
+    # One-to-one assignment of whole lineups (11 names per squad at a time)
+    lineups = []
+    for squad in squads:
+        queries = [(query, player_id) for owner, query, player_id in workload if owner is squad]
+        lineups += [(squad, queries[i:i + 11]) for i in range(0, len(queries), 11)]
+
+    start = time.perf_counter()
+    assigned = [matchers[id(squad)].assign([query for query, _ in lineup]) for squad, lineup in lineups]
+    assign_seconds = time.perf_counter() - start
+
+    for lineup_matches in assigned:
+        lineup_ids = [match.id for match in lineup_matches if match is not None]
+        assert len(lineup_ids) == len(set(lineup_ids)), "assign() gave one id to two names"
+
+    pairs = [(match, player_id) for lineup_matches, (_, lineup) in zip(assigned, lineups)
+             for match, (_, player_id) in zip(lineup_matches, lineup)]
+    logging.info("assign()     : {:.4f}s for {} lineups, {:.1%} correct, no duplicate ids".format(
+        assign_seconds, len(lineups), sum(match is not None and match.id == t for match, t in pairs) / len(pairs)))
+
+    scores = sorted(match.score for match in matches)
+    for quantile in [0.01, 0.05, 0.25, 0.5]:
+        logging.info("score p{:<3} {:.3f}".format(int(quantile * 100), scores[int(quantile * (len(scores) - 1))]))
+
+
+if __name__ == '__main__':
+    main()
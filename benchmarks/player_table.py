@@ -0,0 +1,79 @@
+import logging
+import os
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from analysis.player import Player
+from analysis.player_table import POSITIONS, PlayerTable
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Compares the memory and lookup time of a PlayerTable against the previous dict of Player objects per league.
+BENCH_PLAYERS synthetic players are spread over leagues of 600 players.
+Run from the repository root: python -m benchmarks.player_table
+"""
+
+
+def syntheticRows(count, rng):
+    return [(player_id, 'Player {}'.format(player_id), player_id // 30, rng.randint(45, 94), rng.randint(45, 95),
+             rng.choice(POSITIONS), rng.randint(16, 40), rng.randint(10000, 100000000), 'Country', rng.randint(900, 2300))
+            for player_id in range(1, count + 1)]
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, seconds
+
+
+def main():
+    rows = syntheticRows(int(os.environ.get('BENCH_PLAYERS', '65000')), random.Random(0))
+    leagues = {}
+    for row in rows:
+        leagues.setdefault(row[0] // 600, []).append(row)
+
+    def buildDicts():
+        return {league_id: {row[0]: Player(*row) for row in league_rows} for league_id, league_rows in leagues.items()}
+
+    def buildTable():
+        table = PlayerTable()
+        for league_id, league_rows in leagues.items():
+            table.extend(league_rows, league_id)
+        return table
+
+    dicts, dict_bytes, dict_seconds = measure(buildDicts)
+    table, table_bytes, table_seconds = measure(buildTable)
+    logging.info("{} players in {} leagues".format(len(rows), len(leagues)))
+    logging.info("Player dicts : {:.1f} MB, built in {:.3f}s".format(dict_bytes / 2 ** 20, dict_seconds))
+    logging.info("PlayerTable  : {:.1f} MB, built in {:.3f}s ({:.1f} MB of numeric columns)".format(
+        table_bytes / 2 ** 20, table_seconds, table.nbytes() / 2 ** 20))
+
+    # Overall ratings of 10k lineups of 22 players
+    rng = np.random.default_rng(0)
+    lineups = rng.integers(1, len(rows) + 1, size=(10000, 22))
+
+    start = time.perf_counter()
+    dict_ratings = np.array([[dicts[player_id // 600][player_id].getOverallRating() for player_id in lineup]
+                             for lineup in lineups])
+    dict_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indices, found = table.lookup(lineups)
+    table_ratings = table.overall_ratings[indices]
+    table_seconds = time.perf_counter() - start
+
+    logging.info("Lineup ratings, dict lookups : {:.4f}s".format(dict_seconds))
+    logging.info("Lineup ratings, PlayerTable  : {:.4f}s, identical: {}".format(
+        table_seconds, found.all() and np.array_equal(dict_ratings, table_ratings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+Measures the cold start of each entry point: every statement is run BENCH_REPEATS times in a fresh interpreter,
+reporting the fastest wall time, the peak RSS and which heavy libraries ended up imported. Entry points whose
+dependencies are not installed are reported with the missing module.
+Run from the repository root: python -m benchmarks.startup
+"""
+
+ENTRY_POINTS = {
+    'analysis.predict': 'import analysis.predict',
+    'analysis.gameweek': 'import analysis.gameweek',
+    'analysis.model_runner': 'import analysis.model_runner',
+    'database.routing': 'import database.routing',
+    'models.NeuralNet': 'import models.NeuralNet',
+    'first prediction': "from models.registry import MODEL_REGISTRY\n"
+                        "MODEL_REGISTRY.load('E0').predictBatch([[70.0, 10.0, 2.0, 68.0, 5.0, -1.0]])",
+}
+
+HEAVY_MODULES = ['tensorflow', 'matplotlib', 'h5py', 'pandas', 'psycopg2', 'flask', 'bs4']
+
+MEASURE = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec(compile({statement!r}, '<entry point>', 'exec'))
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'heavy': [module for module in {heavy!r} if module in sys.modules]}}))
+"""
+
+
+def measure(statement: str):
+    """
+    Result of one cold run of statement, or the last line of its error
+    """
+    process = subprocess.run([sys.executable, '-c', MEASURE.format(statement=statement, heavy=HEAVY_MODULES)],
+                             capture_output=True, text=True)
+    if process.returncode:
+        return process.stderr.strip().splitlines()[-1]
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    repeats = int(os.environ.get('BENCH_REPEATS', '3'))
+    baseline = min((measure('pass') for _ in range(repeats)), key=lambda result: result['seconds'])
+    logging.info("{:<24} {:>8.3f}s {:>8.1f} MB".format('interpreter', baseline['seconds'], baseline['rss_mb']))
+
+    for name, statement in ENTRY_POINTS.items():
+        results = [measure(statement) for _ in range(repeats)]
+        failures = [result for result in results if isinstance(result, str)]
+        if failures:
+            logging.info("{:<24} unavailable: {}".format(name, failures[0]))
+            continue
+        best = min(results, key=lambda result: result['seconds'])
+        logging.info("{:<24} {:>8.3f}s {:>8.1f} MB  imports: {}".format(name, best['seconds'], best['rss_mb'],
+                                                                    ", ".join(best['heavy']) or "-"))
+
+
+if __name__ == '__main__':
+    main()
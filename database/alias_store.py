@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+
+from .match_log import ALIAS, EXACT, FUZZY, UNMATCHED, MatchLog
+from .name_matcher import NameMatcher
+from .queries import PreparedQueries
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+alias_store.py persists the names resolved by fuzzy matching in the name_alias table, so the same raw name from the
+same source is resolved with a dictionary lookup on every later run instead of another similarity search.
+"""
+
+# Sources of raw names, the scope is the squad (club_id) for players and the league_id for clubs
+SOCCERWAY_PLAYER = 'soccerway_player'
+SOCCERWAY_CLUB = 'soccerway_club'
+FOOTBALL_DATA_CLUB = 'football_data_club'
+
+
+class AliasStore:
+    '''
+    Cache of (source, raw_name, scope) -> id backed by the name_alias table.
+    Fuzzy matches scoring at least min_confidence are queued and written back by flush().
+    Every resolution made through the store is recorded in its MatchLog.
+    '''
+
+    DEFAULT_MIN_CONFIDENCE = 0.8
+
+    def __init__(self, queries: PreparedQueries, min_confidence: float = DEFAULT_MIN_CONFIDENCE,
+                 match_log: MatchLog = None):
+        self._queries = queries
+        self._match_log = match_log if match_log is not None else MatchLog()
+        self._min_confidence = min_confidence
+        self._aliases = {}  # (source, raw_name, scope) : id
+        self._loaded = set()  # (source, scope) already read from the DB
+        self._pending = {}  # source : [(raw_name, scope, id, score)]
+        self._lock = threading.Lock()
+
+    def load(self, source: str, scopes):
+        """
+        Reads every alias of source within scopes that has not been loaded yet
+        """
+        with self._lock:
+            scopes = [scope for scope in set(scopes) if scope is not None and (source, scope) not in self._loaded]
+        if not scopes:
+            return
+
+        rows = self._queries.fetchall('fetch_aliases', (source, scopes))
+        with self._lock:
+            for raw_name, scope, target_id in rows:
+                self._aliases[(source, raw_name, scope)] = target_id
+            self._loaded.update((source, scope) for scope in scopes)
+
+    def getMatchLog(self) -> MatchLog:
+        return self._match_log
+
+    def lookup(self, source: str, raw_name: str, scope):
+        return self._aliases.get((source, raw_name, scope))
+
+    def record(self, source: str, raw_name: str, scope, target_id, score: float):
+        """
+        Queues a resolved name to be persisted if it is confident enough
+        """
+        if target_id is None or scope is None or score < self._min_confidence:
+            return
+        with self._lock:
+            if self._aliases.get((source, raw_name, scope)) == target_id:
+                return
+            self._aliases[(source, raw_name, scope)] = target_id
+            self._pending.setdefault(source, []).append((raw_name, scope, target_id, score))
+
+    def resolve(self, source: str, raw_name: str, scope, matcher: NameMatcher):
+        """
+        Id for raw_name from the alias table, falling back to fuzzy matching with matcher
+        """
+        alias = self.lookup(source, raw_name, scope)
+        if alias is not None:
+            self._match_log.record(source, raw_name, scope, alias, None, ALIAS)
+            return alias
+
+        start = time.perf_counter()
+        best = matcher.match(raw_name)
+        seconds = time.perf_counter() - start
+
+        if best is None or best.score < matcher.getThreshold():
+            self._match_log.record(source, raw_name, scope, None, best.score if best else None, UNMATCHED, seconds)
+            return None
+
+        self._match_log.record(source, raw_name, scope, best.id, best.score, FUZZY, seconds)
+        self.record(source, raw_name, scope, best.id, best.score)
+        return best.id
+
+    def resolveLineup(self, source: str, lineup, club_id, matcher: NameMatcher):
+        """
+        Ids for every name of a lineup: squad names and aliases first, then a one-to-one assignment of the remaining
+        names against the rest of the squad so that no player is picked twice
+        """
+        lineup_ids = [self.lookup(source, name, club_id) if name is not None and name not in matcher else None
+                      for name in lineup]
+        for name, lineup_id in zip(lineup, lineup_ids):
+            if lineup_id is not None:
+                self._match_log.record(source, name, club_id, lineup_id, None, ALIAS)
+        remaining = [name if lineup_id is None else None for name, lineup_id in zip(lineup, lineup_ids)]
+
+        taken_ids = [lineup_id for lineup_id in lineup_ids if lineup_id is not None]
+        start = time.perf_counter()
+        matches = matcher.assign(remaining, exclude_ids=taken_ids)
+        fuzzy_names = [name for name in remaining if name is not None and name not in matcher]
+        seconds = (time.perf_counter() - start) / max(len(fuzzy_names), 1)  # Spread over the names needing scores
+
+        for position, match in enumerate(matches):
+            name = remaining[position]
+            if name is None:
+                continue
+            if match is None:
+                self._match_log.record(source, name, club_id, None, None, UNMATCHED, seconds)
+            elif name in matcher:
+                lineup_ids[position] = match.id
+                self._match_log.record(source, name, club_id, match.id, 1.0, EXACT)
+            else:
+                lineup_ids[position] = match.id
+                self._match_log.record(source, name, club_id, match.id, match.score, FUZZY, seconds)
+                self.record(source, name, club_id, match.id, match.score)
+
+        return lineup_ids
+
+    def flush(self):
+        """
+        Writes every queued alias to the name_alias table in one statement per source, then flushes the MatchLog
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for source, aliases in pending.items():
+            raw_names, scopes, target_ids, scores = (list(column) for column in zip(*aliases))
+            self._queries.execute('insert_aliases', (source, raw_names, scopes, target_ids, scores))
+        if pending:
+            self._queries.commit()
+            logging.info("Stored {} new name aliases".format(sum(len(x) for x in pending.values())))
+
+        self._match_log.flush(self._queries)
@@ -1,9 +1,10 @@
 import psycopg2
 import os
 
-def setUpDatabase():
+def setUpDatabase(trigram_matching=False):
     """
-    Creates all tables in database, only called manually
+    Creates all tables in database, only called manually. With trigram_matching the optional trigram.sql migration
+    of the pg_trgm name matching mode is run too, it needs the pg_trgm and btree_gist extensions to be available.
     """
     address: str = os.environ.get('DB_ADDRESS')
     if address is None:
@@ -17,4 +18,6 @@ def setUpDatabase():
     with conn:  # with keyword closes connection after execution
         with conn.cursor() as cursor:
             cursor.execute(open("tables.sql", "r").read())
+            if trigram_matching:
+                cursor.execute(open("trigram.sql", "r").read())
             conn.commit()
@@ -1,10 +1,17 @@
 import logging
+import time
 from concurrent.futures._base import as_completed
 from concurrent.futures.thread import ThreadPoolExecutor
-from difflib import SequenceMatcher
 
 import psycopg2
 
+from .alias_store import AliasStore, SOCCERWAY_CLUB, SOCCERWAY_PLAYER
+from .match_log import ALIAS, EXACT, FUZZY, UNMATCHED
+from .name_matcher import NameMatcher
+from .queries import PreparedQueries
+from .squad_cache import SQUAD_CACHE
+from .trigram_matcher import MATCHING_MODES, PYTHON_MATCHING, TRIGRAM_MATCHING, TrigramMatcher
+
 logging.basicConfig(level = logging.INFO)
 
 
@@ -13,13 +20,27 @@ class MatchTableBuilder:
     This class handles the process of associating the match data found on soccerway with the clubs and players already
     found in the database.
     """
-    def __init__(self, address, league, season):
+
+    # Lineup names scoring below this are left as NULL rather than assigned to an unrelated squad member
+    LINEUP_MATCH_THRESHOLD = 0.35
+
+    def __init__(self, address, league, season, match_mode=PYTHON_MATCHING):
+        if match_mode not in MATCHING_MODES:
+            raise ValueError("Unknown name matching mode: {}".format(match_mode))
+        self._match_mode = match_mode
         self._season = season
         self._league = league
         self._conn = self.connectToDB(address)
-        self._club_ids = self.fetchClubIds()  # Fetch all clubs and their ids in that league
-        self._player_ids = self.fetchPlayerIds()  # Fetch all players from that league
-
+        self._queries = PreparedQueries(self._conn)
+        self._squads = SQUAD_CACHE.get(self._queries, league, season)  # Clubs and players shared across builders
+        self._club_ids = self._squads.club_ids
+        self._player_ids = self._squads.player_ids
+        self._club_matcher = self._squads.clubMatcher()
+        self._league_id = self.selectLeagueID()
+        self._aliases = AliasStore(self._queries)  # Names resolved on previous runs
+        self._aliases.load(SOCCERWAY_CLUB, [self._league_id])
+        self._aliases.load(SOCCERWAY_PLAYER, self._player_ids.keys())
+        self._trigram_matcher = TrigramMatcher(self._queries)  # Used in the pg_trgm matching mode
 
     def connectToDB(self, address : str):
         '''
@@ -50,6 +71,8 @@ class MatchTableBuilder:
                     raise Exception("ERROR: Lineup matching failed with: {}".format(status))
                 counter += 1
 
+        self._aliases.flush()
+
 
     def extractLineups(self, match_info):
         if not len(self._club_ids):  # No club ids
@@ -57,42 +80,10 @@ class MatchTableBuilder:
                             .format(self._season, self._league))
             return 200
 
-        if match_info["home_team"] in self._club_ids:
-            home_id = self._club_ids[match_info["home_team"]]
+        if self._match_mode == TRIGRAM_MATCHING:
+            home_id, away_id, home_lineup_ids, away_lineup_ids = self.resolveInDB(match_info)
         else:
-            # If the home_id can't be matched use string similarity
-            home_id = self.searchSimilar(self._club_ids, match_info["home_team"])
-
-        if match_info["away_team"] in self._club_ids:
-            away_id = self._club_ids[match_info["away_team"]]
-        else:
-            away_id = self.searchSimilar(self._club_ids, match_info["away_team"])
-
-        # HOME
-        home_squad_ids = dict(self._player_ids[home_id])
-        home_lineup_ids = []
-
-        for h_name in match_info["home_lineup"]:
-            if h_name is None:  # If lineup not available
-                home_lineup_ids.append(None)
-            elif h_name in home_squad_ids:
-                home_lineup_ids.append(home_squad_ids[h_name])
-            else:
-                # If the h_name can't be matched use string similarity
-                home_lineup_ids.append(self.searchSimilar(home_squad_ids, h_name))
-
-        # AWAY
-        away_squad_ids = dict(self._player_ids[away_id])
-        away_lineup_ids = []
-
-        for a_name in match_info["away_lineup"]:
-            if a_name is None:  # If lineup not available
-                away_lineup_ids.append(None)
-            elif a_name in away_squad_ids:
-                away_lineup_ids.append(away_squad_ids[a_name])
-            else:
-                away_lineup_ids.append(self.searchSimilar(away_squad_ids, a_name))
-
+            home_id, away_id, home_lineup_ids, away_lineup_ids = self.resolveInPython(match_info)
 
         # Make calls to INSERT to database
         self.insertMatch(home_id, away_id, match_info["game_date"],
@@ -101,51 +92,120 @@ class MatchTableBuilder:
 
         return 200
 
-    def searchSimilar(self, name_ids_dict, name):
+    def resolveInPython(self, match_info):
         """
-        Finds the most similar string to name in name_ids_dict
+        Club and lineup ids by exact name, alias table and then NameMatcher similarity
         """
-        closest = ("", 0.0)
-        for key in name_ids_dict:
-            similarity = SequenceMatcher(None, key, name).ratio()
-            if closest[1] < similarity:
-                closest = (key, similarity)
-        return name_ids_dict[closest[0]]
-
-    def fetchClubIds(self):
-        cursor = self._conn.cursor()
+        if match_info["home_team"] in self._club_ids:
+            home_id = self._club_ids[match_info["home_team"]]
+            self._aliases.getMatchLog().record(SOCCERWAY_CLUB, match_info["home_team"], self._league_id, home_id,
+                                               1.0, EXACT)
+        else:
+            # If the home_id can't be matched use string similarity
+            home_id = self.searchSimilar(self._club_matcher, match_info["home_team"], SOCCERWAY_CLUB, self._league_id)
+
+        if match_info["away_team"] in self._club_ids:
+            away_id = self._club_ids[match_info["away_team"]]
+            self._aliases.getMatchLog().record(SOCCERWAY_CLUB, match_info["away_team"], self._league_id, away_id,
+                                               1.0, EXACT)
+        else:
+            away_id = self.searchSimilar(self._club_matcher, match_info["away_team"], SOCCERWAY_CLUB, self._league_id)
 
-        select_statement = '''SELECT club_name, club_id 
-                              FROM club 
-                              JOIN league ON league.league_id=club.league_id 
-                              WHERE league.league='{}' AND league.season='{}';'''.format(self._league, self._season)
-        cursor.execute(select_statement)
+        # Exact names and aliases first, then one similarity matrix per lineup assigned one-to-one
+        home_lineup_ids = self._aliases.resolveLineup(SOCCERWAY_PLAYER, match_info["home_lineup"], home_id,
+                                                      self.squadMatcher(home_id))
+        away_lineup_ids = self._aliases.resolveLineup(SOCCERWAY_PLAYER, match_info["away_lineup"], away_id,
+                                                      self.squadMatcher(away_id))
 
-        return dict(cursor.fetchall())
+        return home_id, away_id, home_lineup_ids, away_lineup_ids
 
-    def fetchPlayerIds(self):
+    def resolveInDB(self, match_info):
         """
-        Select every player in a given league and group by the club in a dictionary
+        Club and lineup ids by exact name, alias table and then pg_trgm similarity. The clubs and then all unmatched
+        lineup names of the fixture are each resolved with a single query, the names assigned one-to-one. Lineups
+        of clubs that could not be resolved are left unmatched.
         """
-        cursor = self._conn.cursor()
+        match_log = self._aliases.getMatchLog()
+
+        team_names = [match_info["home_team"], match_info["away_team"]]
+        club_ids = [None, None]
+        unmatched = []
+
+        for i, name in enumerate(team_names):
+            if name in self._club_ids:
+                club_ids[i] = self._club_ids[name]
+                match_log.record(SOCCERWAY_CLUB, name, self._league_id, club_ids[i], 1.0, EXACT)
+            elif self._aliases.lookup(SOCCERWAY_CLUB, name, self._league_id) is not None:
+                club_ids[i] = self._aliases.lookup(SOCCERWAY_CLUB, name, self._league_id)
+                match_log.record(SOCCERWAY_CLUB, name, self._league_id, club_ids[i], None, ALIAS)
+            else:
+                unmatched.append(i)
+
+        start = time.perf_counter()
+        matches = self._trigram_matcher.matchClubs([team_names[i] for i in unmatched], self._league_id)
+        seconds = (time.perf_counter() - start) / max(len(unmatched), 1)
+        for i, match in zip(unmatched, matches):
+            if match is not None:  # Both clubs are needed, so no threshold
+                club_ids[i] = match.id
+                match_log.record(SOCCERWAY_CLUB, team_names[i], self._league_id, match.id, match.score, FUZZY, seconds)
+                self._aliases.record(SOCCERWAY_CLUB, team_names[i], self._league_id, match.id, match.score)
+        home_id, away_id = club_ids
+
+        lineups = [(home_id, list(match_info["home_lineup"])), (away_id, list(match_info["away_lineup"]))]
+        lineup_ids = [[None] * len(lineup) for _, lineup in lineups]
+        pending = []  # (side, position, name, club_id)
+
+        for side, (club_id, lineup) in enumerate(lineups):
+            if club_id not in self._player_ids:
+                logging.warning("No squad for club {} of {}, lineup not matched".format(
+                    team_names[side], match_info["link"]))
+                continue
+            squad_ids = dict(self._player_ids[club_id])
+            for position, name in enumerate(lineup):
+                if name is None:  # If lineup not available
+                    continue
+                alias = self._aliases.lookup(SOCCERWAY_PLAYER, name, club_id)
+                if name in squad_ids:
+                    lineup_ids[side][position] = squad_ids[name]
+                    match_log.record(SOCCERWAY_PLAYER, name, club_id, squad_ids[name], 1.0, EXACT)
+                elif alias is not None:
+                    lineup_ids[side][position] = alias
+                    match_log.record(SOCCERWAY_PLAYER, name, club_id, alias, None, ALIAS)
+                else:
+                    pending.append((side, position, name, club_id))
+
+        # Candidates of every pending name in one query, assigned one-to-one around the ids already taken
+        start = time.perf_counter()
+        taken_ids = [player_id for side_ids in lineup_ids for player_id in side_ids if player_id is not None]
+        matches, best_scores = self._trigram_matcher.assignPlayers([name for _, _, name, _ in pending],
+                                                                   [club_id for _, _, _, club_id in pending],
+                                                                   exclude_ids=taken_ids)
+        seconds = (time.perf_counter() - start) / max(len(pending), 1)
+        for (side, position, name, club_id), match, best_score in zip(pending, matches, best_scores):
+            if match is not None:
+                lineup_ids[side][position] = match.id
+                match_log.record(SOCCERWAY_PLAYER, name, club_id, match.id, match.score, FUZZY, seconds)
+                self._aliases.record(SOCCERWAY_PLAYER, name, club_id, match.id, match.score)
+            else:
+                match_log.record(SOCCERWAY_PLAYER, name, club_id, None, best_score, UNMATCHED, seconds)
 
-        select_statement = '''SELECT club.club_id, player.name, player.player_id FROM player
-                                JOIN club ON player.club_id=club.club_id
-                                JOIN league ON league.league_id=club.league_id
-                                WHERE league.season='{}' AND league.league='{}';
-                            '''.format(self._season, self._league)
-        cursor.execute(select_statement)
+        return home_id, away_id, lineup_ids[0], lineup_ids[1]
 
-        query_result_set = cursor.fetchall()
+    def squadMatcher(self, club_id):
+        """
+        NameMatcher over the squad of club_id, indexed once and reused for every fixture of that club
+        """
+        return self._squads.squadMatcher(club_id, self.LINEUP_MATCH_THRESHOLD)
 
-        club_player_ids = {}
-        for club_id, player_name, player_id in query_result_set:
-            if club_id in club_player_ids:
-                club_player_ids[club_id].append((player_name, player_id))
-            else:
-                club_player_ids[club_id] = [(player_name, player_id)]
+    def searchSimilar(self, matcher: NameMatcher, name, source, scope):
+        """
+        Finds the id of name from the alias table, otherwise the most similar name indexed by matcher
+        """
+        return self._aliases.resolve(source, name, scope, matcher)
 
-        return club_player_ids
+    def selectLeagueID(self):
+        league_id = self._queries.fetchone('select_league_id', (self._league, self._season))
+        return league_id[0] if league_id else None
 
     def insertMatch(self, home_id, away_id, game_date, status, link, home_lineup, away_lineup, home_goals, away_goals):
         cursor = self._conn.cursor()
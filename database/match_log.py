@@ -0,0 +1,107 @@
+import logging
+import threading
+from collections import namedtuple
+
+from .queries import PreparedQueries
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+match_log.py records how every club and player name was resolved (exact, alias, fuzzy or not at all) and with which
+score. A run's records are summarised as histograms, and the low-confidence pairs are written to the
+name_match_review table to be checked by hand.
+"""
+
+EXACT = 'exact'
+ALIAS = 'alias'
+FUZZY = 'fuzzy'
+UNMATCHED = 'unmatched'
+
+METHODS = [EXACT, ALIAS, FUZZY, UNMATCHED]
+
+MatchRecord = namedtuple('MatchRecord', ['source', 'name', 'scope', 'chosen_id', 'score', 'method', 'seconds'])
+
+
+class MatchLog:
+    '''
+    Thread-safe collector of MatchRecords for one run
+    '''
+
+    DEFAULT_REVIEW_THRESHOLD = 0.6
+    SCORE_BINS = 10
+
+    def __init__(self, review_threshold: float = DEFAULT_REVIEW_THRESHOLD):
+        self._review_threshold = review_threshold
+        self._records = []
+        self._lock = threading.Lock()
+
+    def record(self, source: str, name: str, scope, chosen_id, score, method: str, seconds: float = 0.0):
+        with self._lock:
+            self._records.append(MatchRecord(source, name, scope, chosen_id, score, method, seconds))
+
+    def getRecords(self):
+        with self._lock:
+            return list(self._records)
+
+    def methodHistogram(self):
+        """
+        method : (resolutions, total seconds spent resolving)
+        """
+        histogram = {method: (0, 0.0) for method in METHODS}
+        for record in self.getRecords():
+            count, seconds = histogram[record.method]
+            histogram[record.method] = (count + 1, seconds + record.seconds)
+        return histogram
+
+    def scoreHistogram(self, method: str = FUZZY):
+        """
+        Counts of the scores of one resolution method in SCORE_BINS equal bins over [0, 1]
+        """
+        counts = [0] * self.SCORE_BINS
+        for record in self.getRecords():
+            if record.method == method and record.score is not None:
+                counts[min(int(record.score * self.SCORE_BINS), self.SCORE_BINS - 1)] += 1
+        return counts
+
+    def lowConfidence(self):
+        """
+        Fuzzy or unmatched records scoring below the review threshold
+        """
+        return [record for record in self.getRecords() if record.method in (FUZZY, UNMATCHED)
+                and (record.score is None or record.score < self._review_threshold)]
+
+    def report(self) -> str:
+        lines = []
+        for method, (count, seconds) in self.methodHistogram().items():
+            lines.append("{:<10} {:>6} names {:.4f}s".format(method, count, seconds))
+        bins = self.scoreHistogram()
+        lines.append("fuzzy scores " + " ".join("[{:.1f}) {}".format(i / self.SCORE_BINS, count)
+                                                for i, count in enumerate(bins)))
+        return "\n".join(lines)
+
+    def flush(self, queries: PreparedQueries):
+        """
+        Logs the run's histograms, writes the low-confidence pairs to name_match_review and starts a new run
+        """
+        review = self.lowConfidence()
+        logging.info("Name resolution:\n" + self.report())
+
+        by_source = {}
+        for record in review:
+            by_source.setdefault(record.source, {})[(record.name, record.scope)] = record
+
+        for source, records in by_source.items():
+            records = [record for record in records.values() if record.scope is not None]
+            if not records:
+                continue
+            queries.execute('insert_match_reviews', (source, [record.name for record in records],
+                                                     [record.scope for record in records],
+                                                     [record.chosen_id for record in records],
+                                                     [record.score for record in records],
+                                                     [record.method for record in records]))
+        if review:
+            queries.commit()
+            logging.info("{} low confidence name matches sent for review".format(len(review)))
+
+        with self._lock:
+            self._records = []
@@ -2,12 +2,14 @@ import logging
 import os
 import random
 import re
-from difflib import SequenceMatcher
 
 import psycopg2
 import requests
 from bs4 import BeautifulSoup
 
+from .alias_store import AliasStore, SOCCERWAY_PLAYER
+from .queries import PreparedQueries
+from .squad_cache import SQUAD_CACHE
 
 # Enables Info logging to be displayed on console
 logging.basicConfig(level=logging.INFO)
@@ -19,9 +21,14 @@ class MatchRefresher:
     they happen.
     '''
 
+    # Lineup names scoring below this are left as NULL rather than assigned to an unrelated squad member
+    LINEUP_MATCH_THRESHOLD = 0.35
+
     def __init__(self, address):
         self._conn = self.connectToDB(address)
-        self._player_ids = {} # Fetch all players from that league
+        self._queries = PreparedQueries(self._conn)
+        self._squads = {}  # club_id : SquadEntry of the club's league-season, from the shared squad cache
+        self._aliases = AliasStore(self._queries)  # Lineup names resolved on previous runs
 
 
     def connectToDB(self, address: str):
@@ -48,7 +55,7 @@ class MatchRefresher:
                             '''
         cursor.execute(select_statement)
         for match_id, home_id, away_id, link, league, season in cursor.fetchall():
-            if (home_id not in self._player_ids) or (away_id not in self._player_ids):
+            if (home_id not in self._squads) or (away_id not in self._squads):
                 self.fetchPlayerIds(season, league)
 
             home_goals, away_goals, home_lineup, away_lineup = self.extractMatchInfo(link)
@@ -56,6 +63,8 @@ class MatchRefresher:
                 home_lineup_ids, away_lineup_ids = self.matchPlayerIds(home_id, away_id, home_lineup, away_lineup)
                 self.updateMatch(match_id, home_goals, away_goals, home_lineup_ids, away_lineup_ids)
 
+        self._aliases.flush()
+
     def updateMatch(self, match_id, home_goals, away_goals, home_lineup_ids, away_lineup_ids):
         values = [match_id, home_goals, away_goals, *home_lineup_ids, *away_lineup_ids]
         cursor = self._conn.cursor()
@@ -177,66 +186,32 @@ class MatchRefresher:
 
         return home_goals, away_goals, home_lineup, away_lineup
 
-    def searchSimilar(self, name_ids_dict, name):
+    def squadMatcher(self, club_id):
         """
-        Finds the most similar string to name in name_ids_dict
+        NameMatcher over the squad of club_id, indexed once and reused for every fixture of that club
         """
-        closest = ("", 0.0)
-        for key in name_ids_dict:
-            similarity = SequenceMatcher(None, key, name).ratio()
-            if closest[1] < similarity:
-                closest = (key, similarity)
-        return name_ids_dict[closest[0]]
+        return self._squads[club_id].squadMatcher(club_id, self.LINEUP_MATCH_THRESHOLD)
 
     def matchPlayerIds(self, home_id, away_id, home_lineup, away_lineup):
-        # HOME
-
-        home_squad_ids = dict(self._player_ids[home_id])
-        home_lineup_ids = []
-
-        for h_name in home_lineup:
-            if h_name is None:  # If lineup not available
-                home_lineup_ids.append(None)
-            elif h_name in home_squad_ids:
-                home_lineup_ids.append(home_squad_ids[h_name])
-            else:
-                # If the h_name can't be matched use string similarity
-                home_lineup_ids.append(self.searchSimilar(home_squad_ids, h_name))
-
-        # AWAY
-        away_squad_ids = dict(self._player_ids[away_id])
-        away_lineup_ids = []
-
-        for a_name in away_lineup:
-            if a_name is None:  # If lineup not available
-                away_lineup_ids.append(None)
-            elif a_name in away_squad_ids:
-                away_lineup_ids.append(away_squad_ids[a_name])
-            else:
-                away_lineup_ids.append(self.searchSimilar(away_squad_ids, a_name))
+        """
+        Exact names and aliases first, then one similarity matrix per lineup assigned one-to-one
+        """
+        home_lineup_ids = self._aliases.resolveLineup(SOCCERWAY_PLAYER, home_lineup, home_id,
+                                                      self.squadMatcher(home_id))
+        away_lineup_ids = self._aliases.resolveLineup(SOCCERWAY_PLAYER, away_lineup, away_id,
+                                                      self.squadMatcher(away_id))
 
         return home_lineup_ids, away_lineup_ids
 
     def fetchPlayerIds(self, season, league):
         """
-        Select every player in a given league and group by the club in a dictionary
+        Every player in a given league grouped by club, from the shared squad cache
         """
-        cursor = self._conn.cursor()
-
-        select_statement = '''SELECT club.club_id, player.name, player.player_id FROM player
-                                JOIN club ON player.club_id=club.club_id
-                                JOIN league ON league.league_id=club.league_id
-                                WHERE league.season='{}' AND league.league='{}';
-                            '''.format(season, league)
-        cursor.execute(select_statement)
-
-        query_result_set = cursor.fetchall()
+        squads = SQUAD_CACHE.get(self._queries, league, season)
+        for club_id in squads.player_ids:
+            self._squads[club_id] = squads
 
-        for club_id, player_name, player_id in query_result_set:
-            if club_id in self._player_ids:
-                self._player_ids[club_id].append((player_name, player_id))
-            else:
-                self._player_ids[club_id] = [(player_name, player_id)]
+        self._aliases.load(SOCCERWAY_PLAYER, squads.player_ids.keys())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,248 @@
+import unicodedata
+from collections import Counter, defaultdict, namedtuple
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+"""
+name_matcher.py is the fuzzy name matching shared by the lineup matcher, match refresher, odds builder and predictor.
+A NameMatcher is built once per squad (or league of clubs). Names are normalised (accents, punctuation, initials and
+word order) and indexed by trigram, so each lookup only scores a short list of candidates instead of every name.
+Lineups are assigned to a squad one-to-one with the same scores, so every threshold applies to both.
+"""
+
+NameMatch = namedtuple('NameMatch', ['name', 'id', 'score'])
+
+
+def normalizeName(name: str) -> str:
+    '''
+    Lower case, accents removed and punctuation replaced by spaces e.g. "Nicolás Otamendi" -> "nicolas otamendi"
+    '''
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    cleaned = ''.join(c if c.isalnum() else ' ' for c in stripped.lower())
+    return ' '.join(cleaned.split())
+
+
+def sortedTokens(normalized: str) -> str:
+    '''
+    Word order independent form e.g. "son heung min" -> "heung min son"
+    '''
+    return ' '.join(sorted(normalized.split()))
+
+
+def initialForm(normalized: str) -> str:
+    '''
+    Every word but the last reduced to its initial e.g. "harry kane" -> "h kane", matching sofifa's "H. Kane"
+    '''
+    tokens = normalized.split()
+    return ' '.join([token[0] for token in tokens[:-1]] + tokens[-1:])
+
+
+def trigrams(normalized: str) -> List[str]:
+    '''
+    Trigrams of each word padded with spaces, so initials still produce one trigram
+    '''
+    grams = []
+    for token in normalized.split():
+        padded = ' {} '.format(token)
+        grams += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    return grams
+
+
+def optimalAssignment(scores: np.ndarray) -> List[Tuple[int, int]]:
+    '''
+    (row, column) pairs of the one-to-one assignment with the highest total score (Hungarian algorithm), pairing
+    every row when there are at least as many columns as rows and every column otherwise
+    '''
+    transposed = scores.shape[0] > scores.shape[1]
+    cost = -(scores.T if transposed else scores)
+    rows, columns = cost.shape
+    u = np.zeros(rows + 1)
+    v = np.zeros(columns + 1)
+    owner = np.zeros(columns + 1, dtype=int)  # 1-based row assigned to each column, 0 when free
+    way = np.zeros(columns + 1, dtype=int)
+
+    for row in range(1, rows + 1):
+        owner[0] = row
+        column = 0
+        minimum = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+        while owner[column]:
+            used[column] = True
+            reduced = cost[owner[column] - 1] - u[owner[column]] - v[1:]
+            improved = ~used[1:] & (reduced < minimum[1:])
+            minimum[1:][improved] = reduced[improved]
+            way[1:][improved] = column
+            next_column = 1 + int(np.argmin(np.where(used[1:], np.inf, minimum[1:])))
+            delta = minimum[next_column]
+            u[owner[used]] += delta
+            v[used] -= delta
+            minimum[~used] -= delta
+            column = next_column
+        while column:
+            owner[column] = owner[way[column]]
+            column = way[column]
+
+    pairs = [(owner[column] - 1, column - 1) for column in range(1, columns + 1) if owner[column]]
+    return [(column, row) for row, column in pairs] if transposed else pairs
+
+
+class NameMatcher:
+    '''
+    Index of names to ids that returns the most similar name for a query.
+    Scores are SequenceMatcher ratios in [0, 1], the best of the raw names, the normalised word-sorted names
+    and the initialised names. resolve() only returns an id when the best score reaches the threshold.
+    '''
+
+    DEFAULT_SHORTLIST = 8
+
+    def __init__(self, name_ids: Dict[str, int], threshold: float = 0.0, shortlist_size: int = DEFAULT_SHORTLIST):
+        self._threshold = threshold
+        self._shortlist_size = shortlist_size
+        self._names = list(name_ids)
+        self._ids = [name_ids[name] for name in self._names]
+        self._exact = dict(name_ids)
+        self._positions = {name: position for position, name in enumerate(self._names)}
+
+        self._sorted = []
+        self._initials = []
+        self._normalized_exact = {}
+        self._index = defaultdict(list)  # trigram : candidate positions
+
+        for position, name in enumerate(self._names):
+            normalized = normalizeName(name)
+            self._sorted.append(sortedTokens(normalized))
+            self._initials.append(initialForm(normalized))
+            self._normalized_exact.setdefault(self._sorted[-1], position)
+            for gram in set(trigrams(normalized)):
+                self._index[gram].append(position)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._exact
+
+    def getThreshold(self) -> float:
+        return self._threshold
+
+    def shortlist(self, normalized: str, excluded: Iterable[int] = ()) -> List[int]:
+        """
+        Positions of the candidates sharing the most trigrams with the query, every candidate if none share any
+        """
+        excluded = set(excluded)
+        counts = Counter()
+        for gram in set(trigrams(normalized)):
+            for position in self._index.get(gram, ()):
+                if position not in excluded:
+                    counts[position] += 1
+
+        if not counts:
+            return [position for position in range(len(self._names)) if position not in excluded]
+        return [position for position, _ in counts.most_common(self._shortlist_size)]
+
+    def match(self, name: str, exclude: Iterable[str] = ()) -> NameMatch:
+        """
+        Best NameMatch for name among the indexed names not in exclude, None when there are no candidates
+        """
+        exclude = set(exclude)
+        if name in self._exact and name not in exclude:
+            return NameMatch(name, self._exact[name], 1.0)
+
+        normalized = normalizeName(name)
+        query_sorted = sortedTokens(normalized)
+
+        position = self._normalized_exact.get(query_sorted)
+        if position is not None and self._names[position] not in exclude:
+            return NameMatch(self._names[position], self._ids[position], 1.0)
+
+        excluded = [position for position, candidate in enumerate(self._names) if candidate in exclude] \
+            if exclude else ()
+        candidates = self.shortlist(normalized, excluded)
+        if not candidates:
+            return None
+
+        best_position, best_score = max(zip(candidates, self.ratios(name, candidates)), key=lambda pair: pair[1])
+        return NameMatch(self._names[best_position], self._ids[best_position], best_score)
+
+    def ratios(self, name: str, positions: List[int]) -> List[float]:
+        """
+        Scores of name against the candidates at positions, the best SequenceMatcher ratio of the raw, normalised
+        word-sorted and initialised forms
+        """
+        normalized = normalizeName(name)
+        # seq2 is cached by SequenceMatcher, so each query form is only analysed once
+        raw_matcher = SequenceMatcher(None)
+        raw_matcher.set_seq2(name)
+        sorted_matcher = SequenceMatcher(None)
+        sorted_matcher.set_seq2(sortedTokens(normalized))
+        initial_matcher = SequenceMatcher(None)
+        initial_matcher.set_seq2(initialForm(normalized))
+
+        scores = []
+        for position in positions:
+            raw_matcher.set_seq1(self._names[position])
+            sorted_matcher.set_seq1(self._sorted[position])
+            initial_matcher.set_seq1(self._initials[position])
+            scores.append(max(raw_matcher.ratio(), sorted_matcher.ratio(), initial_matcher.ratio()))
+        return scores
+
+    def assign(self, names: List[str], exclude_ids: Iterable[int] = (), threshold: float = None) -> List[NameMatch]:
+        """
+        One-to-one assignment of names (e.g. a lineup) to the indexed names, so no two names get the same id.
+        Exact and normalised-exact names are taken first. Each remaining name is scored against its trigram
+        shortlist as in match(), and the pairs are chosen together to maximise the total score. Entries are None for
+        None names, for names left without a candidate and for pairs below the threshold (the matcher's threshold by
+        default).
+        """
+        threshold = self._threshold if threshold is None else threshold
+        exclude_ids = set(exclude_ids)
+        taken = {position for position, id in enumerate(self._ids) if id in exclude_ids}
+        results = [None] * len(names)
+        pending = []
+
+        for i, name in enumerate(names):
+            if name is None:
+                continue
+            position = self._positions.get(name)
+            if position is None:
+                position = self._normalized_exact.get(sortedTokens(normalizeName(name)))
+            if position is not None and position not in taken:
+                results[i] = NameMatch(self._names[position], self._ids[position], 1.0)
+                taken.add(position)
+            else:
+                pending.append(i)
+
+        free = [position for position in range(len(self._names)) if position not in taken]
+        if not pending or not free:
+            return results
+
+        # Pairs off the shortlists or below the threshold score 0 and are never kept
+        columns = {position: column for column, position in enumerate(free)}
+        scores = np.zeros((len(pending), len(free)))
+        eligible = np.zeros(scores.shape, dtype=bool)
+        for row, i in enumerate(pending):
+            candidates = self.shortlist(normalizeName(names[i]), taken)
+            for position, score in zip(candidates, self.ratios(names[i], candidates)):
+                if score >= threshold:
+                    scores[row, columns[position]] = score
+                    eligible[row, columns[position]] = True
+
+        for row, column in optimalAssignment(scores):
+            if eligible[row, column]:
+                position = free[column]
+                results[pending[row]] = NameMatch(self._names[position], self._ids[position],
+                                                  float(scores[row, column]))
+
+        return results
+
+    def resolve(self, name: str, exclude: Iterable[str] = ()):
+        """
+        Id of the most similar name, None if nothing scores at least the threshold
+        """
+        best = self.match(name, exclude)
+        if best is None or best.score < self._threshold:
+            return None
+        return best.id
@@ -1,8 +1,8 @@
 import logging
 import random
 import re
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from difflib import SequenceMatcher
 
 import numpy as np
 import pandas as pd
@@ -10,6 +10,12 @@ import psycopg2
 import requests
 from bs4 import BeautifulSoup
 
+from .alias_store import AliasStore, FOOTBALL_DATA_CLUB
+from .match_log import ALIAS, EXACT, FUZZY
+from .name_matcher import NameMatcher
+from .queries import PreparedQueries
+from .trigram_matcher import MATCHING_MODES, PYTHON_MATCHING, TRIGRAM_MATCHING, TrigramMatcher
+
 # Enables Info logging to be displayed on console
 logging.basicConfig(level = logging.INFO)
 
@@ -18,8 +24,14 @@ class OddsBuilder:
     '''
     This class contains the functionality to add Odds data to the Match table
     '''
-    def __init__(self, address):
+    def __init__(self, address, match_mode=PYTHON_MATCHING):
+        if match_mode not in MATCHING_MODES:
+            raise ValueError("Unknown name matching mode: {}".format(match_mode))
+        self._match_mode = match_mode
         self._conn = self.connectToDB(address)
+        self._queries = PreparedQueries(self._conn)
+        self._aliases = AliasStore(self._queries)  # football-data.co.uk club names resolved on previous runs
+        self._trigram_matcher = TrigramMatcher(self._queries)  # Used in the pg_trgm matching mode
 
 
     def connectToDB(self, address):
@@ -237,25 +249,61 @@ class OddsBuilder:
             if db_club_name in known_anomalies:
                 db_club_ids[known_anomalies[db_club_name]] = db_club_ids.pop(db_club_name)
 
+        match_log = self._aliases.getMatchLog()
+
         # PERFECT NAME MATCHES
         matched_club_ids = {club_name : id for club_name, id in db_club_ids.items() if club_name in clubs_in_csv_file}
+        for club_name, id in matched_club_ids.items():
+            match_log.record(FOOTBALL_DATA_CLUB, club_name, league_id, id, 1.0, EXACT)
 
         # REMAINING CLUBS NEED STRING SIMILARITY MATCHING
         remaining_clubs_in_csv = [x for x in clubs_in_csv_file if x not in matched_club_ids]
         unmatched_club_ids = {club_name: id for club_name, id in db_club_ids.items() if club_name not in matched_club_ids}
 
-        DEBUG_NAME_CONV = {}  # debug dictionary to check which names matched up
+        # NAMES RESOLVED ON PREVIOUS RUNS
+        self._aliases.load(FOOTBALL_DATA_CLUB, [league_id])
+        for csv_name in list(remaining_clubs_in_csv):
+            alias_id = self._aliases.lookup(FOOTBALL_DATA_CLUB, csv_name, league_id)
+            if alias_id is not None and alias_id in unmatched_club_ids.values():
+                matched_club_ids[csv_name] = alias_id
+                remaining_clubs_in_csv.remove(csv_name)
+                match_log.record(FOOTBALL_DATA_CLUB, csv_name, league_id, alias_id, None, ALIAS)
+                unmatched_club_ids = {club_name: id for club_name, id in unmatched_club_ids.items()
+                                      if id != alias_id}
+
+        # IN-DATABASE TRIGRAM MATCHING, the most similar pairs are taken first and each club only once
+        if self._match_mode == TRIGRAM_MATCHING and remaining_clubs_in_csv:
+            start = time.perf_counter()
+            matches = self._trigram_matcher.matchClubs(remaining_clubs_in_csv, league_id)
+            seconds = (time.perf_counter() - start) / len(remaining_clubs_in_csv)
+            ranked = sorted([pair for pair in zip(list(remaining_clubs_in_csv), matches) if pair[1] is not None],
+                            key=lambda pair: pair[1].score, reverse=True)
+            unmatched_ids = set(unmatched_club_ids.values())
+
+            for csv_name, match in ranked:
+                if match.id in unmatched_ids and match.score >= self._trigram_matcher.getThreshold():
+                    matched_club_ids[csv_name] = match.id
+                    remaining_clubs_in_csv.remove(csv_name)
+                    unmatched_ids.discard(match.id)
+                    match_log.record(FOOTBALL_DATA_CLUB, csv_name, league_id, match.id, match.score, FUZZY, seconds)
+                    self._aliases.record(FOOTBALL_DATA_CLUB, csv_name, league_id, match.id, match.score)
+
+            unmatched_club_ids = {club_name: id for club_name, id in unmatched_club_ids.items() if id in unmatched_ids}
+
+        # Indexed once per CSV, names are excluded as they get matched
+        csv_name_matcher = NameMatcher({club_name: club_name for club_name in remaining_clubs_in_csv})
+        taken_csv_names = set()
 
         for unmatched_db_name, id in unmatched_club_ids.items():
-            closest_name = self.findMostSimilarClubName(unmatched_db_name, remaining_clubs_in_csv)
-
-            matched_club_ids[closest_name] = id
-            remaining_clubs_in_csv.remove(closest_name)
+            start = time.perf_counter()
+            closest = self.findMostSimilarClubName(unmatched_db_name, csv_name_matcher, taken_csv_names)
+            seconds = time.perf_counter() - start
 
-            DEBUG_NAME_CONV[unmatched_db_name] = closest_name
-
-        logging.debug(DEBUG_NAME_CONV)
-        print(DEBUG_NAME_CONV)
+            matched_club_ids[closest.name] = id
+            remaining_clubs_in_csv.remove(closest.name)
+            taken_csv_names.add(closest.name)
+            match_log.record(FOOTBALL_DATA_CLUB, closest.name, league_id, id, closest.score, FUZZY, seconds)
+            self._aliases.record(FOOTBALL_DATA_CLUB, closest.name, league_id, id, closest.score)
 
         # Map the team names to their club IDs
         filteredData = filteredData.replace({'HomeTeam': matched_club_ids, 'AwayTeam': matched_club_ids})
@@ -283,26 +331,18 @@ class OddsBuilder:
                 if status:
                     logging.error(status)
 
-    def fetchClubIds(self, league_id):
-        cursor = self._conn.cursor()
+        self._aliases.flush()
 
-        select_statement = '''SELECT club_name, club_id 
-                              FROM club 
-                              JOIN league ON league.league_id=club.league_id 
-                              WHERE league.league_id={};'''.format(league_id)
-        cursor.execute(select_statement)
+    def fetchClubIds(self, league_id):
+        return dict(self._queries.fetchall('fetch_club_ids_by_league_id', (league_id,)))
 
-        return dict(cursor.fetchall())
-
-    def findMostSimilarClubName(self, club_name, club_ids):
-        if not len(club_ids):
-            raise Exception("Cannot do similarity matching when the param:club_ids has length 0")
-        closest = ("", 0.0)
-        for key in club_ids:
-            similarity = SequenceMatcher(None, key, club_name).ratio()
-            if closest[1] < similarity:
-                closest = (key, similarity)
-        return closest[0]
+    def findMostSimilarClubName(self, club_name, matcher: NameMatcher, exclude=()):
+        """
+        NameMatch of the most similar name to club_name indexed by matcher, skipping the names in exclude
+        """
+        if len(matcher) <= len(exclude):
+            raise Exception("Cannot do similarity matching when there are no candidate club names left")
+        return matcher.match(club_name, exclude)
 
     def insertMatches(self, matches):
         cursor = self._conn.cursor()
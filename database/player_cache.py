@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable
+
+from .queries import PreparedQueries
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+player_cache.py holds a process-wide, short-lived cache of player rows shared by every Predict. Lineups are looked up
+a whole list of ids at a time: cached rows are served from memory and all the others are read with one
+fetch_players query. Rows expire after a TTL, so ratings updated by the PlayerScraper are picked up within minutes,
+and the least recently used rows are dropped beyond max_players.
+"""
+
+
+class PlayerCache:
+    '''
+    Thread-safe TTL cache of player_id -> player row (the column order of the Player constructor)
+    '''
+
+    DEFAULT_TTL = 300  # seconds
+    DEFAULT_MAX_PLAYERS = 100000
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_players: int = DEFAULT_MAX_PLAYERS):
+        self._ttl = ttl
+        self._max_players = max_players
+        self._rows = OrderedDict()  # player_id : (expiry time, row), least recently used first
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, queries: PreparedQueries, player_ids: Iterable[int]) -> Dict[int, tuple]:
+        """
+        Rows of the given players that exist, reading the ones not cached (or expired) in a single query
+        """
+        player_ids = {int(player_id) for player_id in player_ids if player_id is not None}
+        now = time.monotonic()
+        rows = {}
+        with self._lock:
+            for player_id in player_ids:
+                entry = self._rows.get(player_id)
+                if entry is not None and entry[0] > now:
+                    self._rows.move_to_end(player_id)
+                    rows[player_id] = entry[1]
+            self._hits += len(rows)
+            self._misses += len(player_ids) - len(rows)
+
+        missing = player_ids - set(rows)
+        if missing:
+            fetched = {row[0]: row[:-1] for row in queries.fetchall('fetch_players', (sorted(missing),))}
+            rows.update(fetched)
+            with self._lock:
+                for player_id, row in fetched.items():
+                    self._rows[player_id] = (now + self._ttl, row)
+                    self._rows.move_to_end(player_id)
+                while len(self._rows) > self._max_players:
+                    self._rows.popitem(last=False)
+        return rows
+
+    def invalidate(self):
+        with self._lock:
+            self._rows.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'players': len(self._rows), 'hits': self._hits, 'misses': self._misses}
+
+
+PLAYER_CACHE = PlayerCache()
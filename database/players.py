@@ -9,6 +9,10 @@ import requests
 from bs4 import BeautifulSoup
 from flask import Flask
 
+from .player_cache import PLAYER_CACHE
+from .queries import PreparedQueries
+from .squad_cache import SQUAD_CACHE
+
 app = Flask(__name__)
 
 # Enables Info logging to be displayed on console
@@ -22,6 +26,7 @@ class PlayerScraper:
 
     def __init__(self, address):
         self._conn = self.connectToDB(address)
+        self._queries = PreparedQueries(self._conn)
 
     def connectToDB(self, address: str):
         '''
@@ -114,6 +119,11 @@ class PlayerScraper:
         # Insert into DB in one go
         self.insertPlayers(dataset)
 
+        # Squads and player rows cached in this process are stale for every league-season scraped
+        for league_code, season, _ in links:
+            SQUAD_CACHE.invalidate(league_code, season)
+        PLAYER_CACHE.invalidate()
+
     def preprocess(self, league_code, season, link):
         """
         This method controls the execution process for each league/season
@@ -207,23 +217,10 @@ class PlayerScraper:
         return players
 
     def selectLeagueID(self, league_code, season):
-        cursor = self._conn.cursor()
-        select_statement = '''SELECT league_id
-                              FROM league
-                              WHERE league.league='{}' AND league.season='{}';'''.format(league_code, season)
-        cursor.execute(select_statement)
-
-        return cursor.fetchone()
+        return self._queries.fetchone('select_league_id', (league_code, season))
 
     def fetchClubIds(self, league_code, season):
-        cursor = self._conn.cursor()
-        select_statement = '''SELECT club_name, club_id 
-                              FROM club 
-                              JOIN league ON league.league_id=club.league_id 
-                              WHERE league.league='{}' AND league.season='{}';'''.format(league_code, season)
-        cursor.execute(select_statement)
-
-        return dict(cursor.fetchall())
+        return dict(self._queries.fetchall('fetch_club_ids', (league_code, season)))
 
     def insertClub(self, club_name, league_id):
         cursor = self._conn.cursor()
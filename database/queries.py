@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+
+import psycopg2
+
+# Enables Info logging to be displayed on console
+logging.basicConfig(level=logging.INFO)
+
+"""
+queries.py holds every named, parameterized statement used by the scrapers and predictors.
+Each statement is sent to Postgres once per connection with PREPARE and afterwards run with EXECUTE,
+so the server plans it a single time and values are never formatted into the SQL text.
+"""
+
+# name : (parameter types, statement using $n placeholders)
+QUERIES = {
+    'select_league_id': (
+        ('varchar', 'varchar'),
+        '''SELECT league_id
+           FROM league
+           WHERE league.league = $1 AND league.season = $2'''),
+
+    'fetch_club_ids': (
+        ('varchar', 'varchar'),
+        '''SELECT club_name, club_id
+           FROM club
+           JOIN league ON league.league_id = club.league_id
+           WHERE league.league = $1 AND league.season = $2'''),
+
+    'fetch_club_ids_by_league_id': (
+        ('integer',),
+        '''SELECT club_name, club_id
+           FROM club
+           WHERE club.league_id = $1'''),
+
+    'fetch_player_ids': (
+        ('varchar', 'varchar'),
+        '''SELECT club.club_id, player.name, player.player_id FROM player
+           JOIN club ON player.club_id = club.club_id
+           JOIN league ON league.league_id = club.league_id
+           WHERE league.league = $1 AND league.season = $2'''),
+
+    'fetch_players': (
+        ('integer[]',),
+        '''SELECT player_id, name, player.club_id, overall_rating, potential_rating,
+                  position, age, value, country, total_rating, club.league_id FROM player
+           JOIN club ON player.club_id = club.club_id
+           WHERE player.player_id = ANY($1)'''),
+
+    'fetch_form_matches': (
+        ('integer[]', 'date', 'date'),
+        '''SELECT home_id, away_id, game_date, home_goals, away_goals
+           FROM match
+           WHERE status = 'FT' AND (home_id = ANY($1) OR away_id = ANY($1))
+             AND game_date >= $2 AND game_date < $3'''),
+
+    'fetch_recent_scores': (
+        ('integer', 'date'),
+        '''SELECT home_id, away_id, home_goals, away_goals
+           FROM match
+           WHERE (home_id = $1 OR away_id = $1)
+             AND game_date >= date_trunc('day', $2::timestamp - interval '1' month)
+             AND game_date < date_trunc('day', $2::timestamp)'''),
+
+    'fetch_clubs_recent_scores': (
+        ('integer[]', 'date'),
+        '''SELECT home_id, away_id, home_goals, away_goals
+           FROM match
+           WHERE (home_id = ANY($1) OR away_id = ANY($1))
+             AND game_date >= date_trunc('day', $2::timestamp - interval '1' month)
+             AND game_date < date_trunc('day', $2::timestamp)'''),
+
+    'match_player_names': (
+        ('varchar[]', 'integer[]', 'integer'),
+        '''SELECT query.position, best.name, best.player_id, best.score
+           FROM unnest($1, $2) WITH ORDINALITY AS query (name, club_id, position)
+           JOIN LATERAL (
+               SELECT player.name, player.player_id, similarity(player.name, query.name) AS score
+               FROM player
+               WHERE player.club_id = query.club_id
+               ORDER BY player.name <-> query.name
+               LIMIT $3) AS best ON TRUE
+           ORDER BY query.position, best.score DESC'''),
+
+    'match_club_names': (
+        ('varchar[]', 'integer'),
+        '''SELECT best.club_name, best.club_id, best.score
+           FROM unnest($1) WITH ORDINALITY AS query (name, position)
+           LEFT JOIN LATERAL (
+               SELECT club.club_name, club.club_id, similarity(club.club_name, query.name) AS score
+               FROM club
+               WHERE club.league_id = $2
+               ORDER BY club.club_name <-> query.name
+               LIMIT 1) AS best ON TRUE
+           ORDER BY query.position'''),
+
+    'fetch_aliases': (
+        ('varchar', 'integer[]'),
+        '''SELECT raw_name, scope, target_id
+           FROM name_alias
+           WHERE source = $1 AND scope = ANY($2)'''),
+
+    'insert_aliases': (
+        ('varchar', 'varchar[]', 'integer[]', 'integer[]', 'real[]'),
+        '''INSERT INTO name_alias (source, raw_name, scope, target_id, score)
+           SELECT $1, payload.raw_name, payload.scope, payload.target_id, payload.score
+           FROM unnest($2, $3, $4, $5) AS payload (raw_name, scope, target_id, score)
+           ON CONFLICT (source, raw_name, scope) DO UPDATE
+           SET target_id = EXCLUDED.target_id, score = EXCLUDED.score'''),
+
+    'insert_match_reviews': (
+        ('varchar', 'varchar[]', 'integer[]', 'integer[]', 'real[]', 'varchar[]'),
+        '''INSERT INTO name_match_review (source, raw_name, scope, candidate_id, score, method)
+           SELECT $1, payload.raw_name, payload.scope, payload.candidate_id, payload.score, payload.method
+           FROM unnest($2, $3, $4, $5, $6) AS payload (raw_name, scope, candidate_id, score, method)
+           ON CONFLICT (source, raw_name, scope) DO UPDATE
+           SET candidate_id = EXCLUDED.candidate_id, score = EXCLUDED.score, method = EXCLUDED.method,
+               logged_at = now()'''),
+
+    'insert_predictions': (
+        ('varchar', 'integer[]', 'real[]', 'real[]', 'real[]', 'smallint[]', 'real[]'),
+        '''INSERT INTO prediction (model, match_id, draw_probability, home_probability, away_probability,
+                                  outcome, stake)
+           SELECT $1, payload.match_id, payload.draw_probability, payload.home_probability,
+                  payload.away_probability, payload.outcome, payload.stake
+           FROM unnest($2, $3, $4, $5, $6, $7)
+                AS payload (match_id, draw_probability, home_probability, away_probability, outcome, stake)
+           ON CONFLICT (match_id, model) DO UPDATE
+           SET draw_probability = EXCLUDED.draw_probability, home_probability = EXCLUDED.home_probability,
+               away_probability = EXCLUDED.away_probability, outcome = EXCLUDED.outcome, stake = EXCLUDED.stake,
+               predicted_at = now()'''),
+}
+
+
+class QueryStats:
+    '''
+    Process-wide call counts and timings for each named query, used to find the hot statements.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._seconds = {}
+
+    def record(self, name: str, elapsed: float):
+        with self._lock:
+            self._calls[name] = self._calls.get(name, 0) + 1
+            self._seconds[name] = self._seconds.get(name, 0.0) + elapsed
+
+    def summary(self):
+        """
+        List of (name, calls, total seconds, mean seconds) ordered by total time spent
+        """
+        with self._lock:
+            rows = [(name, calls, self._seconds[name], self._seconds[name] / calls)
+                    for name, calls in self._calls.items()]
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def report(self) -> str:
+        return "\n".join("{:<32} calls={:<6} total={:.4f}s mean={:.6f}s".format(*row) for row in self.summary())
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self._seconds.clear()
+
+
+QUERY_STATS = QueryStats()
+
+
+class PreparedQueries:
+    '''
+    Runs the statements in QUERIES against a single connection, preparing each one on first use.
+    '''
+
+    def __init__(self, conn, queries=None):
+        self._conn = conn
+        self._queries = QUERIES if queries is None else queries
+        self._prepared = set()  # Names whose PREPARE has run on the connection
+        self._unsure = set()  # Names whose first EXECUTE failed, their PREPARE may or may not have run
+        self._lock = threading.Lock()  # The builders share one connection between threads
+
+    def prepareStatement(self, name: str, escape: bool) -> str:
+        '''
+        PREPARE statement of name, sent ahead of its first EXECUTE on this connection.
+        With escape, % is doubled for a statement formatted with parameters.
+        '''
+        types, statement = self._queries[name]
+        if escape:
+            statement = statement.replace('%', '%%')
+        return 'PREPARE {} ({}) AS {}; '.format(name, ', '.join(types), statement)
+
+    def isPrepared(self, cursor, name: str) -> bool:
+        """
+        Whether the session holds a prepared statement of name, asked after a failed first use
+        """
+        cursor.execute('SELECT 1 FROM pg_prepared_statements WHERE name = %s', (name,))
+        return cursor.fetchone() is not None
+
+    def execute(self, name: str, params=()):
+        """
+        EXECUTE a named statement and return the cursor holding its results. The first use on the connection sends
+        PREPARE and EXECUTE together, so every call is a single round trip.
+        Errors are raised without rolling back: the connection is shared, rolling back is up to the caller.
+        """
+        if name not in self._queries:
+            raise KeyError("Unknown query: {}".format(name))
+
+        cursor = self._conn.cursor()
+        start = time.perf_counter()
+
+        execute_statement = 'EXECUTE {}'.format(name)
+        if params:
+            execute_statement += ' ({})'.format(','.join(['%s'] * len(params)))
+        params = params or None  # Only a statement with parameters is %-formatted
+
+        with self._lock:
+            prepared = name in self._prepared
+        if prepared:
+            try:
+                cursor.execute(execute_statement, params)
+            except psycopg2.errors.InvalidSqlStatementName:
+                with self._lock:  # The session lost the statement, prepare it again on the next call
+                    self._prepared.discard(name)
+                raise
+        else:
+            # Held until the statement is prepared, so no other thread sends a bare EXECUTE of it first
+            with self._lock:
+                if name in self._unsure and self.isPrepared(cursor, name):
+                    self._prepared.add(name)
+                self._unsure.discard(name)
+                if name in self._prepared:
+                    cursor.execute(execute_statement, params)
+                else:
+                    try:
+                        cursor.execute(self.prepareStatement(name, params is not None) + execute_statement, params)
+                    except Exception:
+                        # PREPARE outlives the failed transaction when only the EXECUTE failed
+                        self._unsure.add(name)
+                        raise
+                    self._prepared.add(name)
+
+        QUERY_STATS.record(name, time.perf_counter() - start)
+        return cursor
+
+    def commit(self):
+        self._conn.commit()
+
+    def fetchone(self, name: str, params=()):
+        return self.execute(name, params).fetchone()
+
+    def fetchall(self, name: str, params=()):
+        return self.execute(name, params).fetchall()
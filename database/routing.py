@@ -1,10 +1,16 @@
 import asyncio
+import concurrent.futures
 import json
 import logging
+import math
 import os
 import time
 
-from flask import request, Flask
+import psycopg2
+from flask import request, Flask, jsonify
+
+from analysis.predict import OUTCOMES, Predict, kellyStake
+from models.micro_batcher import BATCH_STATS, DEFAULT_TIMEOUT, MICRO_BATCHER
 
 from .soccerway_link_generator import SWLinkGenerator
 from .create_tables import setUpDatabase
@@ -13,6 +19,9 @@ from .odds import OddsBuilder
 from .players import PlayerScraper
 from .trigger_cloud_run import runner
 from .match_refresher import MatchRefresher
+from .queries import QUERY_STATS, PreparedQueries
+from .squad_cache import SQUAD_CACHE
+from .trigram_matcher import MATCHING_MODES, PYTHON_MATCHING, TRIGRAM_MATCHING
 
 # Enables Info logging to be displayed on console
 logging.basicConfig(level=logging.INFO)
@@ -27,11 +36,11 @@ app = Flask(__name__)
 @app.route("/create-table")
 def createTableRoute():
     """
-    Creates Tables from tables.sql file
+    Creates Tables from tables.sql file, and the trigram indexes of trigram.sql with ?match_mode=trgm
     """
     logging.info("request received on /create-table")
 
-    setUpDatabase()
+    setUpDatabase(trigram_matching=request.args.get('match_mode') == TRIGRAM_MATCHING)
     return "tables created", 200
 
 
@@ -74,6 +83,7 @@ def playerTableBuilder():
     # TIMER DONE
     end = time.time()
     logging.info(str(end - start) + " seconds")
+    logging.info("Query statistics:\n" + QUERY_STATS.report())
 
     return "players inserted", 200
 
@@ -109,6 +119,11 @@ def matchTableBuilder():
 
     leagues = {x["identifier"]: x["link"] for x in league_links}  # e.g. {'E0' : 'soccerway.com/...'}
 
+    # Name matching in Python (default) or in Postgres with pg_trgm
+    match_mode = request.args.get('match_mode') or (request_json or {}).get('match_mode', PYTHON_MATCHING)
+    if match_mode not in MATCHING_MODES:
+        return "Unknown match_mode", 400
+
     # Generate league/season soccerway URLs
     link_generator = SWLinkGenerator(address)
 
@@ -125,12 +140,14 @@ def matchTableBuilder():
         season = parsed_json["season"]
         match_info_list = parsed_json["match_data"]
         # Match scraped club/lineup names with DB values
-        lineup_scraper = MatchTableBuilder(address, league, season)
+        lineup_scraper = MatchTableBuilder(address, league, season, match_mode=match_mode)
         lineup_scraper.runner(match_info_list)
 
     # TIMER DONE
     end = time.time()
     logging.info(str(end - start) + "seconds")
+    logging.info("Query statistics:\n" + QUERY_STATS.report())
+    logging.info("Squad cache: {}".format(SQUAD_CACHE.stats()))
 
 
     return "matches inserted", 200
@@ -158,6 +175,8 @@ def refresh():
     # TIMER DONE
     end = time.time()
     logging.info(str(end - start) + "seconds")
+    logging.info("Query statistics:\n" + QUERY_STATS.report())
+    logging.info("Squad cache: {}".format(SQUAD_CACHE.stats()))
     return "refreshed"
 
 
@@ -189,7 +208,12 @@ def addOddsToMatchTable():
     else:
         return "No or bad parameters were passed", 400
 
-    builder = OddsBuilder(address)
+    # Name matching in Python (default) or in Postgres with pg_trgm
+    match_mode = request.args.get('match_mode') or (request_json or {}).get('match_mode', PYTHON_MATCHING)
+    if match_mode not in MATCHING_MODES:
+        return "Unknown match_mode", 400
+
+    builder = OddsBuilder(address, match_mode=match_mode)
 
     datasets = builder.csvFileLocationRunner([x['link'] for x in country_links])
     builder.writeToDB(datasets)
@@ -200,4 +224,129 @@ def addOddsToMatchTable():
     # TIMER DONE
     end = time.time()
     logging.info(str(end - start) + "seconds")
-    return "odds inserted"
\ No newline at end of file
+    logging.info("Query statistics:\n" + QUERY_STATS.report())
+    return "odds inserted"
+
+
+def validOdds(odds) -> bool:
+    """
+    Whether odds are decimal odds a stake can be placed on, a number above 1
+    """
+    return isinstance(odds, (int, float)) and not isinstance(odds, bool) and math.isfinite(odds) and odds > 1
+
+
+def fixtureFeatures(address, fixture, queries: PreparedQueries = None):
+    """
+    v0 feature vector of a /predict fixture, given directly as "features" or built from its soccerway "link" with
+    queries (a new connection when None)
+    """
+    if 'features' in fixture:
+        return fixture['features']
+    if address is None:
+        raise ValueError("DB address not provided in environment")
+    predictor = Predict(address, fixture['link'], fixture['league'], fixture['season'], fixture['home_odds'],
+                        fixture['draw_odds'], fixture['away_odds'], queries=queries)
+    match_info = predictor.extractMatchInfo()
+    if match_info is None:
+        raise ValueError("Fixture page could not be read")
+    return predictor.factory(predictor.extractLineups(match_info))[:-1]  # The last value is the result
+
+
+@app.route("/predict", methods=['GET', 'POST'])
+def predictFixtures():
+    """
+    DESCRIPTION: Predicts fixtures with the latest model of their league and stakes them with the Kelly criterion.
+    ORDER: A model of each league must be saved in model_files/ (see models/registry.py).
+    TECHNICAL: POST one fixture, a list of fixtures or {"fixtures": [...], "kelly": 0.5}. A fixture has league,
+    home_odds, draw_odds and away_odds, and either its v0 "features" or the soccerway "link" and "season" to build
+    them from. The fixtures of concurrent requests are scored together in micro-batches of one forward pass.
+    """
+    logging.info("request received on /predict")
+
+    # TIMER START
+    start = time.time()
+
+    # ARGUMENTS
+    request_json = request.get_json(silent=True)
+    if isinstance(request_json, list):
+        fixtures, kelly = request_json, 0.5
+    elif isinstance(request_json, dict):
+        fixtures = request_json.get('fixtures', [request_json])
+        kelly = float(request_json.get('kelly', 0.5))
+    else:
+        return "No or bad parameters were passed", 400
+
+    required = ('league', 'home_odds', 'draw_odds', 'away_odds')
+    if not fixtures or not all(isinstance(fixture, dict) and all(key in fixture for key in required) and
+                               ('features' in fixture or ('link' in fixture and 'season' in fixture))
+                               for fixture in fixtures):
+        return "No or bad parameters were passed", 400
+    if not all(validOdds(fixture[odds]) for fixture in fixtures for odds in ('home_odds', 'draw_odds', 'away_odds')):
+        return "Odds must be numbers above 1", 400
+
+    # Features given directly must fit their league's model, leagues without a model are reported per fixture
+    for fixture in fixtures:
+        if 'features' in fixture:
+            try:
+                MICRO_BATCHER.checkFeatures(fixture['league'], fixture['features'])
+            except ValueError as e:
+                return str(e), 400
+            except FileNotFoundError:
+                pass
+
+    address: str = os.environ.get('DB_ADDRESS')  # Address stored in environment
+
+    # Fixtures given by link share one connection and its prepared statements for the request
+    conn = None
+    if address is not None and any('features' not in fixture for fixture in fixtures):
+        try:
+            conn = psycopg2.connect(address)
+        except psycopg2.OperationalError:
+            return "Failed to connect to DB", 500
+    queries = PreparedQueries(conn) if conn is not None else None
+
+    # Queue every fixture first so they share micro-batches
+    futures = []
+    try:
+        for fixture in fixtures:
+            try:
+                futures.append(MICRO_BATCHER.submit(fixture['league'], fixtureFeatures(address, fixture, queries)))
+            except Exception as e:
+                futures.append(e)
+    finally:
+        if conn is not None:
+            conn.close()
+
+    predictions = []
+    for fixture, future in zip(fixtures, futures):
+        try:
+            if isinstance(future, Exception):
+                raise future
+            probabilities = future.result(timeout=DEFAULT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            predictions.append({'league': fixture['league'], 'error': "Timed out"})
+            continue
+        except Exception as e:
+            predictions.append({'league': fixture['league'], 'error': str(e)})
+            continue
+        outcome = int(probabilities.argmax())
+        odds = [fixture['draw_odds'], fixture['home_odds'], fixture['away_odds']][outcome]
+        predictions.append({'league': fixture['league'],
+                            'probabilities': dict(zip(OUTCOMES, probabilities.tolist())),
+                            'outcome': OUTCOMES[outcome],
+                            'stake': kellyStake(float(probabilities[outcome]), float(odds), kelly)})
+
+    # TIMER DONE
+    end = time.time()
+    logging.info(str(end - start) + " seconds")
+    logging.info("Micro-batches:\n" + BATCH_STATS.report())
+    return jsonify({'predictions': predictions}), 200
+
+
+@app.route("/predict/stats")
+def predictionStats():
+    """
+    Latency and throughput of the /predict micro-batches per batch size
+    """
+    return jsonify([dict(zip(['batch_size', 'batches', 'rows', 'mean_latency_seconds', 'rows_per_second'], row))
+                    for row in BATCH_STATS.summary()]), 200
@@ -0,0 +1,148 @@
+import logging
+import threading
+from collections import OrderedDict
+
+from .name_matcher import NameMatcher
+from .queries import PreparedQueries
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+squad_cache.py holds a process-wide cache of league-season squads shared by the MatchTableBuilder, MatchRefresher
+and Predict. Each entry keeps the clubs and players of a league-season grouped by club, together with the
+NameMatchers built over them, so a league-season is queried, grouped and indexed once per process.
+Entries are evicted least recently used first once the cache exceeds its memory budget, and the PlayerScraper
+invalidates the league-seasons it writes to.
+"""
+
+# Rough per-name overhead of the grouped lists, exact-name dicts and trigram indexes, on top of the name itself
+BYTES_PER_NAME = 600
+
+
+class SquadEntry:
+    '''
+    Clubs and squads of one league-season, with lazily built NameMatchers over them
+    '''
+
+    def __init__(self, league, season, club_ids, player_ids):
+        self.league = league
+        self.season = season
+        self.club_ids = club_ids  # club_name : club_id
+        self.player_ids = player_ids  # club_id : [(player_name, player_id)]
+        self._club_matchers = {}  # threshold : NameMatcher over the clubs
+        self._squad_matchers = {}  # (club_id, threshold) : NameMatcher over the squad
+        self._lock = threading.Lock()
+
+    def clubMatcher(self, threshold: float = 0.0) -> NameMatcher:
+        with self._lock:
+            if threshold not in self._club_matchers:
+                self._club_matchers[threshold] = NameMatcher(self.club_ids, threshold=threshold)
+            return self._club_matchers[threshold]
+
+    def squadMatcher(self, club_id, threshold: float = 0.0) -> NameMatcher:
+        """
+        NameMatcher over the squad of club_id, indexed once and reused for every fixture of that club
+        """
+        with self._lock:
+            if (club_id, threshold) not in self._squad_matchers:
+                self._squad_matchers[(club_id, threshold)] = NameMatcher(dict(self.player_ids.get(club_id, [])),
+                                                                         threshold=threshold)
+            return self._squad_matchers[(club_id, threshold)]
+
+    def sizeEstimate(self) -> int:
+        """
+        Approximate bytes held by the entry, counting every name once per matcher built over it
+        """
+        def namesSize(names):
+            return sum(len(name) + BYTES_PER_NAME for name in names)
+
+        with self._lock:
+            club_matchers = len(self._club_matchers)
+            squad_matchers = list(self._squad_matchers)
+
+        size = namesSize(self.club_ids) * (1 + club_matchers)
+        size += sum(namesSize(name for name, _ in squad) for squad in self.player_ids.values())
+        size += sum(namesSize(name for name, _ in self.player_ids.get(club_id, [])) for club_id, _ in squad_matchers)
+        return size
+
+
+class SquadCache:
+    '''
+    Thread-safe LRU of (league, season) -> SquadEntry bounded by an approximate memory budget
+    '''
+
+    DEFAULT_BUDGET = 64 * 1024 * 1024  # bytes
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self._budget = budget
+        self._entries = OrderedDict()  # (league, season) : SquadEntry, least recently used first
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, queries: PreparedQueries, league, season) -> SquadEntry:
+        """
+        Entry of a league-season, read from the database with queries on a miss
+        """
+        key = (league, season)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+
+        entry = self.load(queries, league, season)
+
+        with self._lock:
+            if key in self._entries:  # Loaded by another thread in the meantime, keep the first
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = entry
+            self.evict()
+        return entry
+
+    def load(self, queries: PreparedQueries, league, season) -> SquadEntry:
+        """
+        Select every club and player in a given league and group the players by club
+        """
+        club_ids = dict(queries.fetchall('fetch_club_ids', (league, season)))
+
+        player_ids = {}
+        for club_id, player_name, player_id in queries.fetchall('fetch_player_ids', (league, season)):
+            if club_id in player_ids:
+                player_ids[club_id].append((player_name, player_id))
+            else:
+                player_ids[club_id] = [(player_name, player_id)]
+
+        return SquadEntry(league, season, club_ids, player_ids)
+
+    def evict(self):
+        """
+        Drops least recently used entries until the cache fits its budget, always keeping the newest. Call holding
+        the lock.
+        """
+        while len(self._entries) > 1 and self.sizeEstimate() > self._budget:
+            (league, season), _ = self._entries.popitem(last=False)
+            logging.info("Evicted squads of {} {} from the squad cache".format(league, season))
+
+    def sizeEstimate(self) -> int:
+        return sum(entry.sizeEstimate() for entry in self._entries.values())
+
+    def invalidate(self, league=None, season=None):
+        """
+        Forgets a league-season, or every entry when no league is given
+        """
+        with self._lock:
+            if league is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((league, season), None)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self._hits, 'misses': self._misses,
+                    'bytes': self.sizeEstimate()}
+
+
+SQUAD_CACHE = SquadCache()
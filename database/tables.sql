@@ -79,3 +79,44 @@ CREATE TABLE IF NOT EXISTS match (
         PRIMARY KEY (match_id),
         UNIQUE (home_id, away_id, game_date)
 );
+
+CREATE INDEX IF NOT EXISTS match_game_date_idx ON match (game_date);
+CREATE INDEX IF NOT EXISTS match_status_game_date_idx ON match (status, game_date);
+CREATE INDEX IF NOT EXISTS match_home_id_idx ON match (home_id);
+CREATE INDEX IF NOT EXISTS match_away_id_idx ON match (away_id);
+CREATE INDEX IF NOT EXISTS club_league_id_idx ON club (league_id);
+
+CREATE TABLE IF NOT EXISTS name_alias (
+        source VARCHAR(30),
+        raw_name VARCHAR(100),
+        scope INTEGER,
+        target_id INTEGER,
+        score REAL,
+        PRIMARY KEY (source, raw_name, scope)
+);
+
+CREATE INDEX IF NOT EXISTS player_club_id_idx ON player (club_id);
+
+CREATE TABLE IF NOT EXISTS name_match_review (
+        source VARCHAR(30),
+        raw_name VARCHAR(100),
+        scope INTEGER,
+        candidate_id INTEGER,
+        score REAL,
+        method VARCHAR(10),
+        logged_at TIMESTAMP DEFAULT now(),
+        PRIMARY KEY (source, raw_name, scope)
+);
+
+-- Predictions of upcoming matches written by analysis.gameweek, one row per match and model file
+CREATE TABLE IF NOT EXISTS prediction (
+        match_id INTEGER REFERENCES match(match_id) ON DELETE CASCADE,
+        model VARCHAR(30),
+        draw_probability REAL,
+        home_probability REAL,
+        away_probability REAL,
+        outcome SMALLINT,
+        stake REAL,
+        predicted_at TIMESTAMP DEFAULT now(),
+        PRIMARY KEY (match_id, model)
+);
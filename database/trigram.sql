@@ -0,0 +1,11 @@
+-- Optional migration of the pg_trgm name matching mode (match_mode=trgm), run by /create-table?match_mode=trgm
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+-- GIN indexes of earlier versions, they cannot serve the nearest name of one squad or league
+DROP INDEX IF EXISTS player_name_trgm_idx;
+DROP INDEX IF EXISTS club_name_trgm_idx;
+
+-- Names of one club / league walked in trigram distance order by ORDER BY name <-> query LIMIT 1
+CREATE INDEX IF NOT EXISTS player_club_name_trgm_idx ON player USING gist (club_id, name gist_trgm_ops);
+CREATE INDEX IF NOT EXISTS club_league_name_trgm_idx ON club USING gist (league_id, club_name gist_trgm_ops);
@@ -0,0 +1,102 @@
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+from .name_matcher import NameMatch, optimalAssignment
+from .queries import PreparedQueries
+
+"""
+trigram_matcher.py resolves names inside Postgres with pg_trgm similarity, as an alternative to the Python-side
+NameMatcher. Every unmatched name of a fixture (or CSV) is sent in one set-based query, keeping the VM's CPU free.
+The nearest few players of each lineup name are assigned one-to-one, so no two names of a lineup get one player.
+Requires the pg_trgm and btree_gist extensions and the GiST indexes created by the optional trigram.sql migration,
+so the nearest name of a squad or league is found in distance order (<->) within its club_id / league_id.
+"""
+
+# Name matching modes accepted by MatchTableBuilder and OddsBuilder
+PYTHON_MATCHING = 'python'
+TRIGRAM_MATCHING = 'trgm'
+
+MATCHING_MODES = [PYTHON_MATCHING, TRIGRAM_MATCHING]
+
+
+class TrigramMatcher:
+    '''
+    Batch name resolution with pg_trgm. Scores are trigram similarities in [0, 1], which run lower than
+    SequenceMatcher ratios for the same pair of names, hence the separate threshold.
+    '''
+
+    DEFAULT_THRESHOLD = 0.2
+    DEFAULT_CANDIDATES = 3  # Nearest players of each lineup name considered by the assignment
+
+    def __init__(self, queries: PreparedQueries, threshold: float = DEFAULT_THRESHOLD):
+        self._queries = queries
+        self._threshold = threshold
+
+    def getThreshold(self) -> float:
+        return self._threshold
+
+    def _toMatches(self, rows) -> List[NameMatch]:
+        return [NameMatch(name, target_id, score) if target_id is not None else None
+                for name, target_id, score in rows]
+
+    def playerCandidates(self, names: List[str], club_ids: List[int],
+                         candidates: int = DEFAULT_CANDIDATES) -> List[List[NameMatch]]:
+        """
+        Most similar players (at most candidates, best first) in the squad of club_ids[i] for each names[i], in one
+        query
+        """
+        results = [[] for _ in names]
+        if not names:
+            return results
+        for position, name, player_id, score in self._queries.fetchall('match_player_names',
+                                                                        (list(names), list(club_ids), candidates)):
+            results[position - 1].append(NameMatch(name, player_id, score))
+        return results
+
+    def assignPlayers(self, names: List[str], club_ids: List[int], exclude_ids: Iterable[int] = (),
+                      candidates: int = DEFAULT_CANDIDATES) -> Tuple[List[NameMatch], List[float]]:
+        """
+        One-to-one assignment of names[i] to the squad of club_ids[i] over the candidates of every name, so no two
+        names of a club get the same player (nor one of exclude_ids). The pairs are chosen together to maximise the
+        total similarity, as NameMatcher.assign does. Returns the matches (None below the threshold or without a
+        candidate) and the best candidate score of each name.
+        """
+        options = self.playerCandidates(names, club_ids, candidates)
+        exclude_ids = set(exclude_ids)
+        results = [None] * len(names)
+        best_scores = [max((match.score for match in matches), default=None) for matches in options]
+
+        for club_id in set(club_ids):
+            rows = [i for i, name_club_id in enumerate(club_ids) if name_club_id == club_id]
+            columns = {}  # player_id : column
+            for i in rows:
+                for match in options[i]:
+                    if match.id not in exclude_ids:
+                        columns.setdefault(match.id, len(columns))
+            if not columns:
+                continue
+
+            scores = np.zeros((len(rows), len(columns)))
+            eligible = np.zeros(scores.shape, dtype=bool)
+            matches = {}
+            for row, i in enumerate(rows):
+                for match in options[i]:
+                    if match.id in columns and match.score >= self._threshold:
+                        scores[row, columns[match.id]] = match.score
+                        eligible[row, columns[match.id]] = True
+                        matches[(row, columns[match.id])] = match
+
+            for row, column in optimalAssignment(scores):
+                if eligible[row, column]:
+                    results[rows[row]] = matches[(row, column)]
+
+        return results, best_scores
+
+    def matchClubs(self, names: List[str], league_id: int) -> List[NameMatch]:
+        """
+        Most similar club of league_id for each name, in one query
+        """
+        if not names:
+            return []
+        return self._toMatches(self._queries.fetchall('match_club_names', (list(names), league_id)))
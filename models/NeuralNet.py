@@ -1,34 +1,105 @@
 import logging
+import os
 
-import tensorflow as tf
-from tensorflow import keras
 import numpy as np
 
+from models.numpy_net import exportWeights
+
 logging.basicConfig(level=logging.INFO)
 
 
+def tensorflow():
+    """
+    TensorFlow, imported on first use so that importing this module (e.g. for the type) stays cheap
+    """
+    import tensorflow as tf
+    return tf
+
+
 class NeuralNet:
 
-    def __init__(self):
-        self._model = tf.keras.Sequential([
-            keras.layers.Dense(units=6, input_shape=(6,)),
+    def __init__(self, input_size: int = 6, build: bool = True):
+        self._input_size = input_size  # Width of the feature set, 6 for v0
+        self._model = None
+        if build:
+            self.buildModel()
+
+    @classmethod
+    def fromFile(cls, model_path: str) -> 'NeuralNet':
+        """
+        Loads a saved model without first building a new one for it to replace
+        """
+        nn = cls(build=False)
+        nn.loadModel(model_path)
+        return nn
+
+    def buildModel(self):
+        tf = tensorflow()
+        keras = tf.keras
+        self._model = keras.Sequential([
+            keras.layers.Dense(units=6, input_shape=(self._input_size,)),
             keras.layers.Dense(units=50, activation=tf.nn.leaky_relu),
             keras.layers.Dense(units=25, activation=tf.nn.leaky_relu),
             keras.layers.Dense(units=3, activation=tf.nn.softmax)
         ])
         self._model.summary()  # Outputs schema of model to console
 
-    def compileModel(self, loss_function: str = 'sparse_categorical_crossentropy', metrics: str = 'accuracy'):
+    def compileModel(self, loss_function: str = 'sparse_categorical_crossentropy', metrics: str = 'accuracy',
+                     learning_rate: float = None):
+        """
+        learning_rate defaults to Adam's, lower rates fine-tune a loaded model without undoing its training
+        """
         logging.info("Compiling model . . .")
-        optimizer = tf.keras.optimizers.Adam()
+        optimizer = tensorflow().keras.optimizers.Adam(**({'learning_rate': learning_rate} if learning_rate else {}))
         self._model.compile(optimizer=optimizer,
                             loss=loss_function,
                             metrics=[metrics])
         logging.info("Compilation complete.")
 
-    def fitModel(self, x_train, y_train, epochs):
+    def trainingCallbacks(self, monitor: str, patience: int = None, checkpoint_path: str = None):
+        """
+        Early stopping once monitor has not improved for patience epochs, keeping the best weights, and a checkpoint
+        saved to checkpoint_path after every epoch (only after improving ones with early stopping)
+        """
+        keras = tensorflow().keras
+        callbacks = []
+        if patience is not None:
+            callbacks.append(keras.callbacks.EarlyStopping(monitor=monitor, patience=patience,
+                                                           restore_best_weights=True))
+        if checkpoint_path:
+            os.makedirs(os.path.dirname(checkpoint_path) or '.', exist_ok=True)
+            callbacks.append(keras.callbacks.ModelCheckpoint(checkpoint_path, monitor=monitor,
+                                                             save_best_only=patience is not None))
+        return callbacks
+
+    def fitModel(self, x_train, y_train, epochs, batch_size: int = 32, validation_data=None, patience: int = None,
+                 checkpoint_path: str = None):
+        """
+        Trains for at most epochs, stopping early on the loss of validation_data ((x, y), else the training loss)
+        when patience is given
+        """
+        logging.info("Training . . .")
+        monitor = 'val_loss' if validation_data is not None else 'loss'
+        return self._model.fit(x_train, y_train, epochs=epochs, batch_size=batch_size, validation_data=validation_data,
+                               callbacks=self.trainingCallbacks(monitor, patience, checkpoint_path))
+
+    def fitDataset(self, dataset, epochs: int, validation_dataset=None, patience: int = None,
+                   checkpoint_path: str = None):
+        """
+        Trains from a tf.data.Dataset of (x, y) batches, see models.input_pipeline. Early stopping and checkpoints
+        as in fitModel.
+        """
         logging.info("Training . . .")
-        self._model.fit(x_train, y_train, epochs=epochs, batch_size=32)
+        monitor = 'val_loss' if validation_dataset is not None else 'loss'
+        return self._model.fit(dataset, epochs=epochs, validation_data=validation_dataset,
+                               callbacks=self.trainingCallbacks(monitor, patience, checkpoint_path))
+
+    def fitBatches(self, batches, steps_per_epoch: int, epochs: int):
+        """
+        Trains from a repeating generator of (x, y) mini-batches, e.g. analysis.splitter.batches(..., repeat=True)
+        """
+        logging.info("Training . . .")
+        self._model.fit(batches, steps_per_epoch=steps_per_epoch, epochs=epochs)
 
     def evaluateAccuracy(self, x_test, y_test) -> float:
         logging.info("Evaluating . . .")
@@ -41,24 +112,37 @@ class NeuralNet:
         :param features: NumPy array [10,] feature vector
         :return: Integer of the result [0,1,2]
         """
-        probability = self._model.predict(features.reshape(1, 6))
-        prediction = np.argmax(probability,axis=1)
+        probabilities, predictions = self.predictBatch(features.reshape(1, self._input_size))
+        return probabilities[0], predictions
 
-        return probability[0], prediction
+    def predictBatch(self, features):
+        """
+        Scores every row of an (N, input_size) feature matrix in a single forward pass
+        :return: (N, 3) probabilities and the (N,) predicted results [0,1,2]
+        """
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self._input_size)
+        probabilities = np.asarray(self._model.predict_on_batch(features))
+        return probabilities, np.argmax(probabilities, axis=1)
 
     def saveModel(self, file_name :  str) -> None:
         """
+        Saves the model, and exports the weights of .h5 files for NumPy inference (see models.numpy_net)
         """
         try:
             self._model.save(file_name)
         except OSError as e:
             print("failed creating h5 file:", e)
+            return
+        if file_name.endswith('.h5'):
+            exportWeights(file_name)
 
     def loadModel(self, model_path_dir : str) -> None:
         """
         """
+        tf = tensorflow()
         try:
-            self._model = keras.models.load_model(model_path_dir,
-                                                  custom_objects={'leaky_relu' : tf.nn.leaky_relu})  #Custom object used to use correct activation function
+            self._model = tf.keras.models.load_model(model_path_dir,
+                                                     custom_objects={'leaky_relu' : tf.nn.leaky_relu})  #Custom object used to use correct activation function
+            self._input_size = self._model.input_shape[-1]
         except OSError as e:
             print("failed opening h5 file, maybe doesn't exist", e)
@@ -0,0 +1,75 @@
+from typing import Callable, Iterable, Tuple
+
+import numpy as np
+import tensorflow as tf
+
+from analysis.dataset_builder import FeatureArrays
+
+"""
+input_pipeline.py feeds NeuralNet training with tf.data instead of whole in-memory arrays. Matches are read a chunk
+at a time (e.g. from the feature store's memory maps), shuffled within the chunk and cut into batches, so only one
+chunk has to be in memory. Batches are optionally cached after the first epoch and prefetched while the model
+trains on the previous one. A cached dataset is replayed as the first epoch read it, so its rows are reshuffled
+after the cache instead, through a buffer of SHUFFLE_ROWS rows.
+"""
+
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_CHUNK_ROWS = 65536
+SHUFFLE_BATCHES = 64  # Batches mixed together by the batch-level shuffle
+SHUFFLE_ROWS = 65536  # Rows mixed together by the row-level shuffle of cached datasets
+
+
+def chunkBatches(chunks: Iterable[Tuple[np.ndarray, np.ndarray]], batch_size: int, shuffle: bool,
+                 rng: np.random.Generator = None):
+    """
+    Yields float32/int64 (x, y) batches of each (x, y) chunk, rows shuffled within the chunk by rng
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    for x, y in chunks:
+        x = np.asarray(x, dtype=np.float32)
+        y = np.asarray(y, dtype=np.int64)
+        if shuffle:
+            order = rng.permutation(len(y))
+            x, y = x[order], y[order]
+        for start in range(0, len(y), batch_size):
+            yield x[start:start + batch_size], y[start:start + batch_size]
+
+
+def chunkDataset(make_chunks: Callable[[], Iterable[Tuple[np.ndarray, np.ndarray]]], input_size: int,
+                 batch_size: int = DEFAULT_BATCH_SIZE, shuffle: bool = True, cache: str = None,
+                 seed: int = None) -> tf.data.Dataset:
+    """
+    Dataset of (x, y) batches over the chunks returned by make_chunks, called again for every epoch.
+    cache is None for no caching, '' to cache the batches in memory or a file path to cache them on disk.
+    A seed makes the order of every epoch reproducible, each epoch still getting a different one.
+    """
+    signature = (tf.TensorSpec(shape=(None, input_size), dtype=tf.float32),
+                 tf.TensorSpec(shape=(None,), dtype=tf.int64))
+    if cache is not None:
+        # Generated once in order, the rows are reshuffled every epoch after the cache
+        dataset = tf.data.Dataset.from_generator(lambda: chunkBatches(make_chunks(), batch_size, False),
+                                                 output_signature=signature).cache(cache)
+        if shuffle:
+            dataset = dataset.unbatch().shuffle(SHUFFLE_ROWS, seed=seed, reshuffle_each_iteration=True) \
+                .batch(batch_size)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    rng = np.random.default_rng(seed)  # Shared by every epoch's generator, so each shuffles differently
+    dataset = tf.data.Dataset.from_generator(lambda: chunkBatches(make_chunks(), batch_size, shuffle, rng),
+                                             output_signature=signature)
+    if shuffle:
+        dataset = dataset.shuffle(SHUFFLE_BATCHES, seed=seed, reshuffle_each_iteration=True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def featureDataset(features: FeatureArrays, batch_size: int = DEFAULT_BATCH_SIZE,
+                   chunk_rows: int = DEFAULT_CHUNK_ROWS, shuffle: bool = True, cache: str = None,
+                   seed: int = None) -> tf.data.Dataset:
+    """
+    Dataset of (x, y) batches of FeatureArrays (in memory or memory-mapped), read chunk_rows matches at a time
+    """
+    def makeChunks():
+        for start in range(0, len(features.y), chunk_rows):
+            yield features.x[start:start + chunk_rows], features.y[start:start + chunk_rows]
+
+    return chunkDataset(makeChunks, features.x.shape[1], batch_size, shuffle, cache, seed)
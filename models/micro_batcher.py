@@ -0,0 +1,185 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from models.registry import MODEL_REGISTRY, ModelRegistry
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+micro_batcher.py scores prediction requests from many threads (e.g. concurrent HTTP requests) in shared forward
+passes. Each submitted feature vector is queued and a single worker thread drains the queue into micro-batches of
+up to max_batch_size rows, waiting at most max_wait seconds for a batch to fill. The rows of a batch are grouped by
+league and each group is scored by its league's model from the ModelRegistry with one predictBatch call.
+BATCH_STATS records request latency and scoring throughput per batch size.
+"""
+
+
+class BatchStats:
+    '''
+    Process-wide latency and throughput of micro-batches, bucketed by batch size (1, 2-3, 4-7, ...)
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}  # smallest batch size of the bucket : [batches, rows, scoring seconds, latency seconds]
+
+    def record(self, rows: int, scoring_seconds: float, latency_seconds: float):
+        """
+        Records one batch of rows, scored in scoring_seconds, with the summed queue-to-result latency of its rows
+        """
+        bucket = 1 << (rows.bit_length() - 1)
+        with self._lock:
+            totals = self._buckets.setdefault(bucket, [0, 0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += rows
+            totals[2] += scoring_seconds
+            totals[3] += latency_seconds
+
+    def summary(self):
+        """
+        List of (batch sizes, batches, rows, mean latency seconds, rows scored per second) by batch size
+        """
+        with self._lock:
+            buckets = sorted((bucket, list(totals)) for bucket, totals in self._buckets.items())
+        return [("{}-{}".format(bucket, 2 * bucket - 1) if bucket > 1 else "1", batches, rows, latency / rows,
+                 rows / scoring if scoring > 0 else float('inf'))
+                for bucket, (batches, rows, scoring, latency) in buckets]
+
+    def report(self) -> str:
+        return "\n".join("batch={:<10} batches={:<6} rows={:<8} latency={:.6f}s throughput={:.0f} rows/s".format(*row)
+                         for row in self.summary())
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+BATCH_STATS = BatchStats()
+
+DEFAULT_TIMEOUT = 10  # seconds a caller waits for its result
+
+
+class MicroBatcher:
+    '''
+    Collects feature vectors submitted from any thread into micro-batches scored on one worker thread
+    '''
+
+    def __init__(self, registry: ModelRegistry = MODEL_REGISTRY, max_batch_size: int = 64, max_wait: float = 0.005,
+                 stats: BatchStats = BATCH_STATS):
+        self._registry = registry
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait  # seconds
+        self._stats = stats
+        self._queue = queue.Queue()  # (league, features, Future, submit time)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self.run, name='micro-batcher', daemon=True)
+                self._worker.start()
+
+    def checkFeatures(self, league: str, features) -> np.ndarray:
+        """
+        features as a float32 vector, ValueError when it is not one vector of the width of league's latest model
+        """
+        try:
+            features = np.asarray(features, dtype=np.float32)
+        except (TypeError, ValueError):
+            raise ValueError("features of {} must be a list of numbers".format(league))
+        input_size = self._registry.load(league).getInputSize()
+        if features.ndim != 1 or len(features) != input_size:
+            raise ValueError("{} features given, the {} model takes {}".format(features.size, league, input_size))
+        return features
+
+    def submit(self, league: str, features) -> Future:
+        """
+        Queues one feature vector for league's latest model, the Future resolves to its 3 outcome probabilities.
+        Vectors of the wrong width raise ValueError here rather than joining a batch.
+        """
+        features = self.checkFeatures(league, features)
+        self.start()
+        future = Future()
+        self._queue.put((league, features, future, time.perf_counter()))
+        return future
+
+    def predict(self, league: str, features, timeout: float = DEFAULT_TIMEOUT) -> np.ndarray:
+        """
+        (N, 3) probabilities of the rows of features, scored together with whatever else is queued
+        """
+        futures = [self.submit(league, row) for row in np.atleast_2d(features)]
+        return np.array([future.result(timeout=timeout) for future in futures])
+
+    def nextBatch(self):
+        """
+        Blocks for a request, then collects more until the batch is full or max_wait has passed since the first
+        """
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def score(self, batch):
+        """
+        Scores the rows of a batch with one forward pass per league and resolves their Futures
+        """
+        start = time.perf_counter()
+        leagues = {}
+        for item in batch:
+            leagues.setdefault(item[0], []).append(item)
+
+        for league, items in leagues.items():
+            try:
+                model = self._registry.load(league)
+            except Exception as e:  # Missing model, ... fail only this league's requests
+                for item in items:
+                    item[2].set_exception(e)
+                continue
+
+            # The model may have been swapped for one of another width since the rows were checked on submit
+            valid = []
+            for item in items:
+                if len(item[1]) == model.getInputSize():
+                    valid.append(item)
+                else:
+                    item[2].set_exception(ValueError("{} features given, the {} model takes {}".format(
+                        len(item[1]), league, model.getInputSize())))
+            if not valid:
+                continue
+
+            try:
+                probabilities, _ = model.predictBatch(np.stack([item[1] for item in valid]))
+            except Exception as e:
+                for item in valid:
+                    item[2].set_exception(e)
+                continue
+            for item, row in zip(valid, probabilities):
+                item[2].set_result(row)
+
+        finish = time.perf_counter()
+        self._stats.record(len(batch), finish - start, sum(finish - item[3] for item in batch))
+
+    def run(self):
+        while True:
+            batch = self.nextBatch()
+            try:
+                self.score(batch)
+            except Exception as e:
+                logging.error("Micro-batch failed: {}".format(e))
+                for item in batch:
+                    if not item[2].done():
+                        item[2].set_exception(e)
+
+
+MICRO_BATCHER = MicroBatcher()
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import sys
+from typing import List, Tuple
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+numpy_net.py serves the saved dense models without TensorFlow. exportWeights reads the kernel and bias of every
+Dense layer (and its activation) out of a Keras .h5 file with h5py and writes them to a small .npz file, and NumpyNet
+runs the forward pass on those arrays in NumPy. NumpyNet has the predictBatch/predictOutcome interface of NeuralNet,
+so prediction code can use either.
+Export from the repository root: python -m models.numpy_net model_files/E0-2021-09-23.h5
+"""
+
+LEAKY_RELU_ALPHA = 0.2  # Default alpha of tf.nn.leaky_relu, used by NeuralNet
+
+
+def linear(x):
+    return x
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def leakyRelu(x):
+    return np.where(x > 0, x, x * np.float32(LEAKY_RELU_ALPHA))
+
+
+def softmax(x):
+    exponentials = np.exp(x - x.max(axis=1, keepdims=True))
+    return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+
+# Keras activation names as saved in model_config
+ACTIVATIONS = {'linear': linear, 'relu': relu, 'leaky_relu': leakyRelu, 'softmax': softmax}
+
+
+def readH5Weights(h5_path: str) -> Tuple[List[np.ndarray], List[np.ndarray], List[str]]:
+    """
+    Kernels, biases and activation names of the Dense layers of a Keras .h5 model, in layer order
+    """
+    import h5py  # Only needed for .h5 files, serving from .npz exports does not import it
+
+    kernels, biases, activations = [], [], []
+    with h5py.File(h5_path, 'r') as h5_file:
+        config = json.loads(h5_file.attrs['model_config'])
+        weights = h5_file['model_weights']
+        for layer in config['config']['layers']:
+            if layer['class_name'] != 'Dense':
+                continue
+            name = layer['config']['name']
+            activation = layer['config']['activation']
+            if activation not in ACTIVATIONS:
+                raise ValueError("Unsupported activation {} in layer {}".format(activation, name))
+            kernels.append(weights[name][name]['kernel:0'][()])
+            biases.append(weights[name][name]['bias:0'][()])
+            activations.append(activation)
+    return kernels, biases, activations
+
+
+def exportWeights(h5_path: str, npz_path: str = None) -> str:
+    """
+    Writes the Dense layers of a Keras .h5 model to an .npz file (next to it by default) and returns its path
+    """
+    npz_path = npz_path or os.path.splitext(h5_path)[0] + '.npz'
+    kernels, biases, activations = readH5Weights(h5_path)
+    arrays = {}
+    for i, (kernel, bias) in enumerate(zip(kernels, biases)):
+        arrays['kernel_{}'.format(i)] = kernel
+        arrays['bias_{}'.format(i)] = bias
+    np.savez(npz_path, activations=np.array(activations), **arrays)
+    logging.info("Exported {} layers of {} to {}".format(len(kernels), h5_path, npz_path))
+    return npz_path
+
+
+class NumpyNet:
+    '''
+    Forward pass of an exported dense model in NumPy
+    '''
+
+    def __init__(self, kernels: List[np.ndarray], biases: List[np.ndarray], activations: List[str]):
+        self._kernels = [np.asarray(kernel, dtype=np.float32) for kernel in kernels]
+        self._biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+        self._activations = [ACTIVATIONS[activation] for activation in activations]
+        self._input_size = self._kernels[0].shape[0]
+
+    @classmethod
+    def load(cls, path: str) -> 'NumpyNet':
+        """
+        Loads an exported .npz file, or the weights of a Keras .h5 file directly
+        """
+        if path.endswith('.h5'):
+            return cls(*readH5Weights(path))
+        with np.load(path) as arrays:
+            layers = len(arrays['activations'])
+            return cls([arrays['kernel_{}'.format(i)] for i in range(layers)],
+                       [arrays['bias_{}'.format(i)] for i in range(layers)],
+                       [str(activation) for activation in arrays['activations']])
+
+    def getInputSize(self) -> int:
+        return self._input_size
+
+    def nbytes(self) -> int:
+        return sum(kernel.nbytes + bias.nbytes for kernel, bias in zip(self._kernels, self._biases))
+
+    def predictBatch(self, features):
+        """
+        Scores every row of an (N, input_size) feature matrix
+        :return: (N, 3) probabilities and the (N,) predicted results [0,1,2]
+        """
+        outputs = np.asarray(features, dtype=np.float32).reshape(-1, self._input_size)
+        for kernel, bias, activation in zip(self._kernels, self._biases, self._activations):
+            outputs = activation(outputs @ kernel + bias)
+        return outputs, np.argmax(outputs, axis=1)
+
+    def predictOutcome(self, features):
+        probabilities, predictions = self.predictBatch(features)
+        return probabilities[0], predictions
+
+
+if __name__ == '__main__':
+    for model_path in sys.argv[1:]:
+        exportWeights(model_path)
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from typing import List
+
+from models.numpy_net import NumpyNet, exportWeights
+
+logging.basicConfig(level=logging.INFO)
+
+"""
+registry.py indexes the saved models of model_files/ by league and training date, read from file names such as
+E0-2021-09-23.h5 (and the .npz export next to it). Metadata (feature version, accuracy, ...) is kept in a JSON
+sidecar of the same name, models saved without one are v0 models.
+Models are served from the .npz export, which is exported again when its .h5 is saved after it.
+Loaded models are kept in a process-wide LRU bounded by a memory budget. Asking for a league's latest model picks up
+a newer file as soon as it is saved, and a file saved again under the same name is reloaded, so serving processes
+swap models without a restart.
+"""
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODEL_DIR = os.environ.get('MODEL_DIR', os.path.join(REPOSITORY_ROOT, 'model_files'))
+
+MODEL_FILE = re.compile(r'^(?P<league>[A-Za-z0-9]+)-(?P<date>\d{4}-\d{2}-\d{2})\.(?P<extension>h5|npz|json)$')
+
+# Metadata of models saved before sidecars were written
+DEFAULT_META = {'feature_version': 'v0'}
+
+# One saved model: h5_path/npz_path are None when that file does not exist
+ModelEntry = namedtuple('ModelEntry', ['league', 'trained_date', 'h5_path', 'npz_path', 'meta'])
+
+
+class ModelRegistry:
+    '''
+    Thread-safe index of the models saved in a directory, with an LRU of loaded NumpyNets bounded by a memory budget
+    '''
+
+    DEFAULT_BUDGET = 16 * 1024 * 1024  # bytes
+
+    def __init__(self, directory: str = DEFAULT_MODEL_DIR, budget: int = DEFAULT_BUDGET):
+        self._directory = directory
+        self._budget = budget
+        self._index = {}  # league : [ModelEntry] oldest first
+        self._index_mtime = None  # Directory mtime when indexed, files added since change it
+        self._models = OrderedDict()  # path : (file mtime, NumpyNet), least recently used first
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def getDirectory(self) -> str:
+        return self._directory
+
+    def scan(self):
+        """
+        Re-indexes the directory if files were added or removed since the last scan
+        """
+        try:
+            mtime = os.stat(self._directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        with self._lock:
+            if mtime is not None and mtime == self._index_mtime:
+                return
+
+        files = {}  # (league, date) : {extension : path}
+        for file_name in (os.listdir(self._directory) if mtime is not None else []):
+            match = MODEL_FILE.match(file_name)
+            if match:
+                files.setdefault((match.group('league'), match.group('date')), {})[match.group('extension')] = \
+                    os.path.join(self._directory, file_name)
+
+        index = {}
+        for (league, trained_date), paths in sorted(files.items()):
+            if 'h5' not in paths and 'npz' not in paths:
+                continue  # Sidecar of a deleted model
+            meta = dict(DEFAULT_META)
+            if 'json' in paths:
+                with open(paths['json']) as meta_file:
+                    meta.update(json.load(meta_file))
+            index.setdefault(league, []).append(ModelEntry(league, trained_date, paths.get('h5'), paths.get('npz'),
+                                                           meta))
+
+        with self._lock:
+            self._index = index
+            self._index_mtime = mtime
+
+    def entries(self, league: str = None) -> List[ModelEntry]:
+        """
+        Saved models of league (of every league when None), oldest first
+        """
+        self.scan()
+        with self._lock:
+            if league is not None:
+                return list(self._index.get(league, []))
+            return [entry for league_entries in self._index.values() for entry in league_entries]
+
+    def latest(self, league: str, before=None) -> ModelEntry:
+        """
+        Most recently trained model of league, only of those trained before the date before when given. None when
+        there is none.
+        """
+        entries = self.entries(league)
+        if before is not None:
+            before = str(before)[:10]
+            entries = [entry for entry in entries if entry.trained_date < before]
+        return entries[-1] if entries else None
+
+    def find(self, league: str, trained_date=None) -> ModelEntry:
+        """
+        Model of league trained on trained_date, the latest when None. FileNotFoundError when it is not saved.
+        """
+        if trained_date is None:
+            entry = self.latest(league)
+        else:
+            entry = next((entry for entry in self.entries(league) if entry.trained_date == str(trained_date)[:10]),
+                         None)
+        if entry is None:
+            raise FileNotFoundError("No model of {} {} in {}".format(league, trained_date or '', self._directory))
+        return entry
+
+    def modelPath(self, league: str, trained_date=None) -> str:
+        """
+        .h5 path to save a model of league trained on trained_date (today by default) to
+        """
+        trained_date = str(trained_date)[:10] if trained_date else datetime.now().strftime("%Y-%m-%d")
+        return os.path.join(self._directory, "{}-{}.h5".format(league, trained_date))
+
+    def register(self, league: str, trained_date=None, **meta) -> str:
+        """
+        Writes the metadata sidecar of a saved model, e.g. register('E0', feature_version='v0', accuracy=0.56)
+        """
+        path = os.path.splitext(self.modelPath(league, trained_date))[0] + '.json'
+        with open(path + '.tmp', 'w') as meta_file:
+            json.dump(dict(DEFAULT_META, **meta), meta_file, indent=2, default=str)
+        os.replace(path + '.tmp', path)
+        self.scan()
+        return path
+
+    def load(self, league: str, trained_date=None) -> NumpyNet:
+        """
+        NumpyNet of a saved model of league (the latest when trained_date is None), loaded once and then cached
+        """
+        return self.loadFile(self.servedPath(self.find(league, trained_date)))
+
+    def servedPath(self, entry: ModelEntry) -> str:
+        """
+        File to serve an entry from: its .npz export, exported again first when the .h5 was saved after it (e.g.
+        by something other than NeuralNet.saveModel), or the .h5 when there is no export. An export that fails (h5py
+        missing, .h5 still being written, ...) keeps serving the previous one and is retried on the next load.
+        """
+        if entry.npz_path is None:
+            return entry.h5_path
+        if entry.h5_path is None or os.stat(entry.h5_path).st_mtime_ns <= os.stat(entry.npz_path).st_mtime_ns:
+            return entry.npz_path
+
+        logging.info("{} is newer than its export, exporting it again . . .".format(entry.h5_path))
+        temporary_path = entry.npz_path + '.tmp.npz'  # np.savez only writes names ending in .npz
+        try:
+            exportWeights(entry.h5_path, temporary_path)
+            os.replace(temporary_path, entry.npz_path)
+        except Exception as e:
+            logging.warning("Failed to export {}, serving the previous export: {}".format(entry.h5_path, e))
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        return entry.npz_path
+
+    def loadFile(self, path: str) -> NumpyNet:
+        """
+        NumpyNet of an .h5 or .npz file, cached until evicted or the file is saved again
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            if path in self._models and self._models[path][0] == mtime:
+                self._models.move_to_end(path)
+                self._hits += 1
+                return self._models[path][1]
+            self._misses += 1
+
+        logging.info("Loading model {} . . .".format(path))
+        model = NumpyNet.load(path)
+
+        with self._lock:
+            self._models[path] = (mtime, model)
+            self._models.move_to_end(path)
+            self.evict()
+        return model
+
+    def evict(self):
+        """
+        Drops least recently used models until the cache fits its budget, always keeping the newest. Call holding
+        the lock.
+        """
+        while len(self._models) > 1 and self.sizeEstimate() > self._budget:
+            path, _ = self._models.popitem(last=False)
+            logging.info("Evicted {} from the model cache".format(path))
+
+    def sizeEstimate(self) -> int:
+        return sum(model.nbytes() for _, model in self._models.values())
+
+    def invalidate(self):
+        """
+        Forgets every loaded model and the index
+        """
+        with self._lock:
+            self._models.clear()
+            self._index_mtime = None
+
+    def stats(self):
+        with self._lock:
+            return {'models': len(self._models), 'hits': self._hits, 'misses': self._misses,
+                    'bytes': self.sizeEstimate()}
+
+
+MODEL_REGISTRY = ModelRegistry()